@@ -0,0 +1,44 @@
+from collections import defaultdict
+from typing import Dict
+
+from chain import TipIndex
+
+
+class AccountState(TipIndex):
+    """
+    Balance index for one chain tip.
+
+    Instead of walking the whole chain for every balance query, we keep the balance of every address
+    as of self.tip, and update it block by block as the tip moves (see TipIndex.move_to).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._balances: Dict[str, int] = defaultdict(int)
+
+    def reset(self, tip, balances: Dict[str, int]) -> None:
+        # Start from known balances as of tip (e.g. from a Snapshot), instead of replaying the chain up to it
+        self.tip = tip
+        self._balances = defaultdict(int, balances)
+
+    def balance(self, address) -> int:
+        return self._balances.get(address, 0)
+
+    def balances(self) -> Dict[str, int]:
+        return dict(self._balances)
+
+    def apply_block(self, block) -> None:
+        for signed_transaction in block.signed_transactions:
+            transaction = signed_transaction.transaction
+            if transaction.from_address is not None:
+                self._balances[transaction.from_address] -= transaction.coins
+            self._balances[transaction.to_address] += transaction.coins
+        self.tip = block
+
+    def undo_block(self, block) -> None:
+        for signed_transaction in reversed(block.signed_transactions):
+            transaction = signed_transaction.transaction
+            if transaction.from_address is not None:
+                self._balances[transaction.from_address] += transaction.coins
+            self._balances[transaction.to_address] -= transaction.coins
+        self.tip = block.previous_block
@@ -0,0 +1,145 @@
+"""
+Bulk, vectorized queries over a whole chain, for reporting: the balances of many addresses at many heights,
+and the transactions of an address. Needs numpy (the nodes themselves don't).
+
+    ledger = Ledger.from_chain(node.get_blockchain())
+    balances = ledger.balances_at([100, 200, 300])   # One row per address, one column per height
+    ledger.history(address)
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+NO_ADDRESS = -1  # The from column of the transactions that create coins
+
+
+class LedgerEntry(NamedTuple):
+    height: int
+    position: int  # In the block's transactions
+    from_address: Optional[str]
+    to_address: str
+    coins: int
+
+
+class Ledger:
+    """
+    The transactions of one chain as NumPy columns, one row per transaction in chain order:
+    from_ids / to_ids (indexes into addresses), coins, heights and positions.
+    opening_balances are the balances before the chain's first block's transactions, for a chain that
+    starts at a snapshot (e.g. Snapshot.balances); they count from the first block's height.
+    """
+
+    def __init__(self, addresses: List[str], from_ids: np.ndarray, to_ids: np.ndarray, coins: np.ndarray,
+                 heights: np.ndarray, positions: np.ndarray, opening_balances: Dict[str, int] = None,
+                 start_height: int = 0):
+        self.addresses = addresses
+        self.address_ids = {address: address_id for address_id, address in enumerate(addresses)}
+        self.from_ids = from_ids
+        self.to_ids = to_ids
+        self.coins = coins
+        self.heights = heights
+        self.positions = positions
+        self.start_height = start_height
+        self._opening_balances = np.zeros(len(addresses), dtype=np.int64)
+        for address, balance in (opening_balances or {}).items():
+            self._opening_balances[self.address_ids[address]] = balance
+        self._build_address_index()
+
+    @classmethod
+    def from_chain(cls, blockchain, opening_balances: Dict[str, int] = None) -> 'Ledger':
+        # blockchain is the last block. Every block is read once
+        blocks = []
+        block = blockchain
+        while block is not None:
+            blocks.append(block)
+            block = block.previous_block
+        blocks.reverse()
+
+        address_ids: Dict[str, int] = {}
+        for address in opening_balances or {}:
+            address_ids.setdefault(address, len(address_ids))
+        from_ids, to_ids, coins, heights, positions = [], [], [], [], []
+        for block in blocks:
+            for position, signed_transaction in enumerate(block.signed_transactions):
+                transaction = signed_transaction.transaction
+                from_ids.append(NO_ADDRESS if transaction.from_address is None
+                                else address_ids.setdefault(transaction.from_address, len(address_ids)))
+                to_ids.append(address_ids.setdefault(transaction.to_address, len(address_ids)))
+                coins.append(transaction.coins)
+                heights.append(block.height)
+                positions.append(position)
+
+        return cls(list(address_ids), np.array(from_ids, dtype=np.int64), np.array(to_ids, dtype=np.int64),
+                   np.array(coins, dtype=np.int64), np.array(heights, dtype=np.int64),
+                   np.array(positions, dtype=np.int64), opening_balances,
+                   start_height=blocks[0].height if blocks else 0)
+
+    def __len__(self) -> int:
+        return len(self.coins)
+
+    def _build_address_index(self) -> None:
+        # Address -> rows, as one sorted array of rows and where each address' rows start (like a CSR matrix).
+        # A transaction to oneself is listed once
+        rows = np.arange(len(self), dtype=np.int64)
+        sent = self.from_ids != NO_ADDRESS
+        received = self.to_ids != self.from_ids
+        row_addresses = np.concatenate([self.from_ids[sent], self.to_ids[received]])
+        row_numbers = np.concatenate([rows[sent], rows[received]])
+        order = np.lexsort((row_numbers, row_addresses))
+        self._address_rows = row_numbers[order]
+        self._address_offsets = np.searchsorted(row_addresses[order], np.arange(len(self.addresses) + 1))
+
+    def rows_of(self, address: str) -> np.ndarray:
+        # The rows of the transactions that send coins from or to address, in chain order
+        address_id = self.address_ids.get(address)
+        if address_id is None:
+            return np.empty(0, dtype=np.int64)
+        return self._address_rows[self._address_offsets[address_id]:self._address_offsets[address_id + 1]]
+
+    def history(self, address: str) -> List[LedgerEntry]:
+        return [LedgerEntry(int(self.heights[row]), int(self.positions[row]),
+                            None if self.from_ids[row] == NO_ADDRESS else self.addresses[self.from_ids[row]],
+                            self.addresses[self.to_ids[row]], int(self.coins[row]))
+                for row in self.rows_of(address)]
+
+    def balances_at(self, heights: Sequence[int], addresses: Iterable[str] = None) -> np.ndarray:
+        """
+        The balance of every address after the block at every height, as a (addresses, heights) int64 array.
+        addresses defaults to self.addresses (in that order); unknown addresses have a balance of 0.
+        Same as calculate_balance(address, <block at height>) for every pair, in a single pass:
+        every transfer is added to its address' column for the first requested height it counts for,
+        then each row is summed cumulatively along the heights.
+        """
+        heights = np.asarray(heights, dtype=np.int64)
+        order = np.argsort(heights, kind='stable')
+        sorted_heights = heights[order]
+
+        # Debits and credits, by address id
+        sent = self.from_ids != NO_ADDRESS
+        entry_addresses = np.concatenate([self.from_ids[sent], self.to_ids])
+        entry_amounts = np.concatenate([-self.coins[sent], self.coins])
+        entry_heights = np.concatenate([self.heights[sent], self.heights])
+
+        # The first requested height at or above each entry's height (len(heights): after all of them)
+        columns = np.searchsorted(sorted_heights, entry_heights, side='left')
+        counted = columns < len(heights)
+        changes = np.zeros((len(self.addresses), len(heights)), dtype=np.int64)
+        np.add.at(changes, (entry_addresses[counted], columns[counted]), entry_amounts[counted])
+        balances = np.cumsum(changes, axis=1)
+        balances[:, sorted_heights >= self.start_height] += self._opening_balances[:, None]
+
+        # Back to the requested order of heights, and of addresses
+        unsorted = np.empty_like(balances)
+        unsorted[:, order] = balances
+        if addresses is None:
+            return unsorted
+        address_ids = np.array([self.address_ids.get(address, len(self.addresses)) for address in addresses],
+                               dtype=np.int64)
+        return np.vstack([unsorted, np.zeros((1, len(heights)), dtype=np.int64)])[address_ids]
+
+    def balances(self, height: int = None) -> Dict[str, int]:
+        # Every address' balance after the block at height (default: the last block)
+        if height is None:
+            height = int(self.heights[-1]) if len(self) else self.start_height
+        column = self.balances_at([height])[:, 0]
+        return {address: int(balance) for address, balance in zip(self.addresses, column)}
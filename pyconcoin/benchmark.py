@@ -0,0 +1,217 @@
+"""
+Benchmarks for chain growth, hashing, mining, balance queries and sync, on synthetic chains.
+
+    python benchmark.py --sizes 1000 10000 --output results.json
+    python benchmark.py --sizes 1000 10000 --compare results.json  # Exits with 1 if anything got slower
+
+Every result is a cost, in seconds (or bytes, for memory_per_block), so for all of them lower is better.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import nacl.signing
+
+import blockchain_part1
+from blockchain import Block, Node, SignedTransaction, Transaction
+from mining import Miner
+from signatures import address_of, sign_transaction
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_THRESHOLD = 0.2  # A result more than 20% slower than the baseline is a regression
+
+# Tracing allocations is slow, so memory is only measured up to this chain length
+MAX_MEMORY_BENCHMARK_SIZE = 100_000
+
+# How many blocks the pulling node is behind (they are really signed, so the pull can verify them)
+SYNC_GAP = 10
+
+ADDRESSES = [f"ADDRESS_{i}" for i in range(100)]
+
+
+def measure(function: Callable[[], object], repeat: int = 5) -> float:
+    # The median of a few runs, in seconds
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def build_chain(size: int, signing_key: nacl.signing.SigningKey, signed_blocks: int = 0) -> Block:
+    """
+    A chain of `size` blocks (difficulty 0, so nothing is mined) moving coins between ADDRESSES.
+    The last `signed_blocks` blocks are signed for real, by signing_key; the others have placeholder signatures.
+    """
+    owner = address_of(signing_key)
+    block = Block(SignedTransaction(Transaction(None, owner, 10 ** 12), b""), None, 0, difficulty=0)
+    for height in range(1, size):
+        if height >= size - signed_blocks:
+            transaction = Transaction(owner, ADDRESSES[height % len(ADDRESSES)], 1)
+            signature = sign_transaction(signing_key, transaction)
+        else:
+            transaction = Transaction(ADDRESSES[height % len(ADDRESSES)], ADDRESSES[(height * 7) % len(ADDRESSES)], 1)
+            signature = b""
+        block = Block(SignedTransaction(transaction, signature), block, 0, difficulty=0)
+    return block
+
+
+def node_with_chain(tip: Block, other_nodes: List[Node] = None) -> Node:
+    # The chains are built at difficulty 0, so the nodes have to accept that difficulty
+    miner = Miner(difficulty=0)
+    node = Node(coins=0, miner=miner) if other_nodes is None else Node(other_nodes=other_nodes, miner=miner)
+    node._set_last_block(tip)
+    return node
+
+
+def benchmark_chain(size: int, results: Dict[str, float], repeat: int) -> None:
+    signing_key = nacl.signing.SigningKey.generate()
+
+    started = time.perf_counter()
+    tip = build_chain(size, signing_key, signed_blocks=SYNC_GAP)
+    results[f"build_chain_per_block[n={size}]"] = (time.perf_counter() - started) / size
+
+    results[f"block_hash[n={size}]"] = measure(tip.header, repeat=1000)
+    results[f"calculate_balance[n={size}]"] = measure(lambda: Node.calculate_balance(ADDRESSES[1], tip), repeat)
+
+    node = node_with_chain(tip)
+    started = time.perf_counter()
+    node.get_balance(ADDRESSES[1])  # Builds the balance index
+    results[f"balance_index_build[n={size}]"] = time.perf_counter() - started
+    results[f"get_balance[n={size}]"] = measure(lambda: node.get_balance(ADDRESSES[1]), repeat=1000)
+
+    behind = tip
+    for _ in range(SYNC_GAP):
+        behind = behind.previous_block
+    results[f"merge_blockchains[n={size}]"] = measure(lambda: Node.merge_blockchains(behind, tip), repeat=1000)
+
+    def pull():
+        node_b = node_with_chain(behind, other_nodes=[node])
+        node_b.get_balance(ADDRESSES[1])
+        started = time.perf_counter()
+        node_b.pull_blockchains_from_other_nodes()
+        node_b.get_balance(ADDRESSES[1])
+        assert node_b.get_blockchain() is tip
+        return time.perf_counter() - started
+
+    # The time to catch up SYNC_GAP blocks (without building the node that is behind)
+    results[f"pull_blockchains[n={size},gap={SYNC_GAP}]"] = statistics.median(pull() for _ in range(repeat))
+
+
+def benchmark_memory(size: int, results: Dict[str, float]) -> None:
+    tracemalloc.start()
+    try:
+        tip = build_chain(size, nacl.signing.SigningKey.generate())
+        results[f"memory_per_block[n={size}]"] = tracemalloc.get_traced_memory()[0] / size
+    finally:
+        tracemalloc.stop()
+    del tip
+
+
+def benchmark_mining(results: Dict[str, float], difficulty: int = 16) -> None:
+    for processes in sorted({1, os.cpu_count() or 1}):
+        with Miner(difficulty=difficulty, processes=processes) as miner:
+            for block in range(4):
+                miner.mine(f"benchmark block {block}".encode())
+            results[f"mining_seconds_per_hash[processes={processes}]"] = 1 / miner.hash_rate
+
+
+def benchmark_ledger(size: int, results: Dict[str, float], repeat: int) -> None:
+    # The transaction-list ledger of blockchain_part1
+    node_a = blockchain_part1.Node(initial_coins=10 ** 12)
+    for i in range(size - 1 - SYNC_GAP):
+        transaction = blockchain_part1.Transaction(ADDRESSES[i % len(ADDRESSES)], ADDRESSES[(i * 7) % len(ADDRESSES)], 1)
+        node_a._add_signed_transaction(blockchain_part1.SignedTransaction(transaction, b""))
+
+    results[f"ledger_calculate_balance[n={size}]"] = measure(lambda: node_a.calculate_balance(ADDRESSES[1]), repeat)
+
+    def pull():
+        node_b = blockchain_part1.Node(other_nodes=[node_a])
+        node_b._signed_transactions = list(node_a._signed_transactions)
+        node_b._transaction_ids = set(node_a._transaction_ids)
+        node_b._sync_positions[node_a] = len(node_a._signed_transactions)
+        for _ in range(SYNC_GAP):
+            node_a.transfer_coins(ADDRESSES[0], 1)
+
+        started = time.perf_counter()
+        node_b.pull_transactions_from_other_nodes()
+        return time.perf_counter() - started
+
+    results[f"ledger_pull[n={size},gap={SYNC_GAP}]"] = statistics.median(pull() for _ in range(repeat))
+
+
+def run(sizes: List[int], repeat: int = 5, mining: bool = True) -> dict:
+    results: Dict[str, float] = {}
+    for size in sizes:
+        print(f"Chain of {size} blocks...", file=sys.stderr)
+        benchmark_chain(size, results, repeat)
+        benchmark_ledger(size, results, repeat)
+        if size <= MAX_MEMORY_BENCHMARK_SIZE:
+            benchmark_memory(size, results)
+    if mining:
+        print("Mining...", file=sys.stderr)
+        benchmark_mining(results)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    # One row per result in both runs. A result is a regression if it is more than `threshold` slower
+    rows = []
+    for name, seconds in current['results'].items():
+        baseline_seconds = baseline['results'].get(name)
+        if baseline_seconds is None:
+            continue
+        ratio = seconds / baseline_seconds if baseline_seconds > 0 else float('inf')
+        rows.append({'name': name, 'baseline': baseline_seconds, 'current': seconds, 'ratio': ratio,
+                     'regression': ratio > 1 + threshold})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Chain lengths to benchmark")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-mining', action='store_true', help="Skip the mining benchmark")
+    parser.add_argument('--output', help="Write the results to this JSON file (default: stdout)")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare with the results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    current = run(args.sizes, args.repeat, mining=not args.no_mining)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=2)
+    else:
+        json.dump(current, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            rows = compare(json.load(file), current, args.threshold)
+        for row in rows:
+            flag = "REGRESSION" if row['regression'] else ""
+            print(f"{row['name']:<50} {row['baseline']:.3e} -> {row['current']:.3e}  x{row['ratio']:.2f} {flag}",
+                  file=sys.stderr)
+        if any(row['regression'] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
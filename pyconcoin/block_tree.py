@@ -0,0 +1,161 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+DEFAULT_MAX_DEPTH = 100
+DEFAULT_MAX_ORPHANS = 100
+
+
+class BlockTree:
+    """
+    The recent blocks of every known branch, by hash, so a branch that loses now and wins later
+    doesn't have to be pulled and validated again.
+
+    Blocks are kept down to max_depth blocks below the best tip; a branch that forks deeper than that
+    is dropped (so max_depth is also the deepest reorg a node follows). Each block is marked valid once
+    a ChainValidator has checked it, and its branch only has to be checked from there on.
+    A block whose previous block is unknown is an orphan: up to max_orphans of them are parked,
+    and connected when their previous block is added.
+    """
+
+    def __init__(self, max_depth: int = DEFAULT_MAX_DEPTH, max_orphans: int = DEFAULT_MAX_ORPHANS):
+        if max_depth < 1 or max_orphans < 0:
+            raise ValueError("max_depth must be positive, and max_orphans can't be negative")
+        self.max_depth = max_depth
+        self.max_orphans = max_orphans
+        self._blocks: Dict[bytes, 'Block'] = {}
+        self._children: Dict[bytes, List[bytes]] = {}
+        self._tips: Dict[bytes, 'Block'] = {}  # The blocks without children
+        self._valid: Set[bytes] = set()
+        self._by_height: Dict[int, List[bytes]] = {}
+        self._lowest_height = 0  # No block below it is kept
+        self._orphans: 'OrderedDict[bytes, Block]' = OrderedDict()  # Oldest first, for eviction
+        self._orphans_by_parent: Dict[bytes, List[bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def __contains__(self, block_hash: bytes) -> bool:
+        return block_hash in self._blocks
+
+    def get(self, block_hash: bytes) -> Optional['Block']:
+        return self._blocks.get(block_hash)
+
+    def is_valid(self, block) -> bool:
+        return block.block_hash in self._valid
+
+    def orphan_count(self) -> int:
+        return len(self._orphans)
+
+    def tips(self) -> List['Block']:
+        # The tip of every branch, the most work first
+        return sorted(self._tips.values(), key=lambda tip: (tip.total_work, tip.height), reverse=True)
+
+    def best_tip(self) -> Optional['Block']:
+        return max(self._tips.values(), key=lambda tip: (tip.total_work, tip.height), default=None)
+
+    def add(self, block) -> List['Block']:
+        """
+        Add a block (not validated yet) from another node.
+        Returns the blocks that were connected: block itself, then the orphans it connected.
+        Nothing if block is already known, too old, or parked as an orphan.
+        """
+        if (block.block_hash in self._blocks or block.block_hash in self._orphans
+                or block.height < self._lowest_height):
+            return []
+        if block.height > 0 and block.previous_hash not in self._blocks:
+            self._park(block)
+            return []
+
+        connected = []
+        waiting = [block]
+        while waiting:
+            block = self._connect(waiting.pop())
+            connected.append(block)
+            for orphan_hash in self._orphans_by_parent.pop(block.block_hash, []):
+                waiting.append(self._orphans.pop(orphan_hash))
+        return connected
+
+    def add_chain(self, tip) -> None:
+        # Add tip and the blocks before it that I don't have (up to max_depth of them), as valid:
+        # they are my own blockchain, which was already checked
+        blocks = []
+        block = tip
+        while block is not None and block.block_hash not in self._blocks and len(blocks) < self.max_depth:
+            blocks.append(block)
+            block = block.previous_block
+        for block in reversed(blocks):
+            self._orphans.pop(block.block_hash, None)
+            self._connect(block)
+        self.mark_valid(blocks)
+
+    def mark_valid(self, blocks: List['Block']) -> None:
+        self._valid.update(block.block_hash for block in blocks if block.block_hash in self._blocks)
+
+    def unvalidated_path(self, tip) -> List['Block']:
+        # The blocks of tip's branch that were never validated, oldest first
+        path = []
+        block = tip
+        while block is not None and block.block_hash in self._blocks and block.block_hash not in self._valid:
+            path.append(block)
+            block = block.previous_block
+        path.reverse()
+        return path
+
+    def remove(self, block) -> None:
+        # Remove an (invalid) block, and every block after it
+        parent_hash = block.previous_hash
+        waiting = [block.block_hash]
+        while waiting:
+            block_hash = waiting.pop()
+            waiting.extend(self._children.pop(block_hash, []))
+            self._forget(block_hash)
+
+        siblings = self._children.get(parent_hash)
+        if siblings is not None:
+            siblings.remove(block.block_hash)
+            if not siblings:
+                del self._children[parent_hash]
+                self._tips[parent_hash] = self._blocks[parent_hash]
+
+    def prune(self, best_tip) -> None:
+        # Forget the blocks more than max_depth below best_tip. Their children stay, as the first blocks of their branch
+        cutoff = best_tip.height - self.max_depth
+        for height in range(max(self._lowest_height, min(self._by_height, default=cutoff)), cutoff):
+            for block_hash in list(self._by_height.get(height, [])):
+                self._children.pop(block_hash, None)
+                self._forget(block_hash)
+        self._lowest_height = max(self._lowest_height, cutoff)
+
+    def _connect(self, block) -> 'Block':
+        # Keep block on top of my own copy of its previous block (other nodes may have theirs)
+        parent = self._blocks.get(block.previous_hash) if block.height > 0 else None
+        if parent is not None and block.previous_block is not parent:
+            block = block.relinked(parent)
+        self._blocks[block.block_hash] = block
+        self._by_height.setdefault(block.height, []).append(block.block_hash)
+        if parent is not None:
+            self._children.setdefault(parent.block_hash, []).append(block.block_hash)
+            self._tips.pop(parent.block_hash, None)
+        self._tips[block.block_hash] = block
+        return block
+
+    def _forget(self, block_hash: bytes) -> None:
+        block = self._blocks.pop(block_hash)
+        self._valid.discard(block_hash)
+        self._tips.pop(block_hash, None)
+        hashes = self._by_height[block.height]
+        hashes.remove(block_hash)
+        if not hashes:
+            del self._by_height[block.height]
+
+    def _park(self, block) -> None:
+        if self.max_orphans == 0:
+            return
+        self._orphans[block.block_hash] = block
+        self._orphans_by_parent.setdefault(block.previous_hash, []).append(block.block_hash)
+        while len(self._orphans) > self.max_orphans:
+            orphan_hash, orphan = self._orphans.popitem(last=False)
+            siblings = self._orphans_by_parent[orphan.previous_hash]
+            siblings.remove(orphan_hash)
+            if not siblings:
+                del self._orphans_by_parent[orphan.previous_hash]
@@ -1,43 +1,322 @@
 import random
+import sys
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
 import time
 import hashlib
+import os
+import struct
+import weakref
+import nacl.signing
+
+from account_state import AccountState
+from block_tree import BlockTree
+from chain import ChainIndex, blocks_between, find_common_ancestor, same_block
+from mempool import Mempool
+from merkle import MerklePath, merkle_path, merkle_root, root_from_path
+from metrics import COUNT_BUCKETS, REGISTRY
+from mining import DEFAULT_DIFFICULTY, NONCE_SIZE, Miner
+from signatures import SignatureVerifier, address_of, is_well_formed, sign_transaction
+from snapshot import Snapshot
+from transaction_index import TransactionIndex
+from validator import ChainValidator
+
+if TYPE_CHECKING:
+    from blockstore import BlockStore  # blockstore imports this module
+
+# Block header, without the magic number: previous block hash, transaction digest, timestamp, difficulty.
+# The block hash is sha256(header prefix + magic number as 8 big-endian bytes)
+HEADER_PREFIX_FORMAT = '>32s32sdH'
+HEADER_SIZE = struct.calcsize(HEADER_PREFIX_FORMAT) + NONCE_SIZE
+
+GENESIS_PREVIOUS_HASH = bytes(32)  # The "previous block hash" of the first block
+
+
+def intern_address(address):
+    # Every transaction of an address shares one string object, instead of a copy per transaction
+    return sys.intern(address) if type(address) is str else address
 
 
-@dataclass
 class Transaction:
-    from_address: Optional[str]  # In the first transaction, from_address will be None
-    to_address: str
-    coins: int
+    # Not a dataclass: with __slots__ (no __dict__ per transaction) Python 3.7 dataclasses can't have field defaults
+    __slots__ = ('from_address', 'to_address', 'coins', 'salt')
+
+    def __init__(self,
+                 from_address: Optional[str],  # In the first transaction, from_address will be None
+                 to_address: str,
+                 coins: int,
+                 salt: int = None):
+        self.from_address = intern_address(from_address)
+        self.to_address = intern_address(to_address)
+        self.coins = coins
+        # Random, so two transfers of the same coins between the same addresses are still different transactions
+        self.salt = random.getrandbits(64) if salt is None else salt
+
+    def _fields(self) -> tuple:
+        return self.from_address, self.to_address, self.coins, self.salt
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None  # Mutable, like the dataclass it replaces
+
+    def __repr__(self) -> str:
+        return (f"Transaction(from_address={self.from_address!r}, to_address={self.to_address!r}, "
+                f"coins={self.coins!r}, salt={self.salt!r})")
 
 
 @dataclass
 class SignedTransaction:
+    __slots__ = ('transaction', 'signature')
+
     transaction: Transaction
-    signature: str
+    signature: bytes  # Ed25519 signature of the transaction, by the sender's key (see signatures.py)
+
+    def digest(self) -> bytes:
+        transaction = self.transaction
+        encoded = repr((transaction.from_address, transaction.to_address, transaction.coins, transaction.salt,
+                        self.signature))
+        return hashlib.sha256(encoded.encode('utf-8')).digest()
+
+
+def transactions_digest(signed_transactions: List[SignedTransaction]) -> bytes:
+    # The block header commits to all the transactions of the block, in order, with the Merkle root of their digests,
+    # so one transaction can be shown to be in the block with O(log n) hashes (see TransactionProof)
+    return merkle_root([signed_transaction.digest() for signed_transaction in signed_transactions])
 
 
 @dataclass
-class Block:  # HistoryState
+class TransactionProof:
+    # Proof that signed_transaction is in the block with this hash, for clients that only have the block headers
     signed_transaction: SignedTransaction
-    previous_block: Optional['Block']  # In the first block, previous_block will be None
-    magic_number: int
+    height: int
+    block_hash: bytes
+    path: MerklePath
+
+    def transactions_digest(self) -> bytes:
+        # Equals the transactions digest in the block's header, if the proof is valid
+        return root_from_path(self.signed_transaction.digest(), self.path)
+
+
+class Block:  # HistoryState
+    # Not a dataclass: a generated __eq__ / __repr__ would recurse through previous_block all the way to the genesis,
+    # and previous_block may be loaded lazily from a BlockStore
+    # Slotted, because a node holds a lot of blocks. __weakref__ is for the BlockStore cache of loaded blocks
+    __slots__ = ('signed_transactions', 'magic_number', 'difficulty', 'timestamp', '_previous_block', '_load_block',
+                 'previous_hash', 'height', 'total_work', 'block_hash', '_transactions_digest', '__weakref__')
+
+    def __init__(self,
+                 signed_transaction: Optional[SignedTransaction],
+                 previous_block: Optional['Block'],  # In the first block, previous_block will be None
+                 magic_number: int,
+                 difficulty: int = DEFAULT_DIFFICULTY,  # The number of leading zero bits the block hash needs
+                 timestamp: float = None,
+                 signed_transactions: List[SignedTransaction] = None):
+        # A block holds one or more transactions: pass either signed_transaction or signed_transactions
+        if signed_transactions is None:
+            signed_transactions = [signed_transaction]
+        self.signed_transactions = list(signed_transactions)
+        self.magic_number = magic_number
+        self.difficulty = difficulty
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+        self._previous_block = previous_block
+        self._load_block: Optional[Callable[[bytes], 'Block']] = None  # Used to load previous_block lazily
+        self.previous_hash = GENESIS_PREVIOUS_HASH if previous_block is None else previous_block.block_hash
+        self._transactions_digest: Optional[bytes] = None  # Only kept for blocks whose transactions were pruned
+
+        # Filled in when the block is created, so comparing two chains doesn't need to walk them
+        block_work = 2 ** difficulty
+        if previous_block is None:
+            self.height = 0  # The genesis block has height 0
+            self.total_work = block_work  # The expected number of hash attempts spent on the chain up to this block
+        else:
+            self.height = previous_block.height + 1
+            self.total_work = previous_block.total_work + block_work
+
+        self.block_hash = hashlib.sha256(self.header()).digest()  # sha256 of the header, computed once
+
+    @classmethod
+    def restore(cls, header: bytes, signed_transactions: List[SignedTransaction], height: int, total_work: int,
+                load_block: Callable[[bytes], 'Block']) -> 'Block':
+        # Rebuild a stored block without loading its ancestors: previous_block is loaded on first access
+        previous_hash, _, timestamp, difficulty = struct.unpack_from(HEADER_PREFIX_FORMAT, header)
+        block = cls.__new__(cls)
+        block.signed_transactions = signed_transactions
+        block.magic_number = int.from_bytes(header[-NONCE_SIZE:], 'big')
+        block.difficulty = difficulty
+        block.timestamp = timestamp
+        block._previous_block = None
+        block._load_block = load_block
+        block.previous_hash = previous_hash
+        block._transactions_digest = None
+        block.height = height
+        block.total_work = total_work
+        block.block_hash = hashlib.sha256(header).digest()
+        return block
+
+    @classmethod
+    def header_only(cls, header: bytes, height: int, total_work: int) -> 'Block':
+        # The first block of a pruned chain: its transactions and previous blocks are gone, but its header
+        # (so its hash, height and total work) is known, and new blocks can still be checked against it
+        block = cls.restore(header, [], height, total_work, load_block=None)
+        block._transactions_digest = struct.unpack_from(HEADER_PREFIX_FORMAT, header)[1]
+        return block
+
+    def relinked(self, previous_block: Optional['Block']) -> 'Block':
+        # A copy of this block on top of previous_block, which must be a copy of its own previous block.
+        # Other nodes may share the original, so pruning copies blocks instead of changing them
+        block = Block.__new__(Block)
+        for name in Block.__slots__:
+            if name != '__weakref__':
+                setattr(block, name, getattr(self, name))
+        block._previous_block = previous_block
+        block._load_block = None
+        return block
+
+    @property
+    def signed_transaction(self) -> SignedTransaction:
+        # The first transaction of the block
+        return self.signed_transactions[0]
+
+    @property
+    def previous_block(self) -> Optional['Block']:
+        if self._load_block is not None and self.previous_hash != GENESIS_PREVIOUS_HASH:
+            # Loaded on every access, not kept: holding the tip of a stored chain mustn't keep the whole chain in memory
+            return self._load_block(self.previous_hash)
+        return self._previous_block
+
+    def header(self) -> bytes:
+        # A fixed size header: hashing a block costs the same no matter how long the chain is
+        digest = self._transactions_digest
+        if digest is None:
+            digest = transactions_digest(self.signed_transactions)
+        prefix = Block.header_prefix(self.previous_hash, digest, self.timestamp, self.difficulty)
+        return prefix + self.magic_number.to_bytes(NONCE_SIZE, 'big')
+
+    @staticmethod
+    def header_prefix(previous_hash: bytes, transaction_digest: bytes, timestamp: float, difficulty: int) -> bytes:
+        return struct.pack(HEADER_PREFIX_FORMAT, previous_hash, transaction_digest, timestamp, difficulty)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        # The block hash covers the header, which covers the transactions and (by hash) the whole chain before it
+        return self.block_hash == other.block_hash
+
+    def __hash__(self) -> int:
+        return hash(self.block_hash)
+
+    def __repr__(self) -> str:
+        # Bounded: no transactions and no previous blocks
+        return (f"Block(block_hash='{self.block_hash.hex()}', previous_hash='{self.previous_hash.hex()}', "
+                f"height={self.height!r}, transactions={len(self.signed_transactions)!r}, "
+                f"magic_number={self.magic_number!r}, difficulty={self.difficulty!r})")
+
+
+# Every block in memory, by hash, so the same block received from several peers (or read from the BlockStore
+# more than once) is kept as one object
+_interned_blocks: 'weakref.WeakValueDictionary[bytes, Block]' = weakref.WeakValueDictionary()
+
+
+def intern_block(block: Block) -> Block:
+    # The block that is already in memory with the same hash, or block itself if there is none
+    return _interned_blocks.setdefault(block.block_hash, block)
+
+
+# Hot-path metrics (see metrics.py). The per-peer ones are looked up by label in pull_blockchains_from_other_nodes
+_blocks_mined = REGISTRY.counter('pyconcoin_blocks_mined_total', "Blocks mined by create_block")
+_mining_attempts = REGISTRY.histogram('pyconcoin_mining_attempts', "Hashes tried per mined block",
+                                      buckets=COUNT_BUCKETS)
+_balance_blocks_walked = REGISTRY.histogram('pyconcoin_calculate_balance_blocks',
+                                            "Blocks walked per calculate_balance call", buckets=COUNT_BUCKETS)
+_balance_blocks_replayed = REGISTRY.histogram('pyconcoin_get_balance_blocks',
+                                              "Blocks undone or applied per get_balance call", buckets=COUNT_BUCKETS)
+_blocks_adopted = REGISTRY.counter('pyconcoin_blocks_adopted_total', "Blocks adopted from other nodes")
 
 
 class Node:
-    def __init__(self, other_nodes: List['Node'] = None, coins: int = None):
-        self.address = random.randint(0, 1000)
+    # Shared by all nodes, so a transaction that several nodes pull is only verified once
+    _signature_verifier = SignatureVerifier()
+    _default_validators: Dict[int, ChainValidator] = {}  # By minimum difficulty
+
+    def __init__(self, other_nodes: List['Node'] = None, coins: int = None, miner: Miner = None,
+                 block_store: 'BlockStore' = None, mempool: Mempool = None, mine_each_transaction: bool = True,
+                 snapshot: Snapshot = None, snapshot_interval: int = None, snapshot_directory: str = None,
+                 prune_depth: int = None, validator: ChainValidator = None, block_tree: BlockTree = None):
+        if prune_depth is not None and (block_store is not None or prune_depth < 1):
+            raise ValueError("prune_depth must be positive, and a node with a BlockStore keeps all its blocks")
+        if prune_depth is not None and block_tree is not None:
+            raise ValueError("A node with a BlockTree keeps its recent blocks, so it can't prune them")
+        self._signing_key = nacl.signing.SigningKey.generate()
+        self.address = address_of(self._signing_key)
+        self._miner = miner if miner is not None else Miner()
+        self._block_store = block_store
+        self._mempool = mempool if mempool is not None else Mempool()
+        # Checks blocks from others (and mine). By default blocks must be at least as hard as the ones I mine
+        self._validator = validator if validator is not None else Node._default_validator(self._miner.difficulty)
+
+        # If False, transfers wait in the mempool until mine_block() packs them into a block
+        self.mine_each_transaction = mine_each_transaction
         self._other_nodes: List['Node'] = []
         self._last_block: Optional[Block] = None
 
+        # Every snapshot_interval blocks, a Snapshot of the balances is taken (and saved in snapshot_directory)
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_directory = snapshot_directory
+        self.last_snapshot: Optional[Snapshot] = None
+
+        # If set, only the last prune_depth blocks are kept (also the deepest reorg I can follow).
+        # _root is the first block I still have, if I pruned or started from a snapshot
+        self.prune_depth = prune_depth
+        self._root: Optional[Block] = None
+
+        # If set, the recent blocks of every branch I know about (not only of my blockchain), see _activate_best_tip
+        self._block_tree = block_tree
+
+        # Called with every new last block / every transfer accepted into the mempool (e.g. to gossip them)
+        self._tip_listeners: List[Callable[[Block], None]] = []
+        self._transaction_listeners: List[Callable[[SignedTransaction], None]] = []
+
+        # Balances of every address as of self._account_state.tip, brought up to _last_block when a balance is needed
+        self._account_state = AccountState()
+
+        # My blockchain by height (for block locators and sync), also brought up to _last_block when needed
+        self._chain_index = ChainIndex()
+
+        # Where every transaction of my blockchain is (for inclusion proofs), also brought up to _last_block when needed
+        self._transaction_index = TransactionIndex()
+
+        # If I'm restarting, and saved my blockchain before
+        if block_store is not None and len(block_store) > 0:
+            self._other_nodes = other_nodes or []
+
+            # Only the last block is read; older blocks are loaded when previous_block is accessed
+            self._last_block = block_store.tip()
+
+            # The balances as of a recent stored block, so they aren't replayed from the genesis
+            saved_balances = block_store.load_snapshot()
+            saved_block = None if saved_balances is None else block_store.get_by_hash(saved_balances.block_hash)
+            if saved_block is not None:
+                self._account_state.reset(saved_block, saved_balances.balances)
+
+        # If I'm starting from a snapshot: the blocks after it come from the other nodes
+        elif snapshot is not None:
+            self._other_nodes = other_nodes or []
+            self._root = Block.header_only(snapshot.header, snapshot.height, snapshot.total_work)
+            self._account_state.reset(self._root, snapshot.balances)
+            self._set_last_block(self._root)
+            self.pull_blockchains_from_other_nodes()
+
         # If I'm the first node
-        if other_nodes is None and coins is not None:
+        elif other_nodes is None and coins is not None:
             initial_transaction = Transaction(from_address=None, to_address=self.address, coins=coins)
             initial_signed_transaction = self.sign(initial_transaction)
 
             # TODO: Create an initial block and save it as the _last_block. Hint: Use create_block
-            self._last_block = self.create_block(initial_signed_transaction, None)
+            self._set_last_block(self.create_block(initial_signed_transaction, None))
             pass
 
         # If I'm not the first node
@@ -45,103 +324,445 @@ class Node:
             self._other_nodes = other_nodes
 
             # TODO: Give self._last_block a default value: Set it to the blockchain of one of the other nodes
-            self._last_block = other_nodes[0]._last_block
+            # Checked like any blockchain I pull: I start with none, so every block of it is validated
+            self.pull_blockchain(other_nodes[0].get_blockchain())
             pass
 
         else:
             raise Exception("")
 
+    @staticmethod
+    def _default_validator(min_difficulty: int) -> ChainValidator:
+        validator = Node._default_validators.get(min_difficulty)
+        if validator is None:
+            validator = Node._default_validators[min_difficulty] = ChainValidator(
+                signature_verifier=Node._signature_verifier, min_difficulty=min_difficulty)
+        return validator
+
+    def __repr__(self) -> str:
+        # Short, for logs and for the per-peer metric labels
+        return f"Node({self.address[:8]})"
+
     def get_blockchain(self) -> Block:
         # TODO: Return the blockchain I know about.
         # Hint: The blockchain is a linked list, so returning the last block is enough,
         # because it points at all the previous blocks
         return self._last_block
 
-    def create_block(self, signed_transaction, previous_block) -> Block:
-        # As a stub implementation, just use magic_number=0, and sleep a bit
-        # (as if it took time to calculate the correct magic_number)
-        time.sleep(0.1)
-        magic_number = random.randint(0, 1000)
+    def _set_last_block(self, block: Optional[Block]) -> None:
+        if self._block_store is not None:
+            self._block_store.set_tip(block)
+        self._last_block = block
+
+        if block is not None and self._block_store is not None and block.height % self._block_store.sync_every == 0:
+            # About as often as the store is flushed, save the balances for the next time it is opened
+            self._block_store.save_snapshot(self.take_snapshot())
+
+        if block is not None and self._block_tree is not None:
+            self._block_tree.add_chain(block)
+            self._block_tree.prune(block)
+        if block is not None and self.snapshot_interval is not None:
+            snapshot_height = block.height - block.height % self.snapshot_interval
+            if self.last_snapshot is None or snapshot_height > self.last_snapshot.height:
+                self._take_periodic_snapshot(snapshot_height)
+        if block is not None and self.prune_depth is not None:
+            # Pruning copies the blocks it keeps, so it only happens every prune_depth blocks
+            root_height = 0 if self._root is None else self._root.height
+            if block.height - root_height >= 2 * self.prune_depth:
+                self.prune(block.height - self.prune_depth)
+
+        for listener in self._tip_listeners:
+            listener(self._last_block)
+
+    def add_tip_listener(self, listener: Callable[[Block], None]) -> None:
+        self._tip_listeners.append(listener)
+
+    def add_transaction_listener(self, listener: Callable[[SignedTransaction], None]) -> None:
+        self._transaction_listeners.append(listener)
+
+    def get_balance(self, address) -> int:
+        # Same result as calculate_balance(address, self.get_blockchain()), without walking the chain:
+        # only the blocks that differ between the indexed chain and the current one are replayed
+        _balance_blocks_replayed.observe(self._account_state.move_to(self._last_block))
+        return self._account_state.balance(address)
+
+    def take_snapshot(self, height: int = None) -> Snapshot:
+        # The balances as of my block at height (default: my last block)
+        self._chain_index.move_to(self._last_block)
+        block = self._last_block if height is None else self._chain_index.block_at(height)
+        if block is None:
+            raise ValueError(f"I don't have a block at height {height}")
+        self._account_state.move_to(block)
+        return Snapshot(block.header(), block.height, block.total_work, self._account_state.balances())
+
+    def _take_periodic_snapshot(self, height: int) -> None:
+        if height == 0 or (self._root is not None and height < self._root.height):
+            return  # Nothing to save yet, or already pruned
+        self.last_snapshot = self.take_snapshot(height)
+        if self.snapshot_directory is not None:
+            os.makedirs(self.snapshot_directory, exist_ok=True)
+            self.last_snapshot.save(os.path.join(self.snapshot_directory, f'snapshot-{height}.dat'))
+
+    def prune(self, height: int) -> None:
+        """
+        Forget my blocks before height, and the transactions of the block at height.
+        Balances are kept, and new blocks are still checked against the remaining chain, but I can't
+        follow a fork from before height anymore.
+        """
+        self._account_state.move_to(self._last_block)
+        kept_blocks: List[Block] = []
+        block = self._last_block
+        while block is not None and block.height > height:
+            kept_blocks.append(block)
+            block = block.previous_block
+        if block is None or block.height != height or block.previous_block is None:
+            return  # Not in my chain, or already the first block I have
+
+        root = Block.header_only(block.header(), block.height, block.total_work)
+        tip = root
+        for block in reversed(kept_blocks):
+            tip = block.relinked(tip)
+        self._root = root
+        self._last_block = tip
+
+        # The indexes are rebuilt (lazily) from the new chain, so they don't keep the old blocks alive
+        self._account_state.tip = tip  # Same hash: the balances don't change
+        self._chain_index = ChainIndex()
+        self._transaction_index = TransactionIndex()
+
+    def get_block_locator(self) -> List[Tuple[int, bytes]]:
+        # A short summary of my blockchain, so another node can tell where our blockchains diverge
+        self._chain_index.move_to(self._last_block)
+        return self._chain_index.locator()
+
+    def get_blocks_after(self, locator: List[Tuple[int, bytes]], max_count: int) -> Tuple[Optional[Block], List[Block]]:
+        # The last of my blocks that the locator's blockchain also has, and up to max_count of my blocks after it
+        self._chain_index.move_to(self._last_block)
+        return self._chain_index.blocks_after(locator, max_count)
+
+    def get_blocks(self, heights_and_hashes: List[Tuple[int, bytes]]) -> List[Block]:
+        # The blocks of my blockchain with these heights and hashes (the ones I don't have are skipped)
+        self._chain_index.move_to(self._last_block)
+        return self._chain_index.blocks(heights_and_hashes)
+
+    def get_headers_after(self, locator: List[Tuple[int, bytes]], max_count: int) -> Tuple[int, List[bytes]]:
+        # For light clients: the height of the last of my blocks the locator's chain also has (-1 if none),
+        # and the headers of up to max_count of my blocks after it
+        fork_point, blocks = self.get_blocks_after(locator, max_count)
+        return -1 if fork_point is None else fork_point.height, [block.header() for block in blocks]
+
+    def get_transaction_proof(self, digest: bytes) -> Optional[TransactionProof]:
+        # Proof that the transaction with this digest is in my blockchain (None if it isn't)
+        self._transaction_index.move_to(self._last_block)
+        location = self._transaction_index.find(digest)
+        return None if location is None else Node._transaction_proof(*location)
+
+    def get_address_proofs(self, address) -> List[TransactionProof]:
+        # Proofs for all the transactions of my blockchain that send coins from or to address, oldest first
+        self._transaction_index.move_to(self._last_block)
+        return [Node._transaction_proof(block, position)
+                for block, position in self._transaction_index.find_address(address)]
 
-        # TODO: Return a newly created block
-        while True:
-            block = Block(signed_transaction, previous_block, magic_number)
-            hash = hashlib.sha256(str(block).encode('utf-8')).hexdigest()
-            if hash[0] == '0':
-                return block        
-            else:
-                magic_number = random.randint(0, 1000)
+    @staticmethod
+    def _transaction_proof(block: Block, position: int) -> TransactionProof:
+        digests = [signed_transaction.digest() for signed_transaction in block.signed_transactions]
+        return TransactionProof(block.signed_transactions[position], block.height, block.block_hash,
+                                merkle_path(digests, position))
+
+    def create_block(self, signed_transactions, previous_block) -> Block:
+        # signed_transactions can be a single SignedTransaction, or a list of them
+        if isinstance(signed_transactions, SignedTransaction):
+            signed_transactions = [signed_transactions]
+
+        # Find a magic_number that makes the block hash meet the miner's difficulty
+        previous_hash = GENESIS_PREVIOUS_HASH if previous_block is None else previous_block.block_hash
+        timestamp = time.time()
+        difficulty = self._miner.difficulty
+        prefix = Block.header_prefix(previous_hash, transactions_digest(signed_transactions), timestamp, difficulty)
+        with REGISTRY.span('pyconcoin_create_block', "Time to mine a block in create_block",
+                           transactions=len(signed_transactions)):
+            result = self._miner.mine(prefix)
+        _blocks_mined.inc()
+        _mining_attempts.observe(result.attempts)
+
+        # The new block, with the magic number the miner found
+        return Block(None, previous_block, result.nonce, difficulty, timestamp, signed_transactions=signed_transactions)
 
     def make_transaction(self, from_address: str, to_address: str, coins: int) -> None:
-        # IF from has enough coins in his balance
-        if Node.calculate_balance(from_address, self.get_blockchain()) > coins:
+        # IF from has enough coins in his balance (after the transfers they already have waiting in the mempool)
+        if self.get_balance(from_address) - self._mempool.pending_spent(from_address) > coins:
             # Make a signed transfer request
             transaction = Transaction(from_address, to_address, coins)
             signed_transaction = self.sign(transaction)
-
-            # TODO: Create a block for this transaction, and save it as our last block
-            block = self.create_block(signed_transaction, self.get_blockchain())
-            self._last_block = block
-            pass
+            if not Node.is_signed_transaction_valid(signed_transaction):
+                return  # I can only sign for my own address
+
+            # Queue it in the mempool, for mine_block (which runs right away if mine_each_transaction)
+            if self._mempool.add(signed_transaction, self.get_balance(from_address)):
+                for listener in self._transaction_listeners:
+                    listener(signed_transaction)
+                if self.mine_each_transaction:
+                    self.mine_block()
+
+    def receive_transaction(self, signed_transaction: SignedTransaction) -> bool:
+        # A transfer announced by another node: keep it in the mempool if it is signed and the sender can pay for it
+        # Only the genesis block creates coins: a transfer without a sender is never accepted
+        transaction = signed_transaction.transaction
+        if transaction.from_address is None or signed_transaction in self._mempool:
+            return False
+        if not Node.is_signed_transaction_valid(signed_transaction):
+            return False
+        if not self._mempool.add(signed_transaction, self.get_balance(transaction.from_address)):
+            return False
+        for listener in self._transaction_listeners:
+            listener(signed_transaction)
+        return True
+
+    def receive_block(self, block: Block) -> bool:
+        # A block announced by another node. It is accepted if it extends my blockchain
+        # (otherwise the caller should pull the other node's blockchain)
+        tip = self.get_blockchain()
+        if same_block(block, tip):
+            return True
+        if self._block_tree is not None:
+            # Kept even if it is on another branch, or parked until its previous block arrives
+            self._block_tree.add(block)
+            self._activate_best_tip()
+            return block.block_hash in self._block_tree
+        if tip is None or block.previous_hash != tip.block_hash:
+            return False
+        if not self._validator.validate([block], tip, self.get_balance, self._confirmed_in(tip)):
+            return False
+
+        # The mempool first, like in mine_block
+        self._mempool.remove(block.signed_transactions)
+        self._set_last_block(block)
+        return True
+
+    def mine_block(self) -> Optional[Block]:
+        # Pack as many pending transfers as fit into one block, and save it as our last block
+        signed_transactions = self._mempool.take_for_block(self.get_balance)
+        if not signed_transactions:
+            return None
+
+        # My own blocks are checked like the blocks of other nodes, so a bad transfer can't fork me off the network
+        tip = self.get_blockchain()
+        block = self.create_block(signed_transactions, tip)
+        if not self._validator.validate([block], tip, self.get_balance, self._confirmed_in(tip)):
+            # Otherwise the next block would be made of the same transfers, and fail again
+            self._mempool.drop(self._unminable(signed_transactions, tip))
+            return None
+        # The mempool first: listeners of the new tip expect its transfers to be gone from it
+        self._mempool.remove(signed_transactions)
+        self._set_last_block(block)
+        return block
+
+    def _unminable(self, signed_transactions: List[SignedTransaction], tip: Block) -> List[SignedTransaction]:
+        # The transfers that the validator rejects on top of tip whatever block they are in.
+        # (take_for_block already left out the ones the senders can't pay for)
+        is_confirmed = self._confirmed_in(tip)
+        signatures_valid = Node._signature_verifier.verify_many(signed_transactions)
+        return [signed_transaction
+                for signed_transaction, signature_valid in zip(signed_transactions, signatures_valid)
+                if not signature_valid or not is_well_formed(signed_transaction.transaction)
+                or signed_transaction.transaction.coins < 0 or is_confirmed(signed_transaction.digest())]
 
     def transfer_coins(self, to_address: str, coins: int) -> None:
         return self.make_transaction(self.address, to_address, coins)
 
     @staticmethod
-    def merge_blockchains(blockchain1: Block, blockchain2: Block) -> Optional[Block]:
+    def merge_blockchains(blockchain1: Optional[Block], blockchain2: Optional[Block]) -> Optional[Block]:
         # TODO: Pick the better chain and return it (How will we decide?)
-
-        block1 = blockchain1
-        block2 = blockchain2
-
-        count1 : int = 0
-        while block1.previous_block is not None:
-            block1 = block1.previous_block
-            count1 += 1
-
-        count2 : int = 0
-        while block2.previous_block is not None:
-            block2 = block2.previous_block
-            count2 += 1
-
-        return blockchain1 if count1 > count2 else blockchain2
+        # The chain with more work wins. Every block knows the total work behind it, so this is O(1)
+        if blockchain1 is None or blockchain2 is None:
+            return blockchain2 if blockchain1 is None else blockchain1
+        if (blockchain1.total_work, blockchain1.height) > (blockchain2.total_work, blockchain2.height):
+            return blockchain1
+        return blockchain2
 
     @staticmethod
     def calculate_balance(node_address, blockchain):
         balance = 0
+        blocks_walked = 0
         block = blockchain  # The blockchain is a reference to the last block
 
         while block is not None:
+            blocks_walked += 1
             # TODO: Update the balance
             # Hint: Here is the implementation for the previous version, before we started using blocks:
-            transaction: Transaction = block.signed_transaction.transaction
-            if transaction.to_address == node_address:
-                balance += transaction.coins
-            if transaction.from_address == node_address:
-                balance -= transaction.coins
+            for signed_transaction in block.signed_transactions:
+                transaction: Transaction = signed_transaction.transaction
+                if transaction.to_address == node_address:
+                    balance += transaction.coins
+                if transaction.from_address == node_address:
+                    balance -= transaction.coins
 
             block = block.previous_block
+        _balance_blocks_walked.observe(blocks_walked)
         return balance
 
     def sign(self, transaction: Transaction) -> SignedTransaction:
-        signature = f"signed_by_{self.address}"
-        return SignedTransaction(transaction, signature)
+        return SignedTransaction(transaction, sign_transaction(self._signing_key, transaction))
+
+    @staticmethod
+    def is_signed_transaction_valid(signed_transaction: SignedTransaction) -> bool:
+        return Node._signature_verifier.verify(signed_transaction)
+
+    @staticmethod
+    def are_signed_transactions_valid(signed_transactions: List[SignedTransaction]) -> bool:
+        # Verifies the whole batch in parallel
+        return all(Node._signature_verifier.verify_many(signed_transactions))
 
     def add_node(self, node: 'Node'):
         self._other_nodes.append(node)
 
     def pull_blockchains_from_other_nodes(self):
-        # For each node I know about
-        for node in self._other_nodes:
-
+        with REGISTRY.span('pyconcoin_pull', "Time to pull from all the other nodes", peers=len(self._other_nodes)):
+            # For each node I know about
             # Ask that node what blockchain (what history) it knows about
-            other_blockchain = node.get_blockchain()
-
-            # If it has any history
+            blockchains = self._get_blockchains(self._other_nodes)
+            for other_node, other_blockchain in zip(self._other_nodes, blockchains):
+                with REGISTRY.span('pyconcoin_pull_peer', "Time to merge one other node's blockchain",
+                                   labels={'peer': repr(other_node)}):
+                    self.pull_blockchain(other_blockchain)
+
+    def pull_blockchain(self, other_blockchain: Optional[Block]) -> None:
+        # Merge one other blockchain into mine (e.g. one that a node I don't keep in other_nodes sent me)
+        if self._block_tree is not None:
             if other_blockchain is not None:
-                # Merge the blockchains (hint: what if they are not the same?)
+                self._add_to_tree(other_blockchain)
+            return
+
+        # If it has any history
+        if other_blockchain is not None:
+            # Merge the blockchains (hint: what if they are not the same?)
+            with REGISTRY.span('pyconcoin_merge_blockchains', "Time to pick the better of two blockchains"):
                 merged_blockchain = Node.merge_blockchains(self.get_blockchain(), other_blockchain)
 
-                if merged_blockchain is not None:
+            if merged_blockchain is not None and not same_block(merged_blockchain, self.get_blockchain()):
+                fork_point = find_common_ancestor(self.get_blockchain(), merged_blockchain)
+                new_blocks = self._blocks_since_fork(merged_blockchain, fork_point)
+                if new_blocks is None:
+                    return
+
+                # Check the blocks that my blockchain doesn't have yet (proof of work, signatures, balances).
+                # They are streamed to the validator, oldest first, so a long chain is never all in memory
+                self._account_state.move_to(fork_point)
+                if self._validator.validate(new_blocks, fork_point, self._account_state.balance,
+                                            self._confirmed_in(fork_point)):
                     # Set my blockchain to the better (merged) blockchain
-                    self._last_block = merged_blockchain
+                    new_tip = Node._linked_to(merged_blockchain, fork_point)
+                    self._update_mempool(new_tip, fork_point)
+                    self._set_last_block(new_tip)
+                    _blocks_adopted.inc(merged_blockchain.height - (-1 if fork_point is None else fork_point.height))
+
+    def _add_to_tree(self, blockchain: Block) -> None:
+        # Keep the blocks of blockchain that my BlockTree doesn't have, even if it loses now: it may win later
+        lowest_height = 0 if self._last_block is None else self._last_block.height - self._block_tree.max_depth
+        new_blocks: List[Block] = []
+        block = blockchain
+        while block is not None and block.block_hash not in self._block_tree and block.height >= lowest_height:
+            new_blocks.append(block)
+            block = block.previous_block
+        for block in reversed(new_blocks):
+            self._block_tree.add(block)
+        self._activate_best_tip()
+
+    def _activate_best_tip(self) -> None:
+        # Switch to the branch of my BlockTree with the most work, if it has more than my blockchain.
+        # Only the blocks of it that were never validated are checked; the account state (and the other indexes)
+        # are moved by undoing my blocks back to the fork point and applying the branch's blocks.
+        # An invalid block is removed from the tree, with the blocks after it, and the next best branch is tried
+        tree = self._block_tree
+        while True:
+            tip = tree.best_tip()
+            current = self._last_block
+            if tip is None or (current is not None
+                               and (tip.total_work, tip.height) <= (current.total_work, current.height)):
+                return
+
+            fork_point = find_common_ancestor(current, tip)
+            undone = 0 if current is None else current.height - (-1 if fork_point is None else fork_point.height)
+            if undone > tree.max_depth:
+                # It forks too far back: forget the branch
+                block = tip
+                while block.previous_hash in tree and not same_block(block.previous_block, fork_point):
+                    block = block.previous_block
+                tree.remove(block)
+                continue
+
+            path = tree.unvalidated_path(tip)
+            start = path[0].previous_block if path else tip
+            self._account_state.move_to(start)
+            result = self._validator.validate(path, start, self._account_state.balance, self._confirmed_in(start))
+            tree.mark_valid(path[:result.blocks_checked])
+            if not result:
+                tree.remove(path[result.blocks_checked])
+                continue
+
+            self._update_mempool(tip, fork_point)
+            self._set_last_block(tip)
+            _blocks_adopted.inc(tip.height - (-1 if fork_point is None else fork_point.height))
+            return
+
+    def _confirmed_in(self, blockchain: Optional[Block]) -> Callable[[bytes], bool]:
+        # Whether a transaction (by digest) is in blockchain, for the validator
+        self._transaction_index.move_to(blockchain)
+        return lambda digest: self._transaction_index.find(digest) is not None
+
+    def _update_mempool(self, new_tip: Block, fork_point: Optional[Block]) -> None:
+        # Before switching from my blockchain to new_tip: the transfers of its blocks after fork_point are confirmed,
+        # and the ones of my blocks after fork_point (undone by the switch) are pending again, unless new_tip has them
+        confirmed = set()
+        block = new_tip
+        while not same_block(block, fork_point):
+            self._mempool.remove(block.signed_transactions)
+            confirmed.update(signed_transaction.digest() for signed_transaction in block.signed_transactions)
+            block = block.previous_block
+
+        undone_blocks = []
+        block = self._last_block
+        while not same_block(block, fork_point):
+            undone_blocks.append(block)
+            block = block.previous_block
+        if undone_blocks:
+            self._account_state.move_to(new_tip)
+            self._mempool.restore([signed_transaction for block in reversed(undone_blocks)
+                                   for signed_transaction in block.signed_transactions
+                                   if signed_transaction.digest() not in confirmed],
+                                  self._account_state.balance)
+
+    def _get_blockchains(self, nodes: List['Node']) -> List[Optional[Block]]:
+        # Nodes in other processes (network.RemoteNode) have a transport, which asks all of its nodes concurrently
+        remote_nodes_by_transport = {}
+        for node in nodes:
+            transport = getattr(node, 'transport', None)
+            if transport is not None:
+                remote_nodes_by_transport.setdefault(transport, []).append(node)
+
+        blockchains = {}
+        for transport, remote_nodes in remote_nodes_by_transport.items():
+            for node, blockchain in zip(remote_nodes, transport.get_blockchains(remote_nodes, self)):
+                blockchains[id(node)] = blockchain
+        return [blockchains[id(node)] if id(node) in blockchains else node.get_blockchain() for node in nodes]
+
+    def _blocks_since_fork(self, blockchain: Block, fork_point: Optional[Block]) -> Optional[Iterator[Block]]:
+        # The blocks that blockchain has after fork_point (my last block it also has), oldest first, as they are read.
+        # None if it forks before the first block I have (I can't undo my blocks that far),
+        # or if blockchain is pruned after the fork (so its new blocks can't all be checked)
+        if self._root is not None and (fork_point is None or fork_point.height < self._root.height):
+            return None
+        return blocks_between(blockchain, fork_point)
+
+    @staticmethod
+    def _linked_to(blockchain: Block, fork_point: Optional[Block]) -> Block:
+        # blockchain, on top of my own fork_point. Usually it already is,
+        # but another node's copy of fork_point may lead to different (e.g. pruned) history than mine
+        new_blocks = blocks_between(blockchain, fork_point)
+        first_block = next(new_blocks)
+        if first_block.previous_block is fork_point:
+            return blockchain
+        tip = first_block.relinked(fork_point)
+        for block in new_blocks:
+            tip = block.relinked(tip)
+        return tip
@@ -1,33 +1,52 @@
 import random
-from dataclasses import dataclass
-from typing import List, Optional
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 import nacl.signing
 
+from signatures import SignatureVerifier, address_of, sign_transaction
+
 
 @dataclass
 class Transaction:
     from_address: Optional[str]  # For the initial transaction, the from_address will be None
     to_address: str
     coins: int
+    # Random, so two transfers of the same coins between the same addresses are still different transactions
+    salt: int = field(default_factory=lambda: random.getrandbits(64))
 
 @dataclass
 class SignedTransaction:
     transaction: Transaction
-    signature: str
-    
+    signature: bytes  # Ed25519 signature of the transaction, by the sender's key (see signatures.py)
+
+    def transaction_id(self) -> str:
+        # A stable content ID: the same transaction gets the same ID on every node
+        transaction = self.transaction
+        encoded = repr((transaction.from_address, transaction.to_address, transaction.coins, transaction.salt,
+                        self.signature))
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
 
 class Node:
+    # Shared by all nodes, so a transaction that several nodes pull is only verified once
+    _signature_verifier = SignatureVerifier()
+
     def __init__(self, other_nodes: List['Node'] = None, initial_coins: int = None):
         self._signed_transactions: List[SignedTransaction] = []
-        self.address = random.randint(0, 1000)
+        self._transaction_ids: Set[str] = set()  # The IDs of everything in _signed_transactions, for O(1) lookups
+
+        # For every node we pulled from: how many of its transactions we already have
+        self._sync_positions: Dict['Node', int] = {}
         self._other_nodes: List[Node] = []
         self._signing_key = nacl.signing.SigningKey.generate()
+        self.address = address_of(self._signing_key)
 
         # If this is the first node
         if other_nodes is None and initial_coins is not None:
             # TODO: Create an initial transaction (from_address=None) and save it to the _signed_transactions list
-            signed = SignedTransaction(Transaction(None, self.address, initial_coins), "signature")
-            self._signed_transactions.append(signed)
+            signed = self.sign(Transaction(None, self.address, initial_coins))
+            self._add_signed_transaction(signed)
             pass
 
         # If this is not the first node
@@ -57,18 +76,42 @@ class Node:
         # IF from has enough coins in his balance
         if self.calculate_balance(from_address) >= coins:
             # TODO: Make a new signed transaction and save it to the _signed_transactions list
-            new_trans = SignedTransaction(Transaction(from_address, to_address, coins), "signature")
-            self._signed_transactions.append(new_trans)
+            new_trans = self.sign(Transaction(from_address, to_address, coins))
+            self._add_signed_transaction(new_trans)
             pass
 
     def transfer_coins(self, to_address: str, coins: int) -> None:
         return self.make_transaction(self.address, to_address, coins)
 
+    def sign(self, transaction: Transaction) -> SignedTransaction:
+        return SignedTransaction(transaction, sign_transaction(self._signing_key, transaction))
+
+    @staticmethod
+    def is_signed_transaction_valid(signed_transaction: SignedTransaction) -> bool:
+        return Node._signature_verifier.verify(signed_transaction)
+
+    def _add_signed_transaction(self, signed_transaction: SignedTransaction) -> None:
+        self._transaction_ids.add(signed_transaction.transaction_id())
+        self._signed_transactions.append(signed_transaction)
+
+    def get_signed_transactions_since(self, position: int) -> Tuple[List[SignedTransaction], int]:
+        # _signed_transactions is append-only, so a position in it is a high-water mark:
+        # return what was appended after it, and the position to ask from next time
+        return self._signed_transactions[position:], len(self._signed_transactions)
+
     def pull_transactions_from_other_nodes(self):
         # TODO (bonus) : For every node in self._other_nodes,
         #  If that node knows about a SignedTransaction that this node doesn't know about,
         #  Then copy that SignedTransaction to this node
+        # Only the transactions each node added since our last pull are transferred and checked
         for node in self._other_nodes:
-            for transaction in node._signed_transactions:
-                if transaction not in self._signed_transactions:
-                    self._signed_transactions.append(transaction)
\ No newline at end of file
+            new_transactions, position = node.get_signed_transactions_since(self._sync_positions.get(node, 0))
+            new_transactions = [transaction for transaction in new_transactions
+                                if transaction.transaction_id() not in self._transaction_ids]
+
+            # Verify the signatures of the whole batch at once, and skip forged transactions
+            valid = Node._signature_verifier.verify_many(new_transactions)
+            for transaction, is_valid in zip(new_transactions, valid):
+                if is_valid:
+                    self._add_signed_transaction(transaction)
+            self._sync_positions[node] = position
@@ -0,0 +1,324 @@
+import json
+import mmap
+import os
+import struct
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+from blockchain import HEADER_SIZE, Block, SignedTransaction, Transaction, intern_block
+from signatures import is_well_formed
+from snapshot import Snapshot
+
+# blocks.dat: Append-only segment of records: [payload size][header][height][total work][transactions as JSON]
+RECORD_SIZE_FORMAT = '>I'
+RECORD_SIZE_SIZE = struct.calcsize(RECORD_SIZE_FORMAT)
+TOTAL_WORK_SIZE = 40  # Enough for 2 ** 64 blocks of 256 bits of difficulty
+
+# heights.idx: [number of heights], then the offset of the block at each height of the stored chain
+HEIGHTS_HEADER_FORMAT = '>Q'
+OFFSET_FORMAT = '>Q'
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+# hashes.idx: [capacity][number of entries][committed segment size], then an open-addressing hash table
+# of [block hash][offset + 1] slots (0 marks an empty slot). The committed size is written last by a flush:
+# the records after it, and the index entries that point to them, are dropped on open
+HASHES_HEADER_FORMAT = '>QQQ'
+HASH_SLOT_SIZE = 32 + OFFSET_SIZE
+
+INITIAL_CAPACITY = 1024
+
+
+def encode_transaction(signed_transaction: SignedTransaction) -> list:
+    transaction = signed_transaction.transaction
+    signature = signed_transaction.signature
+    if isinstance(signature, bytes):
+        signature = {'hex': signature.hex()}  # JSON has no bytes
+    return [transaction.from_address, transaction.to_address, transaction.coins, transaction.salt, signature]
+
+
+def decode_transaction(encoded: list) -> SignedTransaction:
+    # encoded may come from another node: anything but the shape encode_transaction makes is a ValueError
+    if type(encoded) is not list or len(encoded) != 5:
+        raise ValueError("A transaction is a list of 5 fields")
+    from_address, to_address, coins, salt, signature = encoded
+    if type(signature) is dict and type(signature.get('hex')) is str:
+        signature = bytes.fromhex(signature['hex'])
+    transaction = Transaction(from_address, to_address, coins, salt)
+    if not is_well_formed(transaction) or type(salt) is not int or type(signature) not in (str, bytes):
+        raise ValueError("Malformed transaction")
+    return SignedTransaction(transaction, signature)
+
+
+def encode_block(block: Block) -> bytes:
+    encoded_transactions = json.dumps([encode_transaction(signed_transaction)
+                                       for signed_transaction in block.signed_transactions])
+    return (block.header() + struct.pack('>Q', block.height) + block.total_work.to_bytes(TOTAL_WORK_SIZE, 'big')
+            + encoded_transactions.encode('utf-8'))
+
+
+def decode_block(payload: bytes, load_block) -> Block:
+    header = payload[:HEADER_SIZE]
+    height, = struct.unpack_from('>Q', payload, HEADER_SIZE)
+    total_work_start = HEADER_SIZE + 8
+    total_work = int.from_bytes(payload[total_work_start:total_work_start + TOTAL_WORK_SIZE], 'big')
+    signed_transactions = [decode_transaction(encoded)
+                           for encoded in json.loads(payload[total_work_start + TOTAL_WORK_SIZE:])]
+    return Block.restore(header, signed_transactions, height, total_work, load_block)
+
+
+class BlockStore:
+    """
+    On-disk storage of a node's blocks.
+
+    Blocks are appended to a segment file, and found through two memory-mapped indexes:
+    height -> offset (for the stored tip's chain) and block hash -> offset (for every stored block).
+    Opening a store only maps the indexes; blocks are read when they are asked for, and their
+    previous_block is loaded when it is first accessed.
+
+    Appends are buffered, and written + fsync'd together every sync_every blocks (and on flush / close).
+    The node saves the balances as of one of its blocks next to them (see save_snapshot).
+    """
+
+    def __init__(self, directory: str, sync_every: int = 64):
+        self.sync_every = sync_every
+        os.makedirs(directory, exist_ok=True)
+        self._snapshot_path = os.path.join(directory, 'balances.snap')
+
+        self._segment = open(os.path.join(directory, 'blocks.dat'), 'a+b')
+        self._heights_file, self._heights = self._open_index(os.path.join(directory, 'heights.idx'),
+                                                             struct.calcsize(HEIGHTS_HEADER_FORMAT)
+                                                             + INITIAL_CAPACITY * OFFSET_SIZE)
+        self._hashes_file, self._hashes = self._open_index(os.path.join(directory, 'hashes.idx'),
+                                                           struct.calcsize(HASHES_HEADER_FORMAT)
+                                                           + INITIAL_CAPACITY * HASH_SLOT_SIZE)
+        if self._hash_table_header()[0] == 0:
+            struct.pack_into(HASHES_HEADER_FORMAT, self._hashes, 0, INITIAL_CAPACITY, 0, 0)
+
+        self._segment_size = self._hash_table_header()[2]
+        self._height_count, = struct.unpack_from(HEIGHTS_HEADER_FORMAT, self._heights, 0)
+        self._segment.seek(0, os.SEEK_END)
+        if self._segment.tell() > self._segment_size:
+            # A flush didn't finish (e.g. a crash): some of its index entries may be written, but not committed
+            self._segment.truncate(self._segment_size)
+            self._rehash(self._hash_table_header()[0], self._segment_size)
+            # The blocks it appended are the last heights of the chain
+            while self._height_count > 0 and self._stored_height_offset(self._height_count - 1) >= self._segment_size:
+                self._height_count -= 1
+
+        # Appended but not yet flushed
+        self._pending_records: List[bytes] = []
+        self._pending_size = 0
+        self._pending_offsets: Dict[bytes, int] = {}
+        self._pending_blocks: Dict[int, Block] = {}  # offset -> block
+        self._pending_heights: Dict[int, int] = {}  # height -> offset
+
+        # Blocks that are already in memory, so loading the same block twice returns the same object
+        self._loaded: 'weakref.WeakValueDictionary[bytes, Block]' = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def _open_index(path: str, initial_size: int) -> Tuple:
+        if not os.path.exists(path):
+            with open(path, 'wb') as file:
+                file.truncate(initial_size)
+        file = open(path, 'r+b')
+        return file, mmap.mmap(file.fileno(), 0)
+
+    def _hash_table_header(self) -> Tuple[int, int, int]:
+        return struct.unpack_from(HASHES_HEADER_FORMAT, self._hashes, 0)
+
+    def __len__(self) -> int:
+        # The number of blocks in the stored tip's chain
+        return self._height_count
+
+    def __contains__(self, block_hash: bytes) -> bool:
+        return self._offset_of(block_hash) is not None
+
+    def tip(self) -> Optional[Block]:
+        return self.get(len(self) - 1) if len(self) > 0 else None
+
+    def get(self, height: int) -> Block:
+        if not 0 <= height < len(self):
+            raise IndexError(f"No block at height {height}")
+        return self._read(self._height_offset(height))
+
+    def _height_offset(self, height: int) -> int:
+        offset = self._pending_heights.get(height)
+        if offset is None:
+            offset = self._stored_height_offset(height)
+        return offset
+
+    def _stored_height_offset(self, height: int) -> int:
+        offset, = struct.unpack_from(OFFSET_FORMAT, self._heights,
+                                     struct.calcsize(HEIGHTS_HEADER_FORMAT) + height * OFFSET_SIZE)
+        return offset
+
+    def get_by_hash(self, block_hash: bytes) -> Optional[Block]:
+        block = self._loaded.get(block_hash)
+        if block is not None:
+            return block
+        offset = self._offset_of(block_hash)
+        return None if offset is None else self._read(offset)
+
+    def set_tip(self, tip: Optional[Block]) -> None:
+        """
+        Make tip the stored chain's tip, appending the blocks that are not stored yet.
+        Only the blocks after the last block the old and new chains share are written.
+        """
+        changed: List[Block] = []
+        block = tip
+        while block is not None and not self._is_stored_at_its_height(block):
+            changed.append(block)
+            block = block.previous_block
+
+        for block in reversed(changed):
+            offset = self._offset_of(block.block_hash)
+            if offset is None:
+                offset = self._append(block)
+            self._pending_heights[block.height] = offset
+
+        self._height_count = 0 if tip is None else tip.height + 1
+        if len(self._pending_records) >= self.sync_every:
+            self.flush()
+
+    def _is_stored_at_its_height(self, block: Block) -> bool:
+        # Compares offsets, so no block has to be read
+        if block.height >= len(self):
+            return False
+        return self._height_offset(block.height) == self._offset_of(block.block_hash)
+
+    def _append(self, block: Block) -> int:
+        payload = encode_block(block)
+        offset = self._segment_size + self._pending_size
+        record = struct.pack(RECORD_SIZE_FORMAT, len(payload)) + payload
+        self._pending_records.append(record)
+        self._pending_size += len(record)
+        self._pending_offsets[block.block_hash] = offset
+        self._pending_blocks[offset] = block
+        self._loaded[block.block_hash] = block
+        return offset
+
+    def flush(self) -> None:
+        # Write the batch and fsync once, then publish it in the indexes, and commit it once they are synced too
+        if self._pending_records:
+            self._segment.seek(0, os.SEEK_END)
+            self._segment.write(b''.join(self._pending_records))
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._segment_size = self._segment.tell()
+
+        for block_hash, offset in self._pending_offsets.items():
+            self._insert_hash(block_hash, offset)
+        for height, offset in self._pending_heights.items():
+            self._set_height_offset(height, offset)
+        struct.pack_into(HEIGHTS_HEADER_FORMAT, self._heights, 0, self._height_count)
+        self._heights.flush()
+        self._hashes.flush()
+        self._commit()
+
+        self._pending_records.clear()
+        self._pending_size = 0
+        self._pending_offsets.clear()
+        self._pending_blocks.clear()
+        self._pending_heights.clear()
+
+    def _commit(self) -> None:
+        capacity, count, _ = self._hash_table_header()
+        struct.pack_into(HASHES_HEADER_FORMAT, self._hashes, 0, capacity, count, self._segment_size)
+        self._hashes.flush()
+
+    def save_snapshot(self, snapshot: Snapshot) -> None:
+        # Replaces the saved one. Its block may not be flushed yet: if it never is, load_snapshot's block isn't stored
+        snapshot.save(self._snapshot_path)
+
+    def load_snapshot(self) -> Optional[Snapshot]:
+        return Snapshot.load(self._snapshot_path) if os.path.exists(self._snapshot_path) else None
+
+    def close(self) -> None:
+        self.flush()
+        for index, file in [(self._heights, self._heights_file), (self._hashes, self._hashes_file)]:
+            index.close()
+            file.close()
+        self._segment.close()
+
+    def __enter__(self) -> 'BlockStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _read(self, offset: int) -> Block:
+        block = self._pending_blocks.get(offset)
+        if block is not None:
+            return block
+
+        self._segment.seek(offset)
+        size, = struct.unpack(RECORD_SIZE_FORMAT, self._segment.read(RECORD_SIZE_SIZE))
+        block = decode_block(self._segment.read(size), self.get_by_hash)
+
+        # Another copy may already be in memory (e.g. the tip, or a block someone still holds)
+        return self._loaded.setdefault(block.block_hash, intern_block(block))
+
+    def _set_height_offset(self, height: int, offset: int) -> None:
+        position = struct.calcsize(HEIGHTS_HEADER_FORMAT) + height * OFFSET_SIZE
+        if position + OFFSET_SIZE > len(self._heights):
+            self._heights = self._grow(self._heights, self._heights_file, 2 * len(self._heights))
+        struct.pack_into(OFFSET_FORMAT, self._heights, position, offset)
+
+    @staticmethod
+    def _grow(index: mmap.mmap, file, size: int) -> mmap.mmap:
+        index.close()
+        file.truncate(size)
+        return mmap.mmap(file.fileno(), 0)
+
+    def _offset_of(self, block_hash: bytes) -> Optional[int]:
+        offset = self._pending_offsets.get(block_hash)
+        if offset is not None:
+            return offset
+
+        capacity = self._hash_table_header()[0]
+        slot = int.from_bytes(block_hash[:8], 'big') % capacity
+        while True:
+            position = struct.calcsize(HASHES_HEADER_FORMAT) + slot * HASH_SLOT_SIZE
+            stored_offset, = struct.unpack_from(OFFSET_FORMAT, self._hashes, position + 32)
+            if stored_offset == 0:
+                return None
+            if self._hashes[position:position + 32] == block_hash:
+                return stored_offset - 1
+            slot = (slot + 1) % capacity
+
+    def _insert_hash(self, block_hash: bytes, offset: int) -> None:
+        capacity, count, committed_size = self._hash_table_header()
+        if 2 * (count + 1) > capacity:
+            self._rehash(2 * capacity)
+            capacity, count, committed_size = self._hash_table_header()
+
+        slot = int.from_bytes(block_hash[:8], 'big') % capacity
+        while True:
+            position = struct.calcsize(HASHES_HEADER_FORMAT) + slot * HASH_SLOT_SIZE
+            stored_offset, = struct.unpack_from(OFFSET_FORMAT, self._hashes, position + 32)
+            if stored_offset == 0:
+                break
+            if self._hashes[position:position + 32] == block_hash:
+                return
+            slot = (slot + 1) % capacity
+
+        self._hashes[position:position + 32] = block_hash
+        struct.pack_into(OFFSET_FORMAT, self._hashes, position + 32, offset + 1)
+        struct.pack_into(HASHES_HEADER_FORMAT, self._hashes, 0, capacity, count + 1, committed_size)
+
+    def _rehash(self, new_capacity: int, segment_size: Optional[int] = None) -> None:
+        # Entries that point at or after segment_size (if given) are dropped
+        capacity, _, committed_size = self._hash_table_header()
+        header_size = struct.calcsize(HASHES_HEADER_FORMAT)
+        entries = []
+        for slot in range(capacity):
+            position = header_size + slot * HASH_SLOT_SIZE
+            stored_offset, = struct.unpack_from(OFFSET_FORMAT, self._hashes, position + 32)
+            if stored_offset != 0 and (segment_size is None or stored_offset - 1 < segment_size):
+                entries.append((bytes(self._hashes[position:position + 32]), stored_offset - 1))
+
+        self._hashes = self._grow(self._hashes, self._hashes_file, header_size + new_capacity * HASH_SLOT_SIZE)
+        self._hashes[header_size:] = bytes(new_capacity * HASH_SLOT_SIZE)
+        struct.pack_into(HASHES_HEADER_FORMAT, self._hashes, 0, new_capacity, 0, committed_size)
+        for block_hash, offset in entries:
+            self._insert_hash(block_hash, offset)
@@ -0,0 +1,200 @@
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional, Tuple
+
+# blocks_between keeps one block in every SEGMENT_SIZE in memory, and one segment at a time
+SEGMENT_SIZE = 1024
+
+
+def same_block(block1, block2) -> bool:
+    # Blocks are compared by hash: the same block may be loaded or received more than once
+    if block1 is None or block2 is None:
+        return block1 is block2
+    return block1.block_hash == block2.block_hash
+
+
+def find_common_ancestor(block1, block2) -> Optional['Block']:
+    """
+    Return the last block shared by both chains (None if they share nothing).
+    Uses the block heights, so only the diverging suffix of each chain is walked.
+    """
+    if block1 is None or block2 is None:
+        return None
+
+    # Bring both chains to the same height (a pruned chain may end before it)
+    while block1 is not None and block1.height > block2.height:
+        block1 = block1.previous_block
+    while block1 is not None and block2 is not None and block2.height > block1.height:
+        block2 = block2.previous_block
+
+    # Walk back together until they meet
+    while not same_block(block1, block2):
+        if block1 is None or block2 is None:
+            return None
+        block1 = block1.previous_block
+        block2 = block2.previous_block
+    return block1
+
+
+def blocks_between(tip, fork_point, segment_size: int = SEGMENT_SIZE) -> Optional[Iterator['Block']]:
+    """
+    The blocks after fork_point up to tip, oldest first, without holding all of them: a first walk back from tip
+    keeps every segment_size-th block, then each segment is walked again when the iterator gets to it.
+    So O(n / segment_size + segment_size) blocks are in memory, and the others can stay in a BlockStore.
+    None if tip's chain doesn't lead back to fork_point (it was pruned after it).
+    """
+    checkpoints = []  # Newest first: tip, then every segment_size-th block before it
+    count = 0
+    block = tip
+    while not same_block(block, fork_point):
+        if block is None or (block.previous_block is None and block.height > 0):
+            return None
+        if count % segment_size == 0:
+            checkpoints.append(block)
+        count += 1
+        block = block.previous_block
+    return _segments_oldest_first(checkpoints, count, segment_size)
+
+
+def _segments_oldest_first(checkpoints: list, count: int, segment_size: int) -> Iterator['Block']:
+    for index in reversed(range(len(checkpoints))):
+        segment = []
+        block = checkpoints[index]
+        for _ in range(min(segment_size, count - index * segment_size)):
+            segment.append(block)
+            block = block.previous_block
+        yield from reversed(segment)
+
+
+class TipIndex(ABC):
+    """
+    Base class for indexes of one chain tip (e.g. AccountState).
+
+    Subclasses update the index for one block in apply_block / undo_block (which also move self.tip),
+    and move_to only undoes / applies the blocks that are not shared by the old and new chains,
+    so appending one block costs O(1) and a reorg costs O(fork depth).
+    """
+
+    def __init__(self):
+        self.tip = None
+
+    @abstractmethod
+    def apply_block(self, block) -> None:
+        pass
+
+    @abstractmethod
+    def undo_block(self, block) -> None:
+        pass
+
+    def move_to(self, new_tip) -> int:
+        # Make new_tip the indexed tip. Returns how many blocks were undone and applied
+        if same_block(new_tip, self.tip):
+            return 0
+
+        fork_point = find_common_ancestor(self.tip, new_tip)
+
+        blocks_to_apply: List[object] = []
+        block = new_tip
+        while not same_block(block, fork_point):
+            blocks_to_apply.append(block)
+            block = block.previous_block
+
+        # Roll back our blocks that are not part of the new chain
+        blocks_undone = 0
+        while not same_block(self.tip, fork_point):
+            self.undo_block(self.tip)
+            blocks_undone += 1
+
+        for block in reversed(blocks_to_apply):
+            self.apply_block(block)
+        return blocks_undone + len(blocks_to_apply)
+
+
+# A block locator lists the (height, hash) of the last LOCATOR_DENSE_BLOCKS blocks of a chain,
+# then of blocks further and further back (the gaps double), down to the genesis
+LOCATOR_DENSE_BLOCKS = 10
+
+
+def locator_heights(chain_length: int) -> List[int]:
+    # The heights in the locator of a chain of chain_length blocks, from the tip down
+    heights = []
+    height = chain_length - 1
+    step = 1
+    while height > 0:
+        heights.append(height)
+        if len(heights) >= LOCATOR_DENSE_BLOCKS:
+            step *= 2
+        height -= step
+    if chain_length > 0:
+        heights.append(0)
+    return heights
+
+
+class ChainIndex:
+    """
+    The blocks of one chain, by height.
+    Like AccountState, it follows a tip: moving to a new tip only touches the blocks after the fork.
+    A pruned chain starts at the height of its first block instead of at the genesis.
+    """
+
+    def __init__(self):
+        self._blocks: List['Block'] = []
+        self._start_height = 0  # The height of self._blocks[0]
+
+    @property
+    def tip(self) -> Optional['Block']:
+        return self._blocks[-1] if self._blocks else None
+
+    def __len__(self) -> int:
+        # The length of the chain, including the pruned blocks
+        return self._start_height + len(self._blocks)
+
+    def block_at(self, height: int) -> Optional['Block']:
+        index = height - self._start_height
+        return self._blocks[index] if 0 <= index < len(self._blocks) else None
+
+    def contains(self, block) -> bool:
+        return same_block(self.block_at(block.height), block)
+
+    def move_to(self, new_tip) -> None:
+        new_blocks: List['Block'] = []
+        block = new_tip
+        while block is not None and not self.contains(block):
+            new_blocks.append(block)
+            block = block.previous_block
+
+        if block is None:
+            # Nothing in common: the new chain starts at its genesis, or at the first block of a pruned chain
+            self._blocks = []
+            self._start_height = new_blocks[-1].height if new_blocks else 0
+        else:
+            del self._blocks[block.height + 1 - self._start_height:]
+        self._blocks.extend(reversed(new_blocks))
+
+    def locator(self) -> List[Tuple[int, bytes]]:
+        heights = [height for height in locator_heights(len(self)) if height >= self._start_height]
+        if self._blocks and heights[-1] != self._start_height:
+            heights.append(self._start_height)  # A pruned chain ends its locator with its first block
+        return [(height, self.block_at(height).block_hash) for height in heights]
+
+    def find_fork(self, locator: List[Tuple[int, bytes]]) -> Optional['Block']:
+        # The highest block of the locator that is in this chain (None if they don't even share the genesis)
+        for height, block_hash in locator:
+            block = self.block_at(height)
+            if block is not None and block.block_hash == block_hash:
+                return block
+        return None
+
+    def blocks_after(self, locator: List[Tuple[int, bytes]], max_count: int) -> Tuple[Optional['Block'], List['Block']]:
+        # The fork point with the locator's chain, and up to max_count of this chain's blocks after it
+        fork_point = self.find_fork(locator)
+        start = 0 if fork_point is None else fork_point.height + 1 - self._start_height
+        return fork_point, self._blocks[start:start + max_count]
+
+    def blocks(self, heights_and_hashes: List[Tuple[int, bytes]]) -> List['Block']:
+        # The blocks of this chain with these heights and hashes (the ones it doesn't have are skipped)
+        blocks = []
+        for height, block_hash in heights_and_hashes:
+            block = self.block_at(height)
+            if block is not None and block.block_hash == block_hash:
+                blocks.append(block)
+        return blocks
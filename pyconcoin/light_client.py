@@ -0,0 +1,121 @@
+import hashlib
+import struct
+from typing import List, Optional, Tuple
+
+from blockchain import GENESIS_PREVIOUS_HASH, HEADER_PREFIX_FORMAT, Node, SignedTransaction, TransactionProof
+from chain import locator_heights
+from mining import meets_difficulty
+
+HEADERS_PER_REQUEST = 2000
+
+
+class LightClient:
+    """
+    A wallet that doesn't store or replay the blockchain.
+
+    It only keeps the block headers of the best chain a full node showed it (checking that they link up and
+    have the proof of work), and checks transactions with the Merkle proofs the full node sends:
+    a few hundred bytes per transaction instead of all the blocks.
+
+    A proof shows a transaction is in the chain. It can't show the full node didn't leave some out,
+    so a balance from address_transactions() is only as complete as the full node is honest.
+    """
+
+    def __init__(self, full_node: Node, confirmations: int = 1):
+        self.full_node = full_node
+        self.confirmations = confirmations  # A transaction counts once it is this many blocks deep (1 = in the tip)
+        self._headers: List[bytes] = []
+        self._hashes: List[bytes] = []
+        self._total_work: List[int] = []  # The total work of the chain up to each height
+
+    @property
+    def height(self) -> int:
+        # The height of the last header (-1 if there are none yet)
+        return len(self._headers) - 1
+
+    @property
+    def total_work(self) -> int:
+        return self._total_work[-1] if self._total_work else 0
+
+    def header_at(self, height: int) -> Optional[bytes]:
+        return self._headers[height] if 0 <= height < len(self._headers) else None
+
+    def sync(self) -> bool:
+        """
+        Fetch the headers after the last ones we share with the full node.
+        They replace ours after the fork point if their chain has more work. Returns True if our chain changed.
+        """
+        heights = locator_heights(len(self._hashes))
+        fork_height, headers = self.full_node.get_headers_after([(height, self._hashes[height]) for height in heights],
+                                                                HEADERS_PER_REQUEST)
+        if fork_height >= 0 and fork_height not in heights:
+            return False  # Not a block of our locator
+
+        new_headers: List[bytes] = []
+        new_hashes: List[bytes] = []
+        new_total_work: List[int] = []
+        previous_hash = self._hashes[fork_height] if fork_height >= 0 else GENESIS_PREVIOUS_HASH
+        total_work = self._total_work[fork_height] if fork_height >= 0 else 0
+        while True:
+            for header in headers:
+                header_previous_hash, _, _, difficulty = struct.unpack_from(HEADER_PREFIX_FORMAT, header)
+                block_hash = hashlib.sha256(header).digest()
+                if header_previous_hash != previous_hash or not meets_difficulty(block_hash, difficulty):
+                    return False  # Not a valid chain: keep ours
+                total_work += 2 ** difficulty
+                previous_hash = block_hash
+                new_headers.append(header)
+                new_hashes.append(block_hash)
+                new_total_work.append(total_work)
+            if len(headers) < HEADERS_PER_REQUEST:
+                break
+
+            # There are more headers: continue from the last one
+            last_height = fork_height + len(new_headers)
+            next_fork_height, headers = self.full_node.get_headers_after([(last_height, previous_hash)],
+                                                                         HEADERS_PER_REQUEST)
+            if next_fork_height != last_height:
+                return False  # The full node's chain changed in the meantime: try again later
+
+        if total_work <= self.total_work:
+            return False
+        del self._headers[fork_height + 1:], self._hashes[fork_height + 1:], self._total_work[fork_height + 1:]
+        self._headers.extend(new_headers)
+        self._hashes.extend(new_hashes)
+        self._total_work.extend(new_total_work)
+        return True
+
+    def verify_proof(self, proof: TransactionProof) -> bool:
+        # The proof's block is in our header chain, deep enough, and its header commits to the transaction
+        header = self.header_at(proof.height)
+        if header is None or self._hashes[proof.height] != proof.block_hash:
+            return False
+        if self.height - proof.height + 1 < self.confirmations:
+            return False
+        _, transactions_digest, _, _ = struct.unpack_from(HEADER_PREFIX_FORMAT, header)
+        return proof.transactions_digest() == transactions_digest
+
+    def verify_payment(self, signed_transaction: SignedTransaction) -> bool:
+        # Was this payment made? Asks the full node for its proof (O(log n) hashes), and checks it against the headers
+        proof = self.full_node.get_transaction_proof(signed_transaction.digest())
+        return proof is not None and proof.signed_transaction == signed_transaction and self.verify_proof(proof)
+
+    def address_transactions(self, address) -> List[Tuple[int, SignedTransaction]]:
+        # The (height, transaction) of the proven transactions that send coins from or to address, oldest first
+        transactions = []
+        for proof in self.full_node.get_address_proofs(address):
+            transaction = proof.signed_transaction.transaction
+            if address in (transaction.from_address, transaction.to_address) and self.verify_proof(proof):
+                transactions.append((proof.height, proof.signed_transaction))
+        return transactions
+
+    def balance(self, address) -> int:
+        # The balance from the proven transactions of address
+        balance = 0
+        for _, signed_transaction in self.address_transactions(address):
+            transaction = signed_transaction.transaction
+            if transaction.from_address == address:
+                balance -= transaction.coins
+            if transaction.to_address == address:
+                balance += transaction.coins
+        return balance
@@ -0,0 +1,116 @@
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Iterable, List
+
+from signatures import is_well_formed, transaction_message
+
+DEFAULT_MAX_BLOCK_TRANSACTIONS = 1000
+DEFAULT_MAX_BLOCK_BYTES = 1_000_000
+
+# How many confirmed transactions to remember, so one that is announced again isn't accepted twice
+RECENTLY_CONFIRMED_LIMIT = 100_000
+
+
+def transaction_size(signed_transaction) -> int:
+    # Roughly what the transaction costs in a block
+    return len(transaction_message(signed_transaction.transaction)) + len(signed_transaction.signature)
+
+
+class Mempool:
+    """
+    Transfers that were accepted but are not in a block yet.
+
+    A transfer is accepted if the sender can pay for it on top of everything they already have pending,
+    and take_for_block() picks the oldest transfers that fit in one block.
+    """
+
+    def __init__(self, max_block_transactions: int = DEFAULT_MAX_BLOCK_TRANSACTIONS,
+                 max_block_bytes: int = DEFAULT_MAX_BLOCK_BYTES):
+        self.max_block_transactions = max_block_transactions
+        self.max_block_bytes = max_block_bytes
+        self._pending: 'OrderedDict[bytes, object]' = OrderedDict()  # Transaction digest -> SignedTransaction
+        self._pending_spent: Dict[str, int] = defaultdict(int)
+        self._recently_confirmed: 'OrderedDict[bytes, None]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, signed_transaction) -> bool:
+        return signed_transaction.digest() in self._pending
+
+    def pending_spent(self, address) -> int:
+        return self._pending_spent.get(address, 0)
+
+    def add(self, signed_transaction, confirmed_balance: int) -> bool:
+        # confirmed_balance is the sender's balance in the current chain.
+        # Like make_transaction, the sender has to keep more than they send.
+        # Only the genesis block creates coins, so a transfer without a sender is never accepted
+        transaction = signed_transaction.transaction
+        if not is_well_formed(transaction) or transaction.from_address is None:
+            return False
+        digest = signed_transaction.digest()
+        if digest in self._pending or digest in self._recently_confirmed:
+            return False
+        if confirmed_balance - self.pending_spent(transaction.from_address) <= transaction.coins:
+            return False
+        self._pending_spent[transaction.from_address] += transaction.coins
+
+        self._pending[digest] = signed_transaction
+        return True
+
+    def take_for_block(self, balance: Callable[[str], int]) -> List:
+        """
+        The oldest transfers that fit in a block (max_block_transactions / max_block_bytes).
+        Transfers the sender can't pay for with their current balance are left for later.
+        The transfers stay pending until remove() is called with them.
+        """
+        block_transactions = []
+        block_bytes = 0
+        spent_in_block: Dict[str, int] = defaultdict(int)
+
+        for signed_transaction in self._pending.values():
+            if len(block_transactions) >= self.max_block_transactions:
+                break
+            size = transaction_size(signed_transaction)
+            if block_bytes + size > self.max_block_bytes:
+                break
+
+            transaction = signed_transaction.transaction
+            sender = transaction.from_address
+            if balance(sender) - spent_in_block[sender] <= transaction.coins:
+                continue
+            spent_in_block[sender] += transaction.coins
+
+            block_transactions.append(signed_transaction)
+            block_bytes += size
+        return block_transactions
+
+    def remove(self, signed_transactions: Iterable) -> None:
+        # Called with the transactions of new blocks: they are not pending anymore
+        for signed_transaction in signed_transactions:
+            digest = signed_transaction.digest()
+            self._recently_confirmed[digest] = None
+            if len(self._recently_confirmed) > RECENTLY_CONFIRMED_LIMIT:
+                self._recently_confirmed.popitem(last=False)
+            self._pop(digest)
+
+    def drop(self, signed_transactions: Iterable) -> None:
+        # Called with transfers that can never be in a block (e.g. badly signed): forgotten, not confirmed
+        for signed_transaction in signed_transactions:
+            self._pop(signed_transaction.digest())
+
+    def _pop(self, digest: bytes) -> None:
+        removed = self._pending.pop(digest, None)
+        if removed is not None:
+            sender = removed.transaction.from_address
+            self._pending_spent[sender] -= removed.transaction.coins
+            if self._pending_spent[sender] == 0:
+                del self._pending_spent[sender]
+
+    def restore(self, signed_transactions: Iterable, balance: Callable[[str], int]) -> None:
+        # Called with the transactions of blocks that a reorg undid (and that the new blocks don't have), oldest first:
+        # they are not confirmed anymore, and are pending again if their sender can still pay for them
+        for signed_transaction in signed_transactions:
+            self._recently_confirmed.pop(signed_transaction.digest(), None)
+            sender = signed_transaction.transaction.from_address
+            if sender is not None:
+                self.add(signed_transaction, balance(sender))
@@ -0,0 +1,56 @@
+import hashlib
+from typing import List, Tuple
+
+# A Merkle path lists, from the leaf up to the root, each sibling hash and whether it is on the left
+MerklePath = List[Tuple[bool, bytes]]
+
+EMPTY_ROOT = hashlib.sha256(b'').digest()  # The root of no leaves
+
+
+def _leaf_hash(leaf: bytes) -> bytes:
+    # Leaves and inner nodes are hashed with a different prefix, so a leaf can't pass for an inner node
+    return hashlib.sha256(b'\x00' + leaf).digest()
+
+
+def _node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _next_level(level: List[bytes]) -> List[bytes]:
+    # A node without a sibling moves up as is. Pairing it with a copy of itself would give
+    # [a, b, c] and [a, b, c, c] the same root
+    return [_node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)]
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    level = [_leaf_hash(leaf) for leaf in leaves]
+    if not level:
+        return EMPTY_ROOT
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0]
+
+
+def merkle_path(leaves: List[bytes], index: int) -> MerklePath:
+    """
+    The proof that leaves[index] is under merkle_root(leaves): one sibling hash per level, so O(log n) of them.
+    """
+    if not 0 <= index < len(leaves):
+        raise IndexError(f"No leaf {index}")
+    level = [_leaf_hash(leaf) for leaf in leaves]
+    path: MerklePath = []
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            path.append((sibling < index, level[sibling]))
+        level = _next_level(level)
+        index //= 2
+    return path
+
+
+def root_from_path(leaf: bytes, path: MerklePath) -> bytes:
+    # The root that leaf and path lead to: the proof is valid if it is the root the block header commits to
+    node = _leaf_hash(leaf)
+    for sibling_is_left, sibling in path:
+        node = _node_hash(sibling, node) if sibling_is_left else _node_hash(node, sibling)
+    return node
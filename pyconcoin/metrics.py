@@ -0,0 +1,268 @@
+"""
+Counters, histograms and tracing spans for the hot paths of Node (mining, balances, sync).
+
+Everything reports to REGISTRY:
+
+    import metrics
+    metrics.REGISTRY.snapshot()         # {'counters': {...}, 'histograms': {...}}
+    metrics.REGISTRY.prometheus_text()  # The Prometheus text exposition format
+    metrics.REGISTRY.enabled = False    # No-op mode: every instrument returns right away
+    metrics.REGISTRY.tracing = True     # Also send a SpanRecord to the exporters for every span
+"""
+import bisect
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# For durations, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# For counts (hash attempts, blocks walked), powers of 4
+COUNT_BUCKETS = tuple(4 ** exponent for exponent in range(13))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    start: float  # time.time() when the span started
+    seconds: float
+    attributes: Dict[str, object] = field(default_factory=dict)
+
+
+class Exporter:
+    # Receives what a MetricsRegistry exports. Override the methods you need
+    def export_metrics(self, snapshot: dict) -> None:
+        pass
+
+    def export_span(self, span: SpanRecord) -> None:
+        pass
+
+
+class PrometheusFileExporter(Exporter):
+    # Writes the metrics in the Prometheus text format to a file (e.g. for node_exporter's textfile collector)
+    def __init__(self, path: str):
+        self.path = path
+
+    def export_metrics(self, snapshot: dict) -> None:
+        with open(self.path, 'w') as file:
+            file.write(prometheus_text(snapshot))
+
+
+class SpanRecorder(Exporter):
+    # Keeps the last max_spans spans in memory
+    def __init__(self, max_spans: int = 10_000):
+        self.max_spans = max_spans
+        self.spans: List[SpanRecord] = []
+
+    def export_span(self, span: SpanRecord) -> None:
+        self.spans.append(span)
+        if len(self.spans) > self.max_spans:
+            del self.spans[:len(self.spans) - self.max_spans]
+
+
+class Counter:
+    __slots__ = ('_registry', 'name', 'labels', 'value')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: Labels):
+        self._registry = registry
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        if self._registry.enabled:
+            self.value += amount
+
+
+class Histogram:
+    __slots__ = ('_registry', 'name', 'labels', 'buckets', 'bucket_counts', 'count', 'sum')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: Labels, buckets: Sequence[float]):
+        self._registry = registry
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)  # Not cumulative: the observations in each bucket only
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        if self._registry.enabled:
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.bucket_counts):
+                self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+
+class Span:
+    # Times a block of code into the histogram <name>_seconds, and exports a SpanRecord if tracing is on
+    __slots__ = ('_registry', '_histogram', 'name', 'attributes', '_start', '_start_time')
+
+    def __init__(self, registry: 'MetricsRegistry', histogram: Histogram, name: str, attributes: Dict[str, object]):
+        self._registry = registry
+        self._histogram = histogram
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> 'Span':
+        self._start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        seconds = time.perf_counter() - self._start
+        self._histogram.observe(seconds)
+        if self._registry.tracing:
+            self._registry.export_span(SpanRecord(self.name, self._start_time, seconds, self.attributes))
+
+
+class _NoopSpan:
+    # What span() returns in no-op mode
+    __slots__ = ('attributes',)
+
+    def __init__(self):
+        self.attributes = {}
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class MetricsRegistry:
+    """
+    Holds the counters and histograms, by name and labels.
+    counter() / histogram() return the existing instrument if there is one, so hot paths can either keep
+    the instrument or look it up on every call (e.g. with per-peer labels).
+    Updates are not locked: with several threads, a count may very rarely be off by one.
+    """
+
+    def __init__(self, enabled: bool = True, tracing: bool = False):
+        self.enabled = enabled
+        self.tracing = tracing
+        self._help: Dict[str, str] = {}
+        self._counters: Dict[Tuple[str, Labels], Counter] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._exporters: List[Exporter] = []
+
+    @staticmethod
+    def _labels(labels: Optional[Dict[str, object]]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items())) if labels else ()
+
+    def counter(self, name: str, description: str = '', labels: Dict[str, object] = None) -> Counter:
+        key = (name, self._labels(labels))
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = Counter(self, name, key[1])
+            self._help.setdefault(name, description)
+        return counter
+
+    def histogram(self, name: str, description: str = '', labels: Dict[str, object] = None,
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        key = (name, self._labels(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self, name, key[1], buckets)
+            self._help.setdefault(name, description)
+        return histogram
+
+    def span(self, name: str, description: str = '', labels: Dict[str, object] = None, **attributes):
+        # with registry.span('pyconcoin_pull', peer=...): ...
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, self.histogram(name + '_seconds', description, labels), name, attributes)
+
+    def add_exporter(self, exporter: Exporter) -> None:
+        self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter: Exporter) -> None:
+        self._exporters.remove(exporter)
+
+    def export_span(self, span: SpanRecord) -> None:
+        for exporter in self._exporters:
+            exporter.export_span(span)
+
+    def export(self) -> None:
+        # Send a snapshot of the metrics to every exporter
+        snapshot = self.snapshot()
+        for exporter in self._exporters:
+            exporter.export_metrics(snapshot)
+
+    def snapshot(self) -> dict:
+        """
+        The current values, as plain data:
+        {'counters': {name: {labels: value}}, 'histograms': {name: {labels: {'count', 'sum', 'buckets'}}},
+         'help': {name: help}}, where labels is a tuple of (label, value) pairs and buckets are cumulative.
+        """
+        counters: Dict[str, Dict[Labels, int]] = {}
+        for (name, labels), counter in self._counters.items():
+            counters.setdefault(name, {})[labels] = counter.value
+
+        histograms: Dict[str, Dict[Labels, dict]] = {}
+        for (name, labels), histogram in self._histograms.items():
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            buckets.append((math.inf, histogram.count))
+            histograms.setdefault(name, {})[labels] = {'count': histogram.count, 'sum': histogram.sum,
+                                                       'buckets': buckets}
+        return {'counters': counters, 'histograms': histograms, 'help': dict(self._help)}
+
+    def prometheus_text(self) -> str:
+        return prometheus_text(self.snapshot())
+
+    def reset(self) -> None:
+        # Zero everything (the instruments stay valid)
+        for counter in self._counters.values():
+            counter.value = 0
+        for histogram in self._histograms.values():
+            histogram.bucket_counts = [0] * len(histogram.buckets)
+            histogram.count = 0
+            histogram.sum = 0.0
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def prometheus_text(snapshot: dict) -> str:
+    # A snapshot() in the Prometheus text exposition format
+    lines = []
+    for name, values in sorted(snapshot['counters'].items()):
+        lines.append(f"# HELP {name} {snapshot['help'].get(name, '')}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name, values in sorted(snapshot['histograms'].items()):
+        lines.append(f"# HELP {name} {snapshot['help'].get(name, '')}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in sorted(values.items()):
+            for bound, count in histogram['buckets']:
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_number(bound)),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(histogram['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+# The registry Node and the other modules report to
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,154 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import List, Optional
+
+# The number of leading zero bits a block hash needs (4 bits == one leading hex '0')
+DEFAULT_DIFFICULTY = 4
+
+NONCE_SIZE = 8  # The nonce (magic number) is hashed as 8 big-endian bytes
+MAX_NONCE = 2 ** (8 * NONCE_SIZE) - 1
+
+# How many hashes a worker tries between checks of the stop event
+STOP_CHECK_INTERVAL = 4096
+
+
+def difficulty_target(difficulty: int) -> int:
+    # A hash is valid if, read as a 256 bit number, it is below the target
+    return 1 << (256 - difficulty)
+
+
+def hash_with_nonce(prefix: bytes, nonce: int) -> bytes:
+    return hashlib.sha256(prefix + nonce.to_bytes(NONCE_SIZE, 'big')).digest()
+
+
+def meets_difficulty(digest: bytes, difficulty: int) -> bool:
+    return int.from_bytes(digest, 'big') < difficulty_target(difficulty)
+
+
+@dataclass
+class MiningResult:
+    nonce: int
+    digest: bytes
+    attempts: int  # Hashes tried by all workers together
+    seconds: float
+
+    @property
+    def hash_rate(self) -> float:
+        return self.attempts / self.seconds if self.seconds > 0 else float('inf')
+
+
+# Set in every pool worker by _init_worker, so the miner can stop all workers once one of them finds a nonce
+_stop_event = None
+
+
+def _init_worker(stop_event) -> None:
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _search(prefix: bytes, target: int, start: int, step: int):
+    # Try start, start + step, start + 2 * step, ... until a hash is below the target (or we are told to stop)
+    base = hashlib.sha256(prefix)
+    attempts = 0
+    for nonce in range(start, MAX_NONCE + 1, step):
+        attempts += 1
+        sha = base.copy()
+        sha.update(nonce.to_bytes(NONCE_SIZE, 'big'))
+        digest = sha.digest()
+        if int.from_bytes(digest, 'big') < target:
+            return nonce, digest, attempts
+
+        if attempts % STOP_CHECK_INTERVAL == 0 and _stop_event is not None and _stop_event.is_set():
+            break
+    return None, None, attempts
+
+
+class Miner:
+    """
+    Proof-of-work engine: finds a nonce so that sha256(prefix + nonce) meets the difficulty.
+
+    With processes=1 the search runs in the calling process, starting at nonce 0, so it is deterministic
+    (and with difficulty=0 the first nonce is always valid, which is handy in tests).
+    With more processes the nonce space is interleaved across a process pool, and all workers stop
+    as soon as one of them finds a valid nonce. processes=None uses every core.
+    """
+
+    def __init__(self, difficulty: int = DEFAULT_DIFFICULTY, processes: Optional[int] = 1):
+        if not 0 <= difficulty <= 256:
+            raise ValueError(f"difficulty must be between 0 and 256 bits, got {difficulty}")
+
+        self.difficulty = difficulty
+        self.processes = processes or os.cpu_count() or 1
+        self.last_result: Optional[MiningResult] = None
+        self.total_attempts = 0
+        self.total_seconds = 0.0
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stop_event = None
+
+    @property
+    def hash_rate(self) -> float:
+        # Average hashes per second over everything this miner has mined
+        return self.total_attempts / self.total_seconds if self.total_seconds > 0 else 0.0
+
+    def mine(self, prefix: bytes) -> MiningResult:
+        started = time.perf_counter()
+        target = difficulty_target(self.difficulty)
+
+        if self.processes == 1:
+            nonce, digest, attempts = _search(prefix, target, 0, 1)
+        else:
+            nonce, digest, attempts = self._search_in_pool(prefix, target)
+
+        if nonce is None:
+            raise RuntimeError("No nonce meets the difficulty")
+
+        result = MiningResult(nonce, digest, attempts, time.perf_counter() - started)
+        self.last_result = result
+        self.total_attempts += result.attempts
+        self.total_seconds += result.seconds
+        return result
+
+    def _search_in_pool(self, prefix: bytes, target: int):
+        if self._pool is None:
+            self._stop_event = multiprocessing.Event()
+            self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                             initializer=_init_worker,
+                                             initargs=(self._stop_event,))
+
+        self._stop_event.clear()
+        pending = {self._pool.submit(_search, prefix, target, worker, self.processes)
+                   for worker in range(self.processes)}
+
+        found: List[tuple] = []
+        attempts = 0
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                nonce, digest, worker_attempts = future.result()
+                attempts += worker_attempts
+                if nonce is not None:
+                    found.append((nonce, digest))
+            if found:
+                self._stop_event.set()
+
+        if not found:
+            return None, None, attempts
+        # Several workers may succeed in the same round: pick the smallest nonce so the result doesn't depend on timing
+        nonce, digest = min(found)
+        return nonce, digest, attempts
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self) -> 'Miner':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,477 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import struct
+import threading
+from enum import IntEnum
+from typing import Dict, List, Optional, Set, Tuple
+
+from blockchain import (GENESIS_PREVIOUS_HASH, HEADER_PREFIX_FORMAT, HEADER_SIZE, Block, Node, SignedTransaction,
+                        intern_block)
+from blockstore import decode_block, decode_transaction, encode_block, encode_transaction
+from chain import ChainIndex
+from mining import meets_difficulty
+
+logger = logging.getLogger(__name__)
+
+# Every message is [message type][payload size][payload]
+FRAME_HEADER_FORMAT = '>BI'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+MAX_PAYLOAD_SIZE = 256 * 1024 * 1024
+
+# Blocks in a payload are [block size][encoded block] records (see blockstore.encode_block)
+BLOCK_SIZE_FORMAT = '>I'
+BLOCK_SIZE_SIZE = struct.calcsize(BLOCK_SIZE_FORMAT)
+
+# Block locators and block requests are lists of [height][block hash]
+BLOCK_ID_FORMAT = '>Q32s'
+BLOCK_ID_SIZE = struct.calcsize(BLOCK_ID_FORMAT)
+
+MAX_HEADERS = 2000  # Per HEADERS message
+BLOCKS_PER_REQUEST = 128  # Block bodies are fetched in batches of this many, several batches at a time
+CONNECTIONS_PER_PEER = 4
+
+Address = Tuple[str, int]
+BlockId = Tuple[int, bytes]  # (height, hash)
+
+
+class MessageType(IntEnum):
+    OK = 0
+    ERROR = 1
+    GET_HEADERS = 2  # [max headers][block locator] -> HEADERS
+    HEADERS = 3  # [fork height, -1 if none][headers of the blocks after the fork]
+    GET_BLOCKS = 6  # [block ids] -> BLOCKS
+    BLOCKS = 7  # [blocks]
+    ANNOUNCE_BLOCK = 4  # [block] -> OK
+    ANNOUNCE_TRANSACTION = 5  # [transaction as JSON] -> OK
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class UnknownMessageType(ProtocolError):
+    # The whole frame was read, so the connection can go on
+    pass
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[MessageType, bytes]:
+    message_type, size = struct.unpack(FRAME_HEADER_FORMAT, await reader.readexactly(FRAME_HEADER_SIZE))
+    if size > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Payload of {size} bytes is too large")
+    payload = await reader.readexactly(size)
+    try:
+        return MessageType(message_type), payload
+    except ValueError:
+        raise UnknownMessageType(f"Unknown message type {message_type}") from None
+
+
+def write_frame(writer: asyncio.StreamWriter, message_type: MessageType, payload: bytes = b'') -> None:
+    writer.write(struct.pack(FRAME_HEADER_FORMAT, message_type, len(payload)) + payload)
+
+
+def encode_blocks(blocks: List[Block]) -> bytes:
+    records = []
+    for block in blocks:
+        encoded = encode_block(block)
+        records.append(struct.pack(BLOCK_SIZE_FORMAT, len(encoded)) + encoded)
+    return b''.join(records)
+
+
+def decode_blocks(payload: bytes, known_blocks: Dict[bytes, Block]) -> List[Block]:
+    # Each block's previous_block is looked up in known_blocks, which the decoded blocks are added to
+    blocks = []
+    position = 0
+    while position < len(payload):
+        size, = struct.unpack_from(BLOCK_SIZE_FORMAT, payload, position)
+        position += BLOCK_SIZE_SIZE
+        block = intern_block(decode_block(payload[position:position + size], known_blocks.get))
+        position += size
+        known_blocks[block.block_hash] = block
+        blocks.append(block)
+    return blocks
+
+
+def encode_block_ids(block_ids: List[BlockId]) -> bytes:
+    return b''.join(struct.pack(BLOCK_ID_FORMAT, height, block_hash) for height, block_hash in block_ids)
+
+
+def decode_block_ids(payload: bytes) -> List[BlockId]:
+    return list(struct.iter_unpack(BLOCK_ID_FORMAT, payload))
+
+
+class PeerConnection:
+    # One persistent connection to a peer. Requests on it take turns
+
+    def __init__(self, address: Address):
+        self.address = address
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def request(self, message_type: MessageType, payload: bytes = b'') -> Tuple[MessageType, bytes]:
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                self._reader, self._writer = await asyncio.open_connection(*self.address)
+            try:
+                write_frame(self._writer, message_type, payload)
+                await self._writer.drain()
+                return await read_frame(self._reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                raise
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ConnectionPool:
+    # Up to `size` persistent connections to one peer, reused between requests
+
+    def __init__(self, address: Address, size: int = CONNECTIONS_PER_PEER):
+        self.address = address
+        self._idle: List[PeerConnection] = []
+        self._available = asyncio.Semaphore(size)
+
+    async def request(self, message_type: MessageType, payload: bytes = b'') -> Tuple[MessageType, bytes]:
+        async with self._available:
+            connection = self._idle.pop() if self._idle else PeerConnection(self.address)
+            try:
+                return await connection.request(message_type, payload)
+            finally:
+                self._idle.append(connection)
+
+    def close(self) -> None:
+        for connection in self._idle:
+            connection.close()
+
+
+class RemoteNode:
+    """
+    A node in another process, reached over TCP through a Transport.
+    It can be used as one of a Node's other_nodes: Node.pull_blockchains_from_other_nodes
+    asks all the remote nodes of a transport concurrently.
+    """
+
+    def __init__(self, transport: 'Transport', address: Address):
+        self.transport = transport
+        self.address = address
+
+    def get_blockchain(self) -> Optional[Block]:
+        return self.transport.get_blockchains([self])[0]
+
+    async def fetch_blockchain(self, locator: List[BlockId], locator_blocks: Dict[bytes, Block],
+                               min_total_work: int = 0) -> Optional[Block]:
+        """
+        Headers first: send a block locator of my blockchain, get the headers of the blocks after the common
+        point, and only if that chain has more than min_total_work, fetch those blocks in parallel batches.
+        locator_blocks are my blocks from the locator, by hash; the returned chain is linked to them.
+        Returns None if the other node has no blockchain, or not a better one.
+        """
+        fork_height, headers = await self._fetch_headers(locator)
+        fork_point = None
+        if fork_height >= 0:
+            fork_point = next((block for block in locator_blocks.values() if block.height == fork_height), None)
+            if fork_point is None:
+                raise ProtocolError(f"Fork height {fork_height} is not in the locator")
+
+        # Heights, hashes and total work of the new blocks, checked against their headers
+        expected: List[Tuple[int, bytes, int]] = []
+        height = -1 if fork_point is None else fork_point.height
+        total_work = 0 if fork_point is None else fork_point.total_work
+        previous_hash = GENESIS_PREVIOUS_HASH if fork_point is None else fork_point.block_hash
+        while True:
+            for header in headers:
+                header_previous_hash, _, _, difficulty = struct.unpack_from(HEADER_PREFIX_FORMAT, header)
+                block_hash = hashlib.sha256(header).digest()
+                if header_previous_hash != previous_hash or not meets_difficulty(block_hash, difficulty):
+                    raise ProtocolError("Headers don't form a valid chain")
+                height += 1
+                total_work += 2 ** difficulty
+                previous_hash = block_hash
+                expected.append((height, block_hash, total_work))
+            if len(headers) < MAX_HEADERS:
+                break
+
+            # There are more headers: continue from the last one
+            fork_height, headers = await self._fetch_headers([(height, previous_hash)])
+            if fork_height != height:
+                raise ProtocolError("The blockchain changed during the sync")
+
+        if not expected:
+            new_tip = fork_point
+        elif total_work <= min_total_work:
+            return None  # Not better than what I have: no need for the blocks
+        else:
+            known_blocks = dict(locator_blocks)
+            await self._fetch_blocks(expected, known_blocks)
+            new_tip = known_blocks[previous_hash]
+
+        if new_tip is None or new_tip.total_work <= min_total_work:
+            return None
+        return new_tip
+
+    async def _fetch_headers(self, locator: List[BlockId]) -> Tuple[int, List[bytes]]:
+        message_type, payload = await self.transport.request(
+            self.address, MessageType.GET_HEADERS, struct.pack('>I', MAX_HEADERS) + encode_block_ids(locator))
+        if message_type != MessageType.HEADERS:
+            raise ProtocolError(f"Expected HEADERS, got {message_type.name}")
+
+        fork_height, = struct.unpack_from('>q', payload)
+        headers = [payload[position:position + HEADER_SIZE] for position in range(8, len(payload), HEADER_SIZE)]
+        return fork_height, headers
+
+    async def _fetch_blocks(self, expected: List[Tuple[int, bytes, int]], known_blocks: Dict[bytes, Block]) -> None:
+        async def fetch_batch(batch):
+            message_type, payload = await self.transport.request(
+                self.address, MessageType.GET_BLOCKS, encode_block_ids([(height, block_hash)
+                                                                        for height, block_hash, _ in batch]))
+            if message_type != MessageType.BLOCKS:
+                raise ProtocolError(f"Expected BLOCKS, got {message_type.name}")
+            return payload
+
+        batches = [expected[start:start + BLOCKS_PER_REQUEST] for start in range(0, len(expected), BLOCKS_PER_REQUEST)]
+        payloads = await asyncio.gather(*[fetch_batch(batch) for batch in batches])
+
+        # Decoding is lazy about previous_block, so the batches can be decoded in any order
+        for payload in payloads:
+            decode_blocks(payload, known_blocks)
+        for height, block_hash, total_work in expected:
+            block = known_blocks.get(block_hash)
+            # Recomputing the hash from the block's fields also checks its transactions match the header
+            if (block is None or hashlib.sha256(block.header()).digest() != block_hash
+                    or block.height != height or block.total_work != total_work):
+                raise ProtocolError(f"Missing or invalid block at height {height}")
+
+    def __repr__(self) -> str:
+        return f"RemoteNode({self.address[0]}:{self.address[1]})"
+
+
+class Transport:
+    """
+    Networking for one Node: an asyncio event loop on a background thread, a server answering
+    other nodes' requests, and a pool of persistent connections to the other nodes.
+
+    New blocks and transfers of the served node are announced to all its remote nodes as they appear.
+    The server changes the node on worker threads (never on the loop) while holding node_lock;
+    code on other threads that changes the node should hold it too.
+    """
+
+    def __init__(self):
+        self.node: Optional[Node] = None
+        self.node_lock = threading.RLock()
+        self.address: Optional[Address] = None
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[Address, ConnectionPool] = {}
+
+        # The served node's blockchain by height, for answering other nodes.
+        # Kept up to date by a tip listener, with its own lock, so answering never waits for node_lock
+        self._chain_index = ChainIndex()
+        self._chain_lock = threading.Lock()
+        self._handlers: Set[asyncio.Task] = set()  # One per connection other nodes opened to us
+        self._pulls: Set[asyncio.Future] = set()  # Started by announced blocks that didn't extend my blockchain
+
+    def run(self, coroutine):
+        # Run a coroutine on the transport's loop, and wait for its result
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def connect(self, host: str, port: int) -> RemoteNode:
+        return RemoteNode(self, (host, port))
+
+    def serve(self, node: Node, host: str = '127.0.0.1', port: int = 0) -> Address:
+        self.node = node
+
+        async def start_server():
+            return await asyncio.start_server(self._handle_connection, host, port)
+
+        self._server = self.run(start_server())
+        self.address = self._server.sockets[0].getsockname()[:2]
+        self._update_chain_index(node.get_blockchain())
+        node.add_tip_listener(self._update_chain_index)
+        node.add_tip_listener(self._announce_block)
+        node.add_transaction_listener(self._announce_transaction)
+        return self.address
+
+    def close(self) -> None:
+        async def close_all():
+            for connection in self._connections.values():
+                connection.close()
+            if self._server is not None:
+                self._server.close()
+            for handler in self._handlers:
+                handler.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+
+        self.run(close_all())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def request(self, address: Address, message_type: MessageType, payload: bytes = b''):
+        pool = self._connections.get(address)
+        if pool is None:
+            pool = self._connections[address] = ConnectionPool(address)
+        return await pool.request(message_type, payload)
+
+    def get_blockchains(self, remote_nodes: List[RemoteNode], local_node: Node = None) -> List[Optional[Block]]:
+        """
+        Fetch from all the remote nodes at once. If local_node is given, only the blocks it doesn't have are
+        transferred, and a remote node whose blockchain isn't better than local_node's counts as having none
+        (as does a node that can't be reached).
+        """
+        locator: List[BlockId] = []
+        locator_blocks: Dict[bytes, Block] = {}
+        min_total_work = 0
+        if local_node is not None and local_node.get_blockchain() is not None:
+            locator = local_node.get_block_locator()
+            locator_blocks = {block.block_hash: block for block in local_node.get_blocks(locator)}
+            min_total_work = local_node.get_blockchain().total_work
+
+        async def fetch_all():
+            return await asyncio.gather(*[node.fetch_blockchain(locator, locator_blocks, min_total_work)
+                                          for node in remote_nodes], return_exceptions=True)
+
+        return [None if isinstance(result, Exception) else result for result in self.run(fetch_all())]
+
+    def _remote_nodes(self) -> List[RemoteNode]:
+        return [node for node in self.node._other_nodes if isinstance(node, RemoteNode)]
+
+    def _announce(self, message_type: MessageType, payload: bytes) -> None:
+        # Fire and forget: the messages are sent by the loop
+        for node in self._remote_nodes():
+            future = asyncio.run_coroutine_threadsafe(self.request(node.address, message_type, payload), self._loop)
+            future.add_done_callback(lambda done: done.exception())  # An unreachable node will catch up by pulling
+
+    def _announce_block(self, block: Optional[Block]) -> None:
+        if block is not None:
+            self._announce(MessageType.ANNOUNCE_BLOCK, encode_blocks([block]))
+
+    def _announce_transaction(self, signed_transaction: SignedTransaction) -> None:
+        self._announce(MessageType.ANNOUNCE_TRANSACTION,
+                       json.dumps(encode_transaction(signed_transaction)).encode('utf-8'))
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            while True:
+                try:
+                    message_type, payload = await read_frame(reader)
+                except UnknownMessageType as error:
+                    response = MessageType.ERROR, str(error).encode('utf-8')
+                else:
+                    try:
+                        response = await self._respond(message_type, payload)
+                    except (ProtocolError, ValueError, KeyError, TypeError, struct.error) as error:
+                        response = MessageType.ERROR, str(error).encode('utf-8')
+                write_frame(writer, *response)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ProtocolError, struct.error):
+            pass
+        finally:
+            self._handlers.discard(handler)
+            writer.close()
+
+    async def _respond(self, message_type: MessageType, payload: bytes) -> Tuple[MessageType, bytes]:
+        # Anything that may take a while runs on a worker thread, so the loop keeps serving other connections
+        if message_type == MessageType.GET_HEADERS:
+            max_headers, = struct.unpack_from('>I', payload)
+            locator = decode_block_ids(payload[4:])
+            return MessageType.HEADERS, await self._loop.run_in_executor(
+                None, self._encode_headers, locator, min(max_headers, MAX_HEADERS))
+
+        if message_type == MessageType.GET_BLOCKS:
+            return MessageType.BLOCKS, await self._loop.run_in_executor(
+                None, self._encode_blocks, decode_block_ids(payload))
+
+        if message_type == MessageType.ANNOUNCE_BLOCK:
+            accepted = await self._loop.run_in_executor(None, self._receive_block, payload)
+            if not accepted:
+                # It doesn't extend my blockchain: pull, and let merge_blockchains decide
+                pull = self._loop.run_in_executor(None, self._pull)
+                self._pulls.add(pull)
+                pull.add_done_callback(self._pull_done)
+            return MessageType.OK, b''
+
+        if message_type == MessageType.ANNOUNCE_TRANSACTION:
+            signed_transaction = decode_transaction(json.loads(payload))
+            await self._loop.run_in_executor(None, self._receive_transaction, signed_transaction)
+            return MessageType.OK, b''
+
+        raise ProtocolError(f"Unexpected message {message_type.name}")
+
+    def _update_chain_index(self, tip: Optional[Block]) -> None:
+        with self._chain_lock:
+            self._chain_index.move_to(tip)
+
+    def _encode_headers(self, locator: List[BlockId], max_headers: int) -> bytes:
+        with self._chain_lock:
+            fork_point, blocks = self._chain_index.blocks_after(locator, max_headers)
+        fork_height = -1 if fork_point is None else fork_point.height
+        return struct.pack('>q', fork_height) + b''.join(block.header() for block in blocks)
+
+    def _encode_blocks(self, block_ids: List[BlockId]) -> bytes:
+        with self._chain_lock:
+            blocks = self._chain_index.blocks(block_ids)
+        return encode_blocks(blocks)
+
+    def _receive_block(self, payload: bytes) -> bool:
+        with self.node_lock:
+            tip = self.node.get_blockchain()
+            block, = decode_blocks(payload, {} if tip is None else {tip.block_hash: tip})
+            return self.node.receive_block(block)
+
+    def _receive_transaction(self, signed_transaction: SignedTransaction) -> None:
+        with self.node_lock:
+            self.node.receive_transaction(signed_transaction)
+
+    def _pull(self) -> None:
+        with self.node_lock:
+            self.node.pull_blockchains_from_other_nodes()
+
+    def _pull_done(self, pull: asyncio.Future) -> None:
+        self._pulls.discard(pull)
+        if not pull.cancelled() and pull.exception() is not None:
+            logger.error("Pulling after an announced block failed", exc_info=pull.exception())
+
+
+def main():
+    # Run a node in this process, e.g.:
+    #   python network.py --port 9000 --coins 200
+    #   python network.py --port 9001 --peer 127.0.0.1:9000
+    parser = argparse.ArgumentParser(description="Run a pyconcoin node")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--coins', type=int, help="Start a new network, with this many coins")
+    parser.add_argument('--peer', action='append', default=[], help="host:port of another node")
+    args = parser.parse_args()
+    if args.coins is None and not args.peer:
+        parser.error("--peer is needed to join a network (or --coins to start one)")
+
+    transport = Transport()
+    peers = [transport.connect(host, int(port)) for host, port in (peer.rsplit(':', 1) for peer in args.peer)]
+    if args.coins is not None:
+        # Its peers get its announcements, like the peers of a node that joined
+        node = Node(coins=args.coins)
+        for peer in peers:
+            node.add_node(peer)
+    else:
+        node = Node(other_nodes=peers)
+    host, port = transport.serve(node, args.host, args.port)
+    print(f"Node {node.address} listening on {host}:{port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        transport.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import nacl.encoding
+import nacl.exceptions
+import nacl.signing
+
+
+def address_of(signing_key: nacl.signing.SigningKey) -> str:
+    # An address is the hex encoded public (verify) key, so anyone can check what it signed
+    return signing_key.verify_key.encode(nacl.encoding.HexEncoder).decode('ascii')
+
+
+def transaction_message(transaction) -> bytes:
+    # The bytes that get signed: everything in the transaction
+    return repr((transaction.from_address, transaction.to_address, transaction.coins, transaction.salt)).encode('utf-8')
+
+
+def is_well_formed(transaction) -> bool:
+    # Whole coins between string addresses (only the first transaction has no sender).
+    # Checked before any arithmetic: a transaction from another node can hold anything
+    return (type(transaction.coins) is int and type(transaction.to_address) is str
+            and (transaction.from_address is None or type(transaction.from_address) is str))
+
+
+def signer_of(transaction) -> str:
+    # The sender signs a transfer. The initial transaction has no sender, so the receiver signs it
+    return transaction.to_address if transaction.from_address is None else transaction.from_address
+
+
+def sign_transaction(signing_key: nacl.signing.SigningKey, transaction) -> bytes:
+    return signing_key.sign(transaction_message(transaction)).signature
+
+
+def verify_signature(signed_transaction) -> bool:
+    transaction = signed_transaction.transaction
+    try:
+        verify_key = nacl.signing.VerifyKey(bytes.fromhex(signer_of(transaction)))
+        verify_key.verify(transaction_message(transaction), signed_transaction.signature)
+    except (nacl.exceptions.BadSignatureError, ValueError, TypeError):
+        # A bad signature, an address that is not a key, or a placeholder signature like "signed"
+        return False
+    return True
+
+
+class SignatureVerifier:
+    """
+    Checks the Ed25519 signatures of signed transactions.
+
+    verify_many checks a batch on a thread pool (libsodium releases the GIL while verifying), and
+    the IDs of the last cache_size valid transactions are remembered, so a transaction that arrives
+    again (e.g. from several peers during a pull) isn't verified twice.
+    One verifier can be shared by several threads (e.g. the nodes of a network.Server).
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, cache_size: int = 100_000):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self._verified: 'OrderedDict[bytes, None]' = OrderedDict()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()  # For the cache and the pool; not held while verifying
+
+    @staticmethod
+    def _cache_key(signed_transaction) -> bytes:
+        signature = signed_transaction.signature
+        if isinstance(signature, str):
+            signature = signature.encode('utf-8')
+        return hashlib.sha256(transaction_message(signed_transaction.transaction) + signature).digest()
+
+    def _is_cached(self, key: bytes) -> bool:
+        if key in self._verified:
+            self._verified.move_to_end(key)
+            return True
+        return False
+
+    def _remember(self, key: bytes) -> None:
+        self._verified[key] = None
+        self._verified.move_to_end(key)
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+
+    def verify(self, signed_transaction) -> bool:
+        return self.verify_many([signed_transaction])[0]
+
+    def verify_many(self, signed_transactions: List) -> List[bool]:
+        results: List[bool] = [True] * len(signed_transactions)
+        keys = [self._cache_key(signed_transaction) for signed_transaction in signed_transactions]
+
+        # Only the transactions we haven't verified before (and only once, if the batch has duplicates)
+        to_verify = {}
+        with self._lock:
+            for index, key in enumerate(keys):
+                if not self._is_cached(key):
+                    to_verify.setdefault(key, []).append(index)
+        if not to_verify:
+            return results
+
+        batch = [signed_transactions[indexes[0]] for indexes in to_verify.values()]
+        if len(batch) == 1 or self.max_workers == 1:
+            valid = _verify_all(batch)
+        else:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+                pool = self._pool
+            # One task per worker: a task per signature would cost about as much as verifying it
+            chunk_size = -(-len(batch) // self.max_workers)
+            chunks = [batch[start:start + chunk_size] for start in range(0, len(batch), chunk_size)]
+            valid = [is_valid for chunk_valid in pool.map(_verify_all, chunks) for is_valid in chunk_valid]
+
+        with self._lock:
+            for (key, indexes), is_valid in zip(to_verify.items(), valid):
+                if is_valid:
+                    self._remember(key)
+                for index in indexes:
+                    results[index] = is_valid
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+def _verify_all(signed_transactions: List) -> List[bool]:
+    return [verify_signature(signed_transaction) for signed_transaction in signed_transactions]
@@ -0,0 +1,357 @@
+"""
+Discrete-event simulation of a network of Nodes, on a simulated clock, to size the network and tune sync.
+
+    python simulator.py --nodes 1000 --blocks 100 --seed 1
+    python simulator.py --nodes 200 --topology ring --partition 300 900 0.5 --output report.json
+
+Every node is a real Node (so blocks are really validated and reorganized); only time and the network are simulated.
+Blocks are found as a Poisson process (one block every block_interval seconds on average, by a node picked
+in proportion to its hash power) and mined at difficulty 0, so mining costs no real time.
+Links have a latency and a bandwidth, and send one message at a time. A new tip is announced to the neighbours
+with its header; a neighbour that doesn't have the block asks for it if it extends its tip, and otherwise
+syncs from the announcer with a block locator. Everything random comes from one seeded random.Random,
+so the same config gives the same report.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import random
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from blockchain import HEADER_SIZE, Block, Node
+from block_tree import BlockTree
+from blockstore import encode_block
+from chain import find_common_ancestor, locator_heights, same_block
+from mining import Miner
+
+REQUEST_SIZE = 40  # A block hash and a message type
+LOCATOR_ENTRY_SIZE = 40  # A height and a block hash
+
+PERCENTILES = (50, 90, 99, 100)
+
+Topology = List[List[int]]  # The neighbours of every node
+
+
+@dataclass
+class Partition:
+    # From start to end (in simulated seconds), nodes can't exchange messages with the other nodes
+    start: float
+    end: float
+    nodes: Set[int]
+
+
+@dataclass
+class SimulationConfig:
+    nodes: int = 100
+    blocks: int = 50  # Blocks to mine; the simulation ends when they have all propagated
+    block_interval: float = 10.0  # Average seconds between two blocks of the whole network
+    topology: str = 'random'  # See TOPOLOGIES
+    degree: int = 8
+    latency: Tuple[float, float] = (0.05, 0.3)  # Seconds, drawn uniformly per link
+    bandwidth: Tuple[float, float] = (1e5, 1e6)  # Bytes per second, drawn uniformly per link
+    block_size: Optional[int] = None  # Bytes per block on the wire (default: the size of the encoded block)
+    hash_power: Optional[List[float]] = None  # Relative hash power of every node (default: all the same)
+    partitions: List[Partition] = field(default_factory=list)
+    block_tree: bool = False  # Nodes keep every branch in a BlockTree
+    seed: int = 0
+
+
+@dataclass
+class SimulationReport:
+    nodes: int
+    blocks_mined: int
+    stale_blocks: int  # Mined, but not in the final best chain
+    fork_rate: float  # stale_blocks / blocks_mined
+    reorgs: int  # Tip changes that undid blocks of the previous tip (catching up by several blocks isn't one)
+    propagation: Dict[str, float]  # Percentiles of the delay between a block being mined and each node having it
+    propagation_90: Dict[str, float]  # Percentiles, over the blocks, of the time to reach 90% of the nodes
+    bytes_sent: Dict[str, int]  # By kind of message
+    sync_bytes: int  # Locators and blocks sent to nodes that fell behind or were on another branch
+    simulated_seconds: float
+    events: int
+    consensus: bool  # Whether all the nodes ended up with the same tip
+
+
+def random_topology(count: int, degree: int, rng: random.Random) -> Topology:
+    # A ring (so the network is connected), and random links until every node has about degree neighbours
+    neighbours = [set() for _ in range(count)]
+    for node in range(count):
+        for other in ((node + 1) % count, *rng.sample(range(count), min(count, max(0, degree // 2 - 1)))):
+            if other != node:
+                neighbours[node].add(other)
+                neighbours[other].add(node)
+    return [sorted(node_neighbours) for node_neighbours in neighbours]
+
+
+def ring_topology(count: int, degree: int, rng: random.Random) -> Topology:
+    # Every node is linked to the degree // 2 nodes on each side of it
+    reach = max(1, degree // 2)
+    return [sorted({(node + offset) % count for offset in range(-reach, reach + 1)} - {node})
+            for node in range(count)]
+
+
+def mesh_topology(count: int, degree: int, rng: random.Random) -> Topology:
+    # Everyone is linked to everyone
+    return [[other for other in range(count) if other != node] for node in range(count)]
+
+
+TOPOLOGIES: Dict[str, Callable[[int, int, random.Random], Topology]] = {
+    'random': random_topology,
+    'ring': ring_topology,
+    'mesh': mesh_topology,
+}
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    # Nearest-rank percentiles
+    values = sorted(values)
+    if not values:
+        return {}
+    return {f'p{percentile}': values[max(0, -(-percentile * len(values) // 100) - 1)] for percentile in PERCENTILES}
+
+
+class _Link:
+    __slots__ = ('latency', 'bandwidth', 'free_at')
+
+    def __init__(self, latency: float, bandwidth: float):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.free_at = 0.0  # A link sends one message at a time
+
+
+class Simulation:
+    def __init__(self, config: SimulationConfig):
+        if config.nodes < 2 or config.blocks < 1:
+            raise ValueError("A simulation needs at least 2 nodes and 1 block")
+        self.config = config
+        self.now = 0.0
+        self._rng = random.Random(config.seed)
+        self._events: List[tuple] = []  # (time, sequence, function, arguments); the sequence breaks ties
+        self._sequence = itertools.count()
+        self._event_count = 0
+
+        self.topology = TOPOLOGIES[config.topology](config.nodes, config.degree, self._rng)
+        self._links: Dict[Tuple[int, int], _Link] = {}
+        for node, neighbours in enumerate(self.topology):
+            for other in neighbours:
+                if node < other:
+                    latency = self._rng.uniform(*config.latency)
+                    for direction in ((node, other), (other, node)):
+                        self._links[direction] = _Link(latency, self._rng.uniform(*config.bandwidth))
+
+        # Difficulty 0: the first nonce is valid. One miner for everyone, it has no state that matters here
+        miner = Miner(difficulty=0)
+        first_node = Node(coins=1_000_000, miner=miner, block_tree=self._block_tree())
+        self.nodes = [first_node] + [Node(other_nodes=[first_node], miner=miner, block_tree=self._block_tree())
+                                     for _ in range(config.nodes - 1)]
+        genesis = first_node.get_blockchain()
+
+        # What every node has had in its blockchain, and when every block was mined and reached each node
+        self._seen: List[Set[bytes]] = [{genesis.block_hash} for _ in self.nodes]
+        self._tips: List[Block] = [genesis for _ in self.nodes]
+        self._requested: List[Set[bytes]] = [set() for _ in self.nodes]
+        self._mined: List[Tuple[Block, float]] = []
+        self._mined_at: Dict[bytes, float] = {genesis.block_hash: 0.0}
+        self._delays: Dict[bytes, List[float]] = {}
+        self._block_sizes: Dict[bytes, int] = {}
+        self.bytes_sent: Dict[str, int] = {'announce': 0, 'request': 0, 'block': 0, 'locator': 0, 'sync': 0}
+        self.reorgs = 0
+
+        for node_id, node in enumerate(self.nodes):
+            node.add_tip_listener(lambda block, node_id=node_id: self._new_tip(node_id, block))
+
+        weights = config.hash_power or [1.0] * config.nodes
+        self._cumulative_hash_power = list(itertools.accumulate(weights))
+        for partition in config.partitions:
+            self._schedule(partition.end, self._heal, partition)
+
+    def _block_tree(self) -> Optional[BlockTree]:
+        return BlockTree() if self.config.block_tree else None
+
+    def _schedule(self, time: float, function: Callable, *arguments) -> None:
+        heapq.heappush(self._events, (time, next(self._sequence), function, arguments))
+
+    def run(self) -> SimulationReport:
+        self._schedule(self._rng.expovariate(1 / self.config.block_interval), self._mine)
+        while self._events:
+            self.now, _, function, arguments = heapq.heappop(self._events)
+            self._event_count += 1
+            function(*arguments)
+        return self.report()
+
+    # Network
+
+    def _partitioned(self, node: int, other: int) -> bool:
+        return any(partition.start <= self.now < partition.end
+                   and (node in partition.nodes) != (other in partition.nodes) for partition in self.config.partitions)
+
+    def _send(self, sender: int, receiver: int, size: int, kind: str, function: Callable, *arguments) -> bool:
+        # Queue a message on the link; False if it can't get through (a partition)
+        if self._partitioned(sender, receiver):
+            return False
+        link = self._links[sender, receiver]
+        link.free_at = max(self.now, link.free_at) + size / link.bandwidth
+        self.bytes_sent[kind] += size
+        self._schedule(link.free_at + link.latency, function, *arguments)
+        return True
+
+    def _block_size(self, block: Block) -> int:
+        if self.config.block_size is not None:
+            return self.config.block_size
+        size = self._block_sizes.get(block.block_hash)
+        if size is None:
+            size = self._block_sizes[block.block_hash] = len(encode_block(block))
+        return size
+
+    # Events
+
+    def _mine(self) -> None:
+        miner_id = self._rng.choices(range(len(self.nodes)), cum_weights=self._cumulative_hash_power)[0]
+        node = self.nodes[miner_id]
+        block = node.create_block([], node.get_blockchain())
+        self._mined.append((block, self.now))
+        self._mined_at[block.block_hash] = self.now
+        node.receive_block(block)
+        if len(self._mined) < self.config.blocks:
+            self._schedule(self.now + self._rng.expovariate(1 / self.config.block_interval), self._mine)
+
+    def _new_tip(self, node_id: int, tip: Block) -> None:
+        # Record when the node got the blocks it didn't have, then announce its tip
+        if not same_block(find_common_ancestor(self._tips[node_id], tip), self._tips[node_id]):
+            self.reorgs += 1
+        self._tips[node_id] = tip
+        seen = self._seen[node_id]
+        block = tip
+        while block is not None and block.block_hash not in seen:
+            seen.add(block.block_hash)
+            self._requested[node_id].discard(block.block_hash)
+            self._delays.setdefault(block.block_hash, []).append(self.now - self._mined_at[block.block_hash])
+            block = block.previous_block
+        for neighbour in self.topology[node_id]:
+            self._send(node_id, neighbour, HEADER_SIZE, 'announce', self._announced, neighbour, node_id, tip)
+
+    def _announced(self, node_id: int, sender: int, block: Block) -> None:
+        if block.block_hash in self._seen[node_id] or block.block_hash in self._requested[node_id]:
+            return
+        if same_block(block.previous_block, self._tips[node_id]):
+            # It extends my tip: just ask for the block
+            if self._send(node_id, sender, REQUEST_SIZE, 'request', self._block_requested, sender, node_id, block):
+                self._requested[node_id].add(block.block_hash)
+        elif block.total_work > self._tips[node_id].total_work:
+            # I'm behind, or on another branch: send a locator of my blockchain
+            locator_size = LOCATOR_ENTRY_SIZE * len(locator_heights(self._tips[node_id].height + 1))
+            if self._send(node_id, sender, locator_size, 'locator', self._sync_requested, sender, node_id,
+                          self._tips[node_id], block.block_hash):
+                self._requested[node_id].add(block.block_hash)
+
+    def _block_requested(self, node_id: int, requester: int, block: Block) -> None:
+        if not self._send(node_id, requester, self._block_size(block), 'block', self._block_received, requester, block):
+            self._requested[requester].discard(block.block_hash)
+
+    def _block_received(self, node_id: int, block: Block) -> None:
+        self._requested[node_id].discard(block.block_hash)
+        self.nodes[node_id].receive_block(block)
+
+    def _sync_requested(self, node_id: int, requester: int, requester_tip: Block, announced_hash: bytes) -> None:
+        # Send the blocks of my blockchain after the fork point with the requester's
+        tip = self._tips[node_id]
+        fork_point = find_common_ancestor(requester_tip, tip)
+        size = 0
+        block = tip
+        while not same_block(block, fork_point):
+            size += self._block_size(block)
+            block = block.previous_block
+        if not self._send(node_id, requester, size, 'sync', self._synced, requester, tip, announced_hash):
+            self._requested[requester].discard(announced_hash)
+
+    def _synced(self, node_id: int, tip: Block, announced_hash: bytes) -> None:
+        self._requested[node_id].discard(announced_hash)
+        self.nodes[node_id].pull_blockchain(tip)
+
+    def _heal(self, partition: Partition) -> None:
+        # The links across the partition are back: the nodes on both sides tell each other their tips
+        for node_id in sorted(partition.nodes):
+            for neighbour in self.topology[node_id]:
+                if neighbour not in partition.nodes:
+                    for sender, receiver in ((node_id, neighbour), (neighbour, node_id)):
+                        self._send(sender, receiver, HEADER_SIZE, 'announce', self._announced, receiver, sender,
+                                   self._tips[sender])
+
+    # Results
+
+    def report(self) -> SimulationReport:
+        best_tip = max(self._tips, key=lambda tip: (tip.total_work, tip.height))
+        best_chain = set()
+        block = best_tip
+        while block is not None:
+            best_chain.add(block.block_hash)
+            block = block.previous_block
+        stale_blocks = sum(block.block_hash not in best_chain for block, _ in self._mined)
+
+        delays = []
+        times_to_90 = []
+        for block, _ in self._mined:
+            block_delays = sorted(self._delays.get(block.block_hash, []))
+            delays.extend(block_delays)
+            needed = -(-9 * len(self.nodes) // 10)
+            if len(block_delays) >= needed:
+                times_to_90.append(block_delays[needed - 1])
+
+        return SimulationReport(
+            nodes=len(self.nodes),
+            blocks_mined=len(self._mined),
+            stale_blocks=stale_blocks,
+            fork_rate=stale_blocks / len(self._mined),
+            reorgs=self.reorgs,
+            propagation=percentiles(delays),
+            propagation_90=percentiles(times_to_90),
+            bytes_sent=dict(self.bytes_sent),
+            sync_bytes=self.bytes_sent['locator'] + self.bytes_sent['sync'],
+            simulated_seconds=self.now,
+            events=self._event_count,
+            consensus=all(same_block(tip, best_tip) for tip in self._tips),
+        )
+
+
+def simulate(config: SimulationConfig) -> SimulationReport:
+    return Simulation(config).run()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=SimulationConfig.nodes)
+    parser.add_argument('--blocks', type=int, default=SimulationConfig.blocks)
+    parser.add_argument('--block-interval', type=float, default=SimulationConfig.block_interval)
+    parser.add_argument('--topology', choices=sorted(TOPOLOGIES), default=SimulationConfig.topology)
+    parser.add_argument('--degree', type=int, default=SimulationConfig.degree)
+    parser.add_argument('--latency', type=float, nargs=2, metavar=('MIN', 'MAX'), default=SimulationConfig.latency)
+    parser.add_argument('--bandwidth', type=float, nargs=2, metavar=('MIN', 'MAX'),
+                        default=SimulationConfig.bandwidth, help="Bytes per second")
+    parser.add_argument('--block-size', type=int, help="Bytes per block on the wire")
+    parser.add_argument('--partition', type=float, nargs=3, action='append', default=[],
+                        metavar=('START', 'END', 'FRACTION'), help="Cut FRACTION of the nodes off from START to END")
+    parser.add_argument('--block-tree', action='store_true', help="Nodes keep every branch in a BlockTree")
+    parser.add_argument('--seed', type=int, default=SimulationConfig.seed)
+    parser.add_argument('--output', help="Write the report to this JSON file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    partitions = [Partition(start, end, set(range(int(fraction * args.nodes))))
+                  for start, end, fraction in args.partition]
+    config = SimulationConfig(nodes=args.nodes, blocks=args.blocks, block_interval=args.block_interval,
+                              topology=args.topology, degree=args.degree, latency=tuple(args.latency),
+                              bandwidth=tuple(args.bandwidth), block_size=args.block_size, partitions=partitions,
+                              block_tree=args.block_tree, seed=args.seed)
+    report = json.dumps(asdict(simulate(config)), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
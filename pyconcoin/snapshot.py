@@ -0,0 +1,83 @@
+import hashlib
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Dict
+
+# File format (zlib compressed):
+# magic, header size + block header, height, total work size + total work, balance count,
+# then for every address: address size + address (utf-8), balance
+SNAPSHOT_MAGIC = b'PCSNAP1\n'
+SNAPSHOT_FORMAT = '>H{header_size}sQH{work_size}sI'
+BALANCE_FORMAT = '>H{address_size}sq'
+
+
+@dataclass
+class Snapshot:
+    """
+    The balances of every address as of one block, so a node can start from that block
+    instead of replaying the blockchain from the genesis.
+    The header (and height and total work) let the node check that the blocks after it link up.
+    """
+    header: bytes
+    height: int
+    total_work: int
+    balances: Dict[str, int]
+
+    @property
+    def block_hash(self) -> bytes:
+        return hashlib.sha256(self.header).digest()
+
+    def encode(self) -> bytes:
+        work = self.total_work.to_bytes((self.total_work.bit_length() + 7) // 8 or 1, 'big')
+        balances = {address: coins for address, coins in self.balances.items() if coins != 0}
+        parts = [SNAPSHOT_MAGIC,
+                 struct.pack(SNAPSHOT_FORMAT.format(header_size=len(self.header), work_size=len(work)),
+                             len(self.header), self.header, self.height, len(work), work, len(balances))]
+        for address, coins in sorted(balances.items()):
+            encoded_address = address.encode('utf-8')
+            parts.append(struct.pack(BALANCE_FORMAT.format(address_size=len(encoded_address)),
+                                     len(encoded_address), encoded_address, coins))
+        return zlib.compress(b''.join(parts))
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'Snapshot':
+        data = zlib.decompress(data)
+        if not data.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("Not a snapshot")
+        position = len(SNAPSHOT_MAGIC)
+
+        header_size, = struct.unpack_from('>H', data, position)
+        header = data[position + 2:position + 2 + header_size]
+        position += 2 + header_size
+        height, work_size = struct.unpack_from('>QH', data, position)
+        position += struct.calcsize('>QH')
+        total_work = int.from_bytes(data[position:position + work_size], 'big')
+        position += work_size
+        count, = struct.unpack_from('>I', data, position)
+        position += 4
+
+        balances = {}
+        for _ in range(count):
+            address_size, = struct.unpack_from('>H', data, position)
+            position += 2
+            address = data[position:position + address_size].decode('utf-8')
+            position += address_size
+            balances[address], = struct.unpack_from('>q', data, position)
+            position += 8
+        return cls(header, height, total_work, balances)
+
+    def save(self, path: str) -> None:
+        # Written to a temporary file first, so a crash never leaves half a snapshot
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(self.encode())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'Snapshot':
+        with open(path, 'rb') as file:
+            return cls.decode(file.read())
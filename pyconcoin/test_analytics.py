@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from blockchain import *
+from analytics import *
+
+
+def block_at(blockchain, height):
+    while blockchain.height != height:
+        blockchain = blockchain.previous_block
+    return blockchain
+
+
+def create_node():
+    node_a = Node(coins=100, miner=Miner(difficulty=4))
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=4))
+    node_a.transfer_coins(node_b.address, coins=30)
+    node_a.transfer_coins("C_ADDRESS", coins=5)
+    node_b.pull_blockchains_from_other_nodes()
+    node_b.transfer_coins("C_ADDRESS", coins=7)
+    node_a.add_node(node_b)
+    node_a.pull_blockchains_from_other_nodes()
+    node_a.transfer_coins(node_a.address, coins=1)
+    return node_a, node_b
+
+
+def test_balances_at_match_calculate_balance():
+    node_a, node_b = create_node()
+    blockchain = node_a.get_blockchain()
+    ledger = Ledger.from_chain(blockchain)
+    heights = [4, 0, 2, 1, 3]
+    addresses = [node_a.address, "UNKNOWN_ADDRESS", node_b.address, "C_ADDRESS"]
+
+    balances = ledger.balances_at(heights, addresses)
+    assert balances.shape == (4, 5)
+    for row, address in enumerate(addresses):
+        for column, height in enumerate(heights):
+            expected = Node.calculate_balance(address, block_at(blockchain, height))
+            assert balances[row, column] == expected
+    assert ledger.balances() == {node_a.address: 65, node_b.address: 23, "C_ADDRESS": 12}
+
+
+def test_history_lists_an_address_transactions_in_order():
+    node_a, node_b = create_node()
+    ledger = Ledger.from_chain(node_a.get_blockchain())
+
+    assert ledger.history("C_ADDRESS") == [LedgerEntry(2, 0, node_a.address, "C_ADDRESS", 5),
+                                           LedgerEntry(3, 0, node_b.address, "C_ADDRESS", 7)]
+    assert [entry.height for entry in ledger.history(node_a.address)] == [0, 1, 2, 4]
+    assert ledger.history("UNKNOWN_ADDRESS") == []
+
+
+def test_opening_balances_of_a_pruned_chain():
+    node_a, node_b = create_node()
+    snapshot = node_a.take_snapshot(height=2)
+    node_c = Node(snapshot=snapshot, other_nodes=[node_a])
+    ledger = Ledger.from_chain(node_c.get_blockchain(), opening_balances=snapshot.balances)
+
+    assert ledger.balances() == Ledger.from_chain(node_a.get_blockchain()).balances()
+    assert ledger.balances_at([2, 3], ["C_ADDRESS"]).tolist() == [[5, 12]]
@@ -0,0 +1,31 @@
+from benchmark import *
+
+
+def test_build_chain_has_the_requested_height():
+    tip = build_chain(50, nacl.signing.SigningKey.generate(), signed_blocks=5)
+
+    assert tip.height == 49
+    assert Node.are_signed_transactions_valid(tip.signed_transactions)
+    unsigned = tip
+    for _ in range(5):
+        unsigned = unsigned.previous_block
+    assert not Node.are_signed_transactions_valid(unsigned.signed_transactions)
+
+
+def test_run_reports_every_benchmark_in_seconds():
+    report = run([100], repeat=1, mining=False)
+
+    assert "calculate_balance[n=100]" in report['results']
+    assert "pull_blockchains[n=100,gap=10]" in report['results']
+    assert "ledger_pull[n=100,gap=10]" in report['results']
+    assert all(seconds >= 0 for seconds in report['results'].values())
+
+
+def test_compare_flags_only_results_slower_than_the_threshold():
+    baseline = {'results': {'a': 1.0, 'b': 1.0, 'c': 1.0}}
+    current = {'results': {'a': 1.1, 'b': 1.5, 'new': 1.0}}
+    rows = {row['name']: row for row in compare(baseline, current, threshold=0.2)}
+
+    assert set(rows) == {'a', 'b'}
+    assert not rows['a']['regression']
+    assert rows['b']['regression']
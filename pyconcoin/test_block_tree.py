@@ -0,0 +1,109 @@
+import pytest
+
+from blockchain import *
+from block_tree import *
+
+
+class CountingValidator(ChainValidator):
+    # Counts the blocks it is asked to check
+    def __init__(self):
+        super().__init__()
+        self.blocks_validated = 0
+
+    def validate(self, blocks, fork_point=None, balance=None, is_confirmed=None):
+        blocks = list(blocks)
+        self.blocks_validated += len(blocks)
+        return super().validate(blocks, fork_point, balance, is_confirmed)
+
+
+def create_nodes():
+    # node_a and node_b share their first two blocks, node_c follows both with a BlockTree
+    node_a = Node(coins=100, miner=Miner(difficulty=4))
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=4))
+    node_a.transfer_coins(node_b.address, coins=50)
+    node_b.pull_blockchains_from_other_nodes()
+    validator = CountingValidator()
+    node_c = Node(other_nodes=[node_a], block_tree=BlockTree(), validator=validator)
+    node_c.add_node(node_b)
+    validator.blocks_validated = 0  # Not counting node_c's first blockchain
+    return node_a, node_b, node_c, validator
+
+
+def test_switching_back_to_a_known_branch_only_validates_its_new_blocks():
+    node_a, node_b, node_c, validator = create_nodes()
+    node_a.transfer_coins("X_ADDRESS", coins=1)
+    for _ in range(2):
+        node_b.transfer_coins("Y_ADDRESS", coins=1)
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_blockchain() == node_b.get_blockchain()
+    assert validator.blocks_validated == 3
+    assert len(node_c._block_tree.tips()) == 2
+
+    # node_a's branch wins again: only its 2 new blocks are checked, not the one node_c already had
+    for _ in range(2):
+        node_a.transfer_coins("X_ADDRESS", coins=1)
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_blockchain() == node_a.get_blockchain()
+    assert validator.blocks_validated == 5
+    assert node_c.get_balance("X_ADDRESS") == 3
+    assert node_c.get_balance("Y_ADDRESS") == 0
+
+    for _ in range(2):
+        node_b.transfer_coins("Y_ADDRESS", coins=1)
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_blockchain() == node_b.get_blockchain()
+    assert validator.blocks_validated == 7
+    assert node_c.get_balance("X_ADDRESS") == 0
+    assert node_c.get_balance("Y_ADDRESS") == 4
+
+
+def test_orphans_connect_when_their_previous_block_arrives():
+    node_a, _, node_c, _ = create_nodes()
+    node_a.transfer_coins("X_ADDRESS", coins=1)
+    block_2 = node_a.get_blockchain()
+    node_a.transfer_coins("X_ADDRESS", coins=1)
+    block_3 = node_a.get_blockchain()
+
+    assert not node_c.receive_block(block_3)
+    assert node_c._block_tree.orphan_count() == 1
+    assert node_c.receive_block(block_2)
+    assert node_c.get_blockchain() == block_3
+    assert node_c._block_tree.orphan_count() == 0
+    assert node_c.get_balance("X_ADDRESS") == 2
+
+
+def test_invalid_blocks_are_removed_from_the_tree():
+    _, _, node_c, _ = create_nodes()
+    tip = node_c.get_blockchain()
+    signed_transaction = node_c.sign(Transaction(node_c.address, "X_ADDRESS", 1))
+    bad_block = Block(signed_transaction, previous_block=tip, magic_number=0, difficulty=4)
+
+    assert not node_c.receive_block(bad_block)
+    assert node_c.get_blockchain() == tip
+    assert bad_block.block_hash not in node_c._block_tree
+    assert node_c._block_tree.tips() == [tip]
+
+
+def test_branches_that_fork_deeper_than_max_depth_are_ignored():
+    node_a = Node(coins=100, miner=Miner(difficulty=4))
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=4))
+    node_a.transfer_coins(node_b.address, coins=50)
+    node_b.pull_blockchains_from_other_nodes()
+    node_c = Node(other_nodes=[node_a], block_tree=BlockTree(max_depth=2))
+    for _ in range(3):
+        node_a.transfer_coins("X_ADDRESS", coins=1)
+    node_c.pull_blockchains_from_other_nodes()
+    for _ in range(5):
+        node_b.transfer_coins("Y_ADDRESS", coins=1)
+
+    node_c.add_node(node_b)
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_blockchain() == node_a.get_blockchain()
+    assert len(node_c._block_tree) == 3
+
+
+def test_block_tree_cant_be_pruned():
+    with pytest.raises(ValueError):
+        Node(coins=100, block_tree=BlockTree(), prune_depth=10)
+    with pytest.raises(ValueError):
+        BlockTree(max_depth=0)
@@ -1,4 +1,5 @@
 from blockchain import *
+from chain import blocks_between, find_common_ancestor
 
 A_ADDRESS = "NODE_A_ADDRESS"
 B_ADDRESS = "NODE_B_ADDRESS"
@@ -184,4 +185,277 @@ def test_merge_blockchains__one_is_longer__picks_longer_one():
     assert Node.merge_blockchains(block_a, block_a) == block_a
     assert Node.merge_blockchains(block_b1, block_b1) == block_b1
     assert Node.merge_blockchains(block_c2, block_b1) == block_c2
-    assert Node.merge_blockchains(block_b1, block_c2) == block_c2
\ No newline at end of file
+    assert Node.merge_blockchains(block_b1, block_c2) == block_c2
+
+def test_get_balance_matches_calculate_balance():
+    node_a = Node(coins=200)
+    node_b = Node(other_nodes=[node_a])
+    node_a.transfer_coins(node_b.address, coins=50)
+    node_a.transfer_coins(node_b.address, coins=30)
+    node_b.pull_blockchains_from_other_nodes()
+
+    # The balance index should agree with walking the chain
+    for node in [node_a, node_b]:
+        assert node.get_balance(node_a.address) == Node.calculate_balance(node_a.address, node.get_blockchain()) == 120
+        assert node.get_balance(node_b.address) == Node.calculate_balance(node_b.address, node.get_blockchain()) == 80
+
+
+def test_account_state_rolls_back_to_other_fork():
+    # A --> B1
+    # A --> B2 --> C2
+    block_a = create_block(previous_block=None, from_address=None, to_address=A_ADDRESS, coins=100)
+    block_b1 = create_block(previous_block=block_a, coins=60)
+    block_b2 = create_block(previous_block=block_a, coins=10)
+    block_c2 = create_block(previous_block=block_b2, coins=20)
+
+    state = AccountState()
+    state.move_to(block_b1)
+    assert state.balance(A_ADDRESS) == 40
+    assert state.balance(B_ADDRESS) == 60
+
+    # Switching to the other fork undoes B1 and applies B2, C2
+    state.move_to(block_c2)
+    assert state.balance(A_ADDRESS) == Node.calculate_balance(A_ADDRESS, block_c2) == 70
+    assert state.balance(B_ADDRESS) == Node.calculate_balance(B_ADDRESS, block_c2) == 30
+
+
+def test_blocks_know_their_height():
+    block_a = create_block(previous_block=None)
+    block_b = create_block(previous_block=block_a)
+    block_c = create_block(previous_block=block_b)
+
+    assert (block_a.height, block_b.height, block_c.height) == (0, 1, 2)
+    assert block_a.total_work < block_b.total_work < block_c.total_work
+
+
+def test_find_common_ancestor():
+    # A --> B1
+    # A --> B2 --> C2 --> D2
+    block_a = create_block(previous_block=None)
+    block_b1 = create_block(previous_block=block_a)
+    block_b2 = create_block(previous_block=block_a)
+    block_c2 = create_block(previous_block=block_b2)
+    block_d2 = create_block(previous_block=block_c2)
+
+    assert find_common_ancestor(block_b1, block_d2) is block_a
+    assert find_common_ancestor(block_d2, block_b2) is block_b2
+    assert find_common_ancestor(block_c2, block_c2) is block_c2
+    assert find_common_ancestor(block_b1, create_block(previous_block=None)) is None
+
+
+def test_blocks_between_streams_oldest_first():
+    chain = [create_block(previous_block=None)]
+    for _ in range(10):
+        chain.append(create_block(previous_block=chain[-1]))
+
+    for segment_size in (1, 3, 4, 20):
+        assert list(blocks_between(chain[-1], chain[2], segment_size)) == chain[3:]
+        assert list(blocks_between(chain[-1], None, segment_size)) == chain
+    assert list(blocks_between(chain[2], chain[2])) == []
+    # Pruned after the fork point: the blocks in between can't be read
+    assert blocks_between(chain[-1].relinked(None), chain[2]) is None
+
+
+def test_node_mines_with_its_miner():
+    node_a = Node(coins=200, miner=Miner(difficulty=0))
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=0))
+    node_a.transfer_coins(node_b.address, coins=50)
+
+    # With difficulty 0 the first magic number is accepted
+    assert node_a.get_blockchain().magic_number == 0
+    assert node_a.get_blockchain().difficulty == 0
+    assert Node.calculate_balance(node_b.address, node_a.get_blockchain()) == 50
+
+
+def test_block_hash_meets_difficulty():
+    node_a = Node(coins=200, miner=Miner(difficulty=8))
+    node_a.transfer_coins(B_ADDRESS, coins=50)
+
+    block = node_a.get_blockchain()
+    assert len(block.header()) == HEADER_SIZE
+    assert block.block_hash == hashlib.sha256(block.header()).digest()
+    assert block.block_hash[0] == 0  # 8 bits of difficulty == one leading zero byte
+    assert block.previous_hash == block.previous_block.block_hash
+
+
+def test_hashing_deep_chains():
+    # The header only refers to the previous block by hash, so hashing doesn't recurse into the chain
+    block = create_block(previous_block=None)
+    for _ in range(5000):
+        block = create_block(previous_block=block)
+
+    assert block.height == 5000
+    assert len(block.header()) == HEADER_SIZE
+
+
+def test_deep_chains_compare_by_hash():
+    chain = [create_block(previous_block=None)]
+    for _ in range(5000):
+        chain.append(create_block(previous_block=chain[-1]))
+    tip = chain[-1]
+    copy = Block(None, signed_transactions=tip.signed_transactions, previous_block=tip.previous_block,
+                 magic_number=tip.magic_number, difficulty=tip.difficulty, timestamp=tip.timestamp)
+
+    assert copy == tip and copy is not tip
+    assert copy in chain
+    assert len({*chain, copy}) == len(chain)
+    assert tip != tip.previous_block
+    assert len(repr(tip)) < 300
+
+
+def test_interned_blocks_are_shared():
+    block = create_block(previous_block=None)
+    copy = Block(None, signed_transactions=block.signed_transactions, previous_block=None,
+                 magic_number=block.magic_number, difficulty=block.difficulty, timestamp=block.timestamp)
+
+    assert intern_block(block) is block
+    assert intern_block(copy) is block
+
+
+def test_signature():
+    node_a = Node(coins=200)
+    node_b = Node(other_nodes=[node_a])
+    node_a.transfer_coins(node_b.address, coins=50)
+
+    signed_transaction = node_a.get_blockchain().signed_transaction
+    assert Node.is_signed_transaction_valid(signed_transaction)
+
+    # Changing the transaction breaks the signature
+    forged = SignedTransaction(Transaction(node_a.address, node_b.address, 150), signed_transaction.signature)
+    assert not Node.is_signed_transaction_valid(forged)
+    assert not Node.is_signed_transaction_valid(SignedTransaction(signed_transaction.transaction, b"signed"))
+
+
+def test_pull_ignores_chains_with_bad_signatures():
+    node_a = Node(coins=200)
+    node_b = Node(other_nodes=[node_a])
+
+    # Someone forges a transfer from B to A
+    forged = SignedTransaction(Transaction(node_b.address, node_a.address, 10), node_a.sign(
+        Transaction(node_b.address, node_a.address, 10)).signature)
+    node_a._set_last_block(node_a.create_block(forged, node_a.get_blockchain()))
+
+    node_b.pull_blockchains_from_other_nodes()
+    assert node_b.get_blockchain() is node_a.get_blockchain().previous_block
+
+
+def test_mine_block_packs_pending_transfers():
+    node_a = Node(coins=200, mine_each_transaction=False)
+    node_b = Node(other_nodes=[node_a])
+    genesis = node_a.get_blockchain()
+
+    node_a.transfer_coins(node_b.address, coins=50)
+    node_a.transfer_coins(node_b.address, coins=60)
+    node_a.transfer_coins(node_b.address, coins=100)  # Not enough coins left after the pending transfers
+
+    # Nothing is mined until mine_block is called
+    assert node_a.get_blockchain() is genesis
+
+    block = node_a.mine_block()
+    assert block.previous_block is genesis
+    assert [signed_transaction.transaction.coins for signed_transaction in block.signed_transactions] == [50, 60]
+    assert node_a.mine_block() is None
+
+    assert node_a.get_balance(node_b.address) == Node.calculate_balance(node_b.address, block) == 110
+    node_b.pull_blockchains_from_other_nodes()
+    assert node_b.get_balance(node_a.address) == 90
+
+
+def test_block_locator_finds_the_fork():
+    node_a = Node(coins=200, miner=Miner(difficulty=0))
+    for _ in range(30):
+        node_a.transfer_coins(B_ADDRESS, coins=1)
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=0))
+    for _ in range(3):
+        node_a.transfer_coins(B_ADDRESS, coins=1)
+        coinbase = SignedTransaction(Transaction(None, B_ADDRESS, 1), signature=b"")
+        node_b._set_last_block(node_b.create_block(coinbase, node_b.get_blockchain()))
+
+    # The last 10 blocks, then exponentially further back, down to the genesis
+    locator = node_b.get_block_locator()
+    heights = [height for height, _ in locator]
+    assert heights[:10] == list(range(33, 23, -1))
+    assert heights[10:] == [22, 18, 10, 0]
+
+    fork_point, blocks = node_a.get_blocks_after(locator, max_count=2)
+    assert fork_point.height == 30  # The last block both chains have
+    assert [block.height for block in blocks] == [31, 32]
+    assert node_a.get_blocks([(block.height, block.block_hash) for block in blocks]) == blocks
+
+
+def test_chain_records_are_slotted_and_share_addresses():
+    block = create_block(create_block(None, from_address=None, to_address="".join(["NODE_A", "_ADDRESS"])))
+    first_address = block.previous_block.signed_transaction.transaction.to_address
+
+    assert block.signed_transaction.transaction.from_address is first_address
+    for record in (block, block.signed_transaction, block.signed_transaction.transaction):
+        assert not hasattr(record, '__dict__')
+
+
+def test_received_transfers_cant_create_coins():
+    node_a = Node(coins=100, miner=Miner(difficulty=4))
+    attacker = Node(other_nodes=[node_a])
+    coins_from_nowhere = attacker.sign(Transaction(None, attacker.address, 10 ** 9))
+
+    assert not node_a.receive_transaction(coins_from_nowhere)
+    assert node_a.mine_block() is None
+    assert node_a.get_balance(attacker.address) == 0
+
+
+def test_confirmed_transfers_cant_be_replayed():
+    node_a = Node(coins=200, miner=Miner(difficulty=4))
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=4))
+    node_a.transfer_coins(node_b.address, coins=50)
+    node_b.pull_blockchains_from_other_nodes()
+    confirmed = node_a.get_blockchain().signed_transaction
+
+    # node_b puts node_a's transfer in a block again, to be paid twice
+    replay = node_b.create_block(confirmed, node_b.get_blockchain())
+    assert not node_a.receive_block(replay)
+    twice = node_b.create_block([node_b.sign(Transaction(node_b.address, "C_ADDRESS", 1))] * 2, node_a.get_blockchain())
+    assert not node_a.receive_block(twice)
+    assert node_a.get_balance(node_a.address) == 150
+
+
+def test_reorg_makes_undone_transfers_pending_again():
+    node_a = Node(coins=100, miner=Miner(difficulty=4))
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=4))
+    node_b.pull_blockchains_from_other_nodes()
+    node_a.transfer_coins(B_ADDRESS, coins=10)
+    undone_block = node_a.get_blockchain()
+
+    # node_b mines a longer branch without the transfer, and node_a switches to it
+    for _ in range(2):
+        node_b._set_last_block(node_b.create_block([], node_b.get_blockchain()))
+    node_a.pull_blockchain(node_b.get_blockchain())
+    assert node_a.get_blockchain() == node_b.get_blockchain()
+    assert node_a.get_balance(B_ADDRESS) == 0
+    assert undone_block.signed_transaction in node_a._mempool
+
+    assert node_a.mine_block().signed_transactions == undone_block.signed_transactions
+    assert node_a.get_balance(B_ADDRESS) == 10
+
+
+def test_mined_blocks_are_validated():
+    node_a = Node(coins=100, miner=Miner(difficulty=4), mine_each_transaction=False)
+    tip = node_a.get_blockchain()
+    badly_signed = SignedTransaction(Transaction(node_a.address, B_ADDRESS, 10), bytes(64))
+    node_a._mempool.add(badly_signed, node_a.get_balance(node_a.address))  # The mempool doesn't check signatures
+
+    assert node_a.mine_block() is None
+    assert node_a.get_blockchain() == tip
+    # It was dropped, so it doesn't keep the next transfers out of a block
+    assert len(node_a._mempool) == 0
+    node_a.transfer_coins(B_ADDRESS, coins=10)
+    assert node_a.mine_block().height == 1
+
+
+def test_nodes_only_make_transfers_they_can_sign():
+    node_a = Node(coins=100, miner=Miner(difficulty=4))
+    node_b = Node(other_nodes=[node_a])
+    node_a.transfer_coins(node_b.address, coins=50)
+
+    # node_b's coins, but node_a can't sign for them
+    node_a.make_transaction(node_b.address, node_a.address, 10)
+    assert len(node_a._mempool) == 0
+    assert node_a.get_blockchain().height == 1
@@ -0,0 +1,59 @@
+from blockchain_part1 import *
+
+
+def test_pull_copies_new_transactions_once():
+    node_a = Node(initial_coins=200)
+    node_b = Node(other_nodes=[node_a])
+    node_a.transfer_coins(node_b.address, coins=50)
+
+    node_b.pull_transactions_from_other_nodes()
+    node_b.pull_transactions_from_other_nodes()
+
+    assert node_b._signed_transactions == node_a._signed_transactions
+
+
+def test_pull_only_transfers_what_was_added_since_the_last_pull():
+    node_a = Node(initial_coins=200)
+    node_b = Node(other_nodes=[node_a])
+    node_b.pull_transactions_from_other_nodes()
+
+    node_a.transfer_coins(node_b.address, coins=50)
+    node_a.transfer_coins(node_b.address, coins=20)
+
+    new_transactions, position = node_a.get_signed_transactions_since(node_b._sync_positions[node_a])
+    assert [transaction.transaction.coins for transaction in new_transactions] == [50, 20]
+    assert position == 3
+
+    node_b.pull_transactions_from_other_nodes()
+    assert len(node_b._signed_transactions) == 3
+    assert node_b._sync_positions[node_a] == 3
+
+
+def test_transaction_id_is_stable():
+    transaction_1 = SignedTransaction(Transaction(1, 2, 10, salt=0), b"signature")
+    transaction_2 = SignedTransaction(Transaction(1, 2, 10, salt=0), b"signature")
+
+    assert transaction_1.transaction_id() == transaction_2.transaction_id()
+    assert transaction_1.transaction_id() != SignedTransaction(Transaction(1, 2, 11, salt=0), b"signature").transaction_id()
+    assert transaction_1.transaction_id() != SignedTransaction(Transaction(1, 2, 10, salt=1), b"signature").transaction_id()
+
+
+def test_signature():
+    node_a = Node(initial_coins=200)
+    node_b = Node(other_nodes=[node_a])
+    node_a.transfer_coins(node_b.address, coins=50)
+
+    signed_transaction = node_a._signed_transactions[1]
+
+    assert Node.is_signed_transaction_valid(signed_transaction)
+    assert not Node.is_signed_transaction_valid(SignedTransaction(signed_transaction.transaction, b"signature"))
+
+
+def test_pull_skips_forged_transactions():
+    node_a = Node(initial_coins=200)
+    node_b = Node(other_nodes=[node_a])
+    node_a._add_signed_transaction(SignedTransaction(Transaction(node_b.address, node_a.address, 10), b"forged"))
+
+    node_b.pull_transactions_from_other_nodes()
+
+    assert node_b._signed_transactions == node_a._signed_transactions[:1]
@@ -0,0 +1,108 @@
+import gc
+import weakref
+
+import pytest
+
+from blockchain import *
+from blockstore import *
+
+
+def test_reopened_node_continues_the_stored_chain(tmp_path):
+    with BlockStore(str(tmp_path), sync_every=2) as store:
+        node_a = Node(coins=200, miner=Miner(difficulty=0), block_store=store)
+        for _ in range(5):
+            node_a.transfer_coins(to_address="C_ADDRESS", coins=10)
+        tip_hash = node_a.get_blockchain().block_hash
+
+    with BlockStore(str(tmp_path)) as store:
+        restarted = Node(miner=Miner(difficulty=0), block_store=store)
+        # The balances were saved with the block at height 4, so only block 5 is replayed
+        assert restarted._account_state.tip.height == 4
+
+        assert len(store) == 6
+        assert restarted.get_blockchain().block_hash == tip_hash
+        assert restarted.get_blockchain().height == 5
+        assert restarted.get_balance("C_ADDRESS") == 50
+        assert Node.calculate_balance("C_ADDRESS", restarted.get_blockchain()) == 50
+
+        # Blocks are read by height or hash, and previous_block is loaded on access
+        genesis = store.get(0)
+        assert genesis.previous_block is None
+        assert store.get(1).previous_block is genesis
+        assert store.get_by_hash(tip_hash) is restarted.get_blockchain()
+        assert store.get_by_hash(bytes(32)) is None
+
+        # Walking the chain doesn't keep it in memory: only the blocks someone holds are
+        block = restarted.get_blockchain()
+        while block.previous_block is not None:
+            block = block.previous_block
+        genesis = weakref.ref(block)
+        del block
+        gc.collect()
+        assert genesis() is None
+
+
+def test_set_tip_switches_to_another_fork(tmp_path):
+    miner_node = Node(coins=100, miner=Miner(difficulty=0))
+    genesis = miner_node.get_blockchain()
+    fork_1 = miner_node.create_block(SignedTransaction(Transaction(None, "1", 10), "signed"), genesis)
+    fork_2a = miner_node.create_block(SignedTransaction(Transaction(None, "2", 10), "signed"), genesis)
+    fork_2b = miner_node.create_block(SignedTransaction(Transaction(None, "2", 10), "signed"), fork_2a)
+
+    with BlockStore(str(tmp_path)) as store:
+        store.set_tip(fork_1)
+        store.set_tip(fork_2b)
+        assert len(store) == 3
+        assert store.get(1).block_hash == fork_2a.block_hash
+
+        store.set_tip(fork_1)
+        assert len(store) == 2
+        assert fork_2b.block_hash in store  # The other fork's blocks are still stored
+
+    with BlockStore(str(tmp_path)) as store:
+        assert store.tip().block_hash == fork_1.block_hash
+
+
+def test_hash_index_grows(tmp_path):
+    node = Node(coins=100, miner=Miner(difficulty=0))
+    blocks = [node.get_blockchain()]
+    for i in range(3000):
+        blocks.append(node.create_block(SignedTransaction(Transaction(None, str(i), 1), "signed"), blocks[-1]))
+
+    with BlockStore(str(tmp_path), sync_every=500) as store:
+        store.set_tip(blocks[-1])
+
+    with BlockStore(str(tmp_path)) as store:
+        assert len(store) == 3001
+        assert all(block.block_hash in store for block in blocks)
+        assert store.get(1234).signed_transaction.transaction.to_address == "1233"
+
+
+def test_unfinished_flush_is_dropped_on_open(tmp_path, monkeypatch):
+    node = Node(coins=100, miner=Miner(difficulty=0))
+    blocks = [node.get_blockchain()]
+    for i in range(5):
+        blocks.append(node.create_block(SignedTransaction(Transaction(None, str(i), 1), "signed"), blocks[-1]))
+
+    store = BlockStore(str(tmp_path))
+    store.set_tip(blocks[2])
+    store.flush()
+
+    # Crash after the records and index entries of blocks 3 and 4 were synced, before they were committed
+    def crash():
+        raise OSError("Crashed")
+    monkeypatch.setattr(store, '_commit', crash)
+    store.set_tip(blocks[4])
+    with pytest.raises(OSError):
+        store.flush()
+    for file in [store._heights, store._hashes, store._heights_file, store._hashes_file, store._segment]:
+        file.close()
+
+    with BlockStore(str(tmp_path)) as store:
+        assert len(store) == 3
+        assert store.tip().block_hash == blocks[2].block_hash
+        assert blocks[3].block_hash not in store
+        store.set_tip(blocks[5])
+
+    with BlockStore(str(tmp_path)) as store:
+        assert [store.get(height).block_hash for height in range(6)] == [block.block_hash for block in blocks]
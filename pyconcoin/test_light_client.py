@@ -0,0 +1,79 @@
+from blockchain import *
+from light_client import *
+from merkle import *
+from transaction_index import TransactionIndex
+
+
+def test_merkle_paths_lead_to_the_root():
+    for count in range(1, 12):
+        leaves = [bytes([i]) * 32 for i in range(count)]
+        root = merkle_root(leaves)
+
+        for index, leaf in enumerate(leaves):
+            path = merkle_path(leaves, index)
+            assert root_from_path(leaf, path) == root
+            assert len(path) <= count.bit_length()
+        assert root_from_path(b'other leaf', merkle_path(leaves, 0)) != root
+    assert merkle_root([b'a', b'b', b'c']) != merkle_root([b'a', b'b', b'c', b'c'])
+
+
+def test_light_client_verifies_payments_with_headers_only():
+    node_a = Node(coins=200, mine_each_transaction=False)
+    node_b = Node(other_nodes=[node_a])
+    for coins in (10, 20, 30):
+        node_a.transfer_coins(node_b.address, coins=coins)
+    node_a.mine_block()
+    node_a.transfer_coins(node_b.address, coins=5)
+    node_a.mine_block()
+    client = LightClient(node_a)
+
+    assert client.sync()
+    assert client.height == node_a.get_blockchain().height
+    assert client.header_at(client.height) == node_a.get_blockchain().header()
+    assert client.balance(node_b.address) == 65
+    assert client.balance(node_a.address) == node_a.get_balance(node_a.address)
+
+    payment = node_a.get_blockchain().signed_transaction
+    assert client.verify_payment(payment)
+    forged = SignedTransaction(Transaction(node_a.address, node_b.address, 500, salt=payment.transaction.salt),
+                               payment.signature)
+    assert not client.verify_payment(forged)
+
+    # The proof doesn't match the header if the transaction is swapped for another one
+    proof = node_a.get_transaction_proof(payment.digest())
+    proof.signed_transaction = forged
+    assert not client.verify_proof(proof)
+
+
+def test_light_client_follows_the_chain_with_more_work():
+    node_a = Node(coins=200)
+    client = LightClient(node_a, confirmations=2)
+    client.sync()
+    node_a.transfer_coins("NODE_B_ADDRESS", coins=10)
+    payment = node_a.get_blockchain().signed_transaction
+
+    assert client.sync()
+    assert not client.sync()
+    assert not client.verify_payment(payment)  # Only 1 confirmation
+    node_a.transfer_coins("NODE_B_ADDRESS", coins=10)
+    client.sync()
+    assert client.verify_payment(payment)
+
+
+def test_transaction_index_follows_reorgs():
+    def block(previous_block, to_address):
+        signed_transaction = SignedTransaction(Transaction("NODE_A_ADDRESS", to_address, 1), signature="signed")
+        return Block(signed_transaction, previous_block, magic_number=0)
+    genesis = block(None, "NODE_A_ADDRESS")
+    fork_1 = block(block(genesis, "NODE_B_ADDRESS"), "NODE_B_ADDRESS")
+    fork_2 = block(genesis, "NODE_C_ADDRESS")
+    index = TransactionIndex()
+
+    index.move_to(fork_1)
+    assert len(index.find_address("NODE_B_ADDRESS")) == 2
+    index.move_to(fork_2)
+
+    assert index.find(fork_1.signed_transaction.digest()) is None
+    assert index.find(fork_2.signed_transaction.digest()) == (fork_2, 0)
+    assert index.find_address("NODE_B_ADDRESS") == []
+    assert [location[0] for location in index.find_address("NODE_A_ADDRESS")] == [genesis, fork_2]
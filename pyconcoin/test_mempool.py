@@ -0,0 +1,66 @@
+from blockchain import SignedTransaction, Transaction
+from mempool import *
+
+
+def transfer(coins, from_address="A", to_address="B"):
+    return SignedTransaction(Transaction(from_address, to_address, coins, salt=0), bytes(64))
+
+
+def test_add_checks_pending_spends():
+    mempool = Mempool()
+
+    assert mempool.add(transfer(40), confirmed_balance=100)
+    assert mempool.add(transfer(50), confirmed_balance=100)
+    assert not mempool.add(transfer(10), confirmed_balance=100)  # 100 - 90 pending is not more than 10
+    assert not mempool.add(transfer(40), confirmed_balance=100)  # Already pending
+    assert mempool.pending_spent("A") == 90
+    assert len(mempool) == 2
+
+
+def test_take_for_block_respects_the_block_budget():
+    mempool = Mempool(max_block_transactions=3)
+    transfers = [transfer(coins) for coins in range(1, 6)]
+    for signed_transaction in transfers:
+        mempool.add(signed_transaction, confirmed_balance=100)
+
+    assert mempool.take_for_block(lambda address: 100) == transfers[:3]
+
+    mempool.max_block_bytes = 2 * transaction_size(transfers[0])
+    assert mempool.take_for_block(lambda address: 100) == transfers[:2]
+
+    mempool.remove(transfers[:2])
+    assert mempool.take_for_block(lambda address: 100) == transfers[2:4]
+    assert mempool.pending_spent("A") == 3 + 4 + 5
+
+
+def test_take_for_block_skips_transfers_the_sender_cant_pay():
+    mempool = Mempool()
+    mempool.add(transfer(60), confirmed_balance=100)
+    mempool.add(transfer(5, from_address="C"), confirmed_balance=10)
+
+    # A's balance dropped since the transfer was accepted
+    balances = {"A": 50, "C": 10}
+    assert [t.transaction.from_address for t in mempool.take_for_block(balances.get)] == ["C"]
+
+
+def test_restore_makes_undone_transfers_pending_again():
+    mempool = Mempool()
+    confirmed = [transfer(40), transfer(50)]
+    mempool.remove(confirmed)
+    assert not mempool.add(confirmed[0], confirmed_balance=100)  # Already in a block
+
+    # A reorg undid their block, and A spent some coins in the new blocks
+    mempool.restore(confirmed, lambda address: 60)
+    assert list(mempool._pending.values()) == [confirmed[0]]
+    assert mempool.pending_spent("A") == 40
+
+
+def test_transfers_without_a_sender_are_rejected():
+    # Only the genesis block creates coins
+    mempool = Mempool()
+    assert not mempool.add(transfer(10, from_address=None), confirmed_balance=0)
+    # Nor can a transfer create fractions of coins, or hold something else than coins and addresses
+    assert not mempool.add(transfer(0.5), confirmed_balance=100)
+    assert not mempool.add(transfer("1"), confirmed_balance=100)
+    assert not mempool.add(transfer(1, to_address=7), confirmed_balance=100)
+    assert len(mempool) == 0
@@ -0,0 +1,114 @@
+import math
+
+import pytest
+
+from blockchain import *
+from metrics import *
+
+
+@pytest.fixture
+def registry():
+    # The global registry, zeroed before and after every test
+    REGISTRY.reset()
+    yield REGISTRY
+    REGISTRY.enabled = True
+    REGISTRY.tracing = False
+    REGISTRY.reset()
+
+
+def counter_value(registry, name, labels=()):
+    return registry.snapshot()['counters'][name].get(labels, 0)
+
+
+def test_counter_and_histogram():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_total', "A counter")
+    counter.inc()
+    counter.inc(4)
+    assert registry.counter('test_total') is counter
+    histogram = registry.histogram('test_seconds', buckets=(1, 2, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+
+    snapshot = registry.snapshot()
+    assert snapshot['counters']['test_total'][()] == 5
+    assert snapshot['histograms']['test_seconds'][()] == {'count': 4, 'sum': 14.5,
+                                                           'buckets': [(1, 2), (2, 2), (5, 3), (math.inf, 4)]}
+
+
+def test_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter('test_total', "A counter", labels={'peer': 'a"b'}).inc(2)
+    registry.histogram('test_blocks', "A histogram", buckets=(1, 4)).observe(3)
+
+    text = registry.prometheus_text()
+    assert '# HELP test_total A counter\n# TYPE test_total counter\ntest_total{peer="a\\"b"} 2\n' in text
+    assert '# TYPE test_blocks histogram\n' in text
+    assert 'test_blocks_bucket{le="1"} 0\ntest_blocks_bucket{le="4"} 1\ntest_blocks_bucket{le="+Inf"} 1\n' in text
+    assert 'test_blocks_sum 3.0\ntest_blocks_count 1\n' in text
+
+
+def test_spans_are_exported_when_tracing():
+    registry = MetricsRegistry(tracing=True)
+    recorder = SpanRecorder(max_spans=2)
+    registry.add_exporter(recorder)
+    for peer in range(3):
+        with registry.span('test_pull', peer=peer):
+            pass
+
+    assert [span.attributes['peer'] for span in recorder.spans] == [1, 2]
+    assert registry.snapshot()['histograms']['test_pull_seconds'][()]['count'] == 3
+
+
+def test_noop_mode_records_nothing():
+    registry = MetricsRegistry(enabled=False, tracing=True)
+    recorder = SpanRecorder()
+    registry.add_exporter(recorder)
+    registry.counter('test_total').inc()
+    with registry.span('test_pull'):
+        pass
+
+    assert counter_value(registry, 'test_total') == 0
+    assert 'test_pull_seconds' not in registry.snapshot()['histograms']
+    assert recorder.spans == []
+
+
+def test_node_reports_mining_balance_and_sync(registry):
+    recorder = SpanRecorder()
+    registry.add_exporter(recorder)
+    registry.tracing = True
+    try:
+        node_a = Node(coins=100, miner=Miner(difficulty=4))
+        node_b = Node(other_nodes=[node_a])
+        node_a.transfer_coins("B_ADDRESS", coins=10)
+        Node.calculate_balance("B_ADDRESS", node_a.get_blockchain())
+        node_b.pull_blockchains_from_other_nodes()
+        node_b.get_balance("B_ADDRESS")
+    finally:
+        registry.remove_exporter(recorder)
+
+    snapshot = registry.snapshot()
+    assert counter_value(registry, 'pyconcoin_blocks_mined_total') == 2
+    assert snapshot['histograms']['pyconcoin_mining_attempts'][()]['count'] == 2
+    assert snapshot['histograms']['pyconcoin_calculate_balance_blocks'][()]['sum'] == 2
+    # get_balance only replays the blocks added since the balances were last brought up to date
+    assert snapshot['histograms']['pyconcoin_get_balance_blocks'][()]['sum'] == 2
+    assert snapshot['histograms']['pyconcoin_pull_peer_seconds'][(('peer', repr(node_a)),)]['count'] == 1
+    # node_b's first blockchain (the genesis block), then the block of node_a's transfer
+    assert counter_value(registry, 'pyconcoin_blocks_adopted_total') == 2
+    assert {'pyconcoin_create_block', 'pyconcoin_pull', 'pyconcoin_merge_blockchains'} <= \
+        {span.name for span in recorder.spans}
+
+
+def test_exporter_writes_prometheus_file(registry, tmp_path):
+    path = str(tmp_path / 'pyconcoin.prom')
+    exporter = PrometheusFileExporter(path)
+    registry.add_exporter(exporter)
+    try:
+        Node(coins=100, miner=Miner(difficulty=4))
+        registry.export()
+    finally:
+        registry.remove_exporter(exporter)
+
+    with open(path) as file:
+        assert 'pyconcoin_blocks_mined_total 1\n' in file.read()
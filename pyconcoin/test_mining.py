@@ -0,0 +1,36 @@
+from mining import *
+
+
+def test_difficulty_zero_accepts_the_first_nonce():
+    result = Miner(difficulty=0).mine(b"block")
+
+    assert result.nonce == 0
+    assert result.attempts == 1
+
+
+def test_single_process_mining_is_deterministic():
+    result_1 = Miner(difficulty=8).mine(b"block")
+    result_2 = Miner(difficulty=8).mine(b"block")
+
+    assert result_1.nonce == result_2.nonce
+    assert result_1.digest == hash_with_nonce(b"block", result_1.nonce)
+    assert meets_difficulty(result_1.digest, 8)
+    assert result_1.digest[0] == 0  # 8 bits == one leading zero byte
+
+
+def test_miner_reports_hash_rate():
+    miner = Miner(difficulty=8)
+    miner.mine(b"block 1")
+    miner.mine(b"block 2")
+
+    assert miner.total_attempts >= 2
+    assert miner.hash_rate > 0
+    assert miner.last_result.hash_rate > 0
+
+
+def test_process_pool_finds_a_valid_nonce():
+    with Miner(difficulty=12, processes=2) as miner:
+        for prefix in [b"block 1", b"block 2"]:
+            result = miner.mine(prefix)
+            assert meets_difficulty(hash_with_nonce(prefix, result.nonce), 12)
+            assert result.attempts >= 1
@@ -0,0 +1,135 @@
+import json
+import time
+
+import pytest
+
+from blockchain import *
+from network import *
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_pull_blockchains_over_tcp():
+    transport_a, transport_b = Transport(), Transport()
+    try:
+        node_a = Node(coins=200)
+        host, port = transport_a.serve(node_a)
+
+        # B only knows A through the network
+        node_b = Node(other_nodes=[transport_b.connect(host, port)])
+        transport_b.serve(node_b)
+        assert node_b.get_blockchain().block_hash == node_a.get_blockchain().block_hash
+
+        with transport_a.node_lock:
+            node_a.transfer_coins(node_b.address, coins=50)
+        node_b.pull_blockchains_from_other_nodes()
+
+        assert node_b.get_blockchain().block_hash == node_a.get_blockchain().block_hash
+        assert node_b.get_balance(node_a.address) == 150
+        assert node_b.get_balance(node_b.address) == 50
+    finally:
+        transport_a.close()
+        transport_b.close()
+
+
+def test_new_blocks_and_transfers_are_announced():
+    transport_a, transport_b = Transport(), Transport()
+    try:
+        node_a = Node(coins=200, mine_each_transaction=False)
+        address_a = transport_a.serve(node_a)
+        node_b = Node(other_nodes=[transport_b.connect(*address_a)])
+        address_b = transport_b.serve(node_b)
+        node_a.add_node(transport_a.connect(*address_b))
+
+        with transport_a.node_lock:
+            node_a.transfer_coins(node_b.address, coins=50)
+        wait_until(lambda: len(node_b._mempool) == 1)
+
+        with transport_a.node_lock:
+            node_a.mine_block()
+        wait_until(lambda: node_b.get_blockchain().block_hash == node_a.get_blockchain().block_hash)
+
+        assert node_b.get_balance(node_b.address) == 50
+        assert len(node_b._mempool) == 0
+    finally:
+        transport_a.close()
+        transport_b.close()
+
+
+def test_sync_fetches_only_the_missing_blocks(monkeypatch):
+    # Small limits, so the sync needs several HEADERS messages and several GET_BLOCKS batches
+    monkeypatch.setattr('network.MAX_HEADERS', 5)
+    monkeypatch.setattr('network.BLOCKS_PER_REQUEST', 2)
+
+    transport_a, transport_b = Transport(), Transport()
+    try:
+        node_a = Node(coins=200, miner=Miner(difficulty=0))
+        address_a = transport_a.serve(node_a)
+        node_b = Node(other_nodes=[transport_b.connect(*address_a)], miner=Miner(difficulty=0))
+        old_tip = node_b.get_blockchain()
+
+        with transport_a.node_lock:
+            for _ in range(12):
+                node_a.transfer_coins(node_b.address, coins=1)
+
+        requests = []
+        original_request = transport_b.request
+
+        async def counting_request(address, message_type, payload=b''):
+            requests.append(message_type)
+            return await original_request(address, message_type, payload)
+
+        transport_b.request = counting_request
+        node_b.pull_blockchains_from_other_nodes()
+
+        assert node_b.get_blockchain().block_hash == node_a.get_blockchain().block_hash
+        assert node_b.get_balance(node_b.address) == 12
+        # 12 new headers = 5 + 5 + 2, and 12 blocks in batches of 2. The genesis block was not transferred again
+        assert requests.count(MessageType.GET_HEADERS) == 3
+        assert requests.count(MessageType.GET_BLOCKS) == 6
+        block = node_b.get_blockchain()
+        while block.height > 0:
+            block = block.previous_block
+        assert block is old_tip
+
+        # Nothing new: only the headers are asked for
+        requests.clear()
+        node_b.pull_blockchains_from_other_nodes()
+        assert requests == [MessageType.GET_HEADERS]
+    finally:
+        transport_a.close()
+        transport_b.close()
+
+
+def test_malformed_requests_get_an_error():
+    transport_a, transport_b = Transport(), Transport()
+    try:
+        address = transport_a.serve(Node(coins=200))
+
+        # Too short for the max header count: the connection stays open for the next request
+        message_type, _ = transport_b.run(transport_b.request(address, MessageType.GET_HEADERS, b'\x00'))
+        assert message_type == MessageType.ERROR
+        # An unknown message type, and transactions that aren't shaped like encode_transaction's
+        message_type, _ = transport_b.run(transport_b.request(address, 99, b'payload'))
+        assert message_type == MessageType.ERROR
+        for transaction in ({}, ["A", "B", 10], ["A", "B", "10", 0, "signed"], ["A", "B", 0.5, 0, "signed"]):
+            message_type, _ = transport_b.run(transport_b.request(address, MessageType.ANNOUNCE_TRANSACTION,
+                                                                  json.dumps(transaction).encode('utf-8')))
+            assert message_type == MessageType.ERROR
+        message_type, _ = transport_b.run(transport_b.request(address, MessageType.GET_BLOCKS, b''))
+        assert message_type == MessageType.BLOCKS
+    finally:
+        transport_a.close()
+        transport_b.close()
+
+
+def test_main_needs_a_network_to_start_or_join(monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['network.py', '--port', '0'])
+    with pytest.raises(SystemExit):
+        main()
+    assert "--peer is needed" in capsys.readouterr().err
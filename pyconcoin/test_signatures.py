@@ -0,0 +1,49 @@
+import nacl.signing
+
+from blockchain import SignedTransaction, Transaction
+from signatures import *
+
+
+def test_verify_many_checks_each_transaction():
+    key_a = nacl.signing.SigningKey.generate()
+    key_b = nacl.signing.SigningKey.generate()
+    transaction = Transaction(address_of(key_a), address_of(key_b), 10)
+
+    valid = SignedTransaction(transaction, sign_transaction(key_a, transaction))
+    signed_by_wrong_key = SignedTransaction(transaction, sign_transaction(key_b, transaction))
+    placeholder = SignedTransaction(Transaction("NODE_A_ADDRESS", "NODE_B_ADDRESS", 10), "signed")
+
+    verifier = SignatureVerifier(max_workers=4)
+    assert verifier.verify_many([valid, signed_by_wrong_key, placeholder, valid]) == [True, False, False, True]
+    verifier.close()
+
+
+def test_valid_transactions_are_cached():
+    key = nacl.signing.SigningKey.generate()
+    transactions = [Transaction(None, address_of(key), coins) for coins in range(3)]
+    signed_transactions = [SignedTransaction(transaction, sign_transaction(key, transaction))
+                           for transaction in transactions]
+
+    verifier = SignatureVerifier(cache_size=2)
+    assert verifier.verify_many(signed_transactions) == [True, True, True]
+
+    # Only the last 2 are remembered
+    assert len(verifier._verified) == 2
+    assert not verifier._is_cached(SignatureVerifier._cache_key(signed_transactions[0]))
+    assert verifier._is_cached(SignatureVerifier._cache_key(signed_transactions[2]))
+
+
+def test_verifier_can_be_shared_by_threads():
+    key = nacl.signing.SigningKey.generate()
+    transactions = [Transaction(None, address_of(key), coins) for coins in range(50)]
+    signed_transactions = [SignedTransaction(transaction, sign_transaction(key, transaction))
+                           for transaction in transactions]
+
+    # A small cache, so the threads keep evicting each other's entries
+    verifier = SignatureVerifier(max_workers=3, cache_size=10)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(verifier.verify_many, [signed_transactions[start:] for start in range(40)]))
+    verifier.close()
+
+    assert all(all(valid) and len(valid) == 50 - start for start, valid in enumerate(results))
+    assert len(verifier._verified) == 10
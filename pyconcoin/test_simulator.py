@@ -0,0 +1,64 @@
+import random
+
+from simulator import *
+
+
+def test_same_seed_same_report():
+    config = SimulationConfig(nodes=50, blocks=10, seed=7)
+    report = simulate(config)
+    assert report == simulate(SimulationConfig(nodes=50, blocks=10, seed=7))
+    assert report != simulate(SimulationConfig(nodes=50, blocks=10, seed=8))
+
+    assert report.blocks_mined == 10
+    assert report.nodes == 50
+    assert 0 < report.propagation['p50'] <= report.propagation['p90'] <= report.propagation['p100']
+    assert report.bytes_sent['block'] > 0
+
+
+def test_partition_forks_the_network_and_heals():
+    # Blocks every second, so both halves mine while they are cut off (from 5 to 25 seconds)
+    config = SimulationConfig(nodes=40, blocks=40, block_interval=1.0, seed=1,
+                              partitions=[Partition(5.0, 25.0, set(range(20)))])
+    simulation = Simulation(config)
+    report = simulation.run()
+
+    assert report.stale_blocks > 0
+    assert report.fork_rate == report.stale_blocks / 40
+    assert report.reorgs > 0
+    assert report.sync_bytes > 0
+    # The last blocks may still compete, but everyone agrees on the chain mined after the partition
+    tips = [node.get_blockchain() for node in simulation.nodes]
+    common = tips[0]
+    for tip in tips[1:]:
+        common = find_common_ancestor(common, tip)
+    assert simulation._mined_at[common.block_hash] > 25.0
+
+
+def test_catching_up_is_not_a_reorg():
+    # Only the other half mines while half of the nodes are cut off: they catch up by several blocks, undoing none
+    config = SimulationConfig(nodes=20, blocks=6, block_interval=30.0, degree=4, seed=2,
+                              hash_power=[0.0] * 10 + [1.0] * 10, partitions=[Partition(1.0, 100.0, set(range(10)))])
+    report = simulate(config)
+
+    assert report.sync_bytes > 0
+    assert report.stale_blocks == report.reorgs == 0
+
+
+def test_topologies_are_connected():
+    for name, topology in TOPOLOGIES.items():
+        neighbours = topology(30, 4, random.Random(0))
+        reached = {0}
+        waiting = [0]
+        while waiting:
+            for other in neighbours[waiting.pop()]:
+                if other not in reached:
+                    reached.add(other)
+                    waiting.append(other)
+        assert len(reached) == 30, name
+        assert all(node not in neighbours[node] and len(neighbours[node]) >= 2 for node in range(30)), name
+
+
+def test_percentiles():
+    assert percentiles(range(1, 101)) == {'p50': 50, 'p90': 90, 'p99': 99, 'p100': 100}
+    assert percentiles([3.0]) == {'p50': 3.0, 'p90': 3.0, 'p99': 3.0, 'p100': 3.0}
+    assert percentiles([]) == {}
@@ -0,0 +1,93 @@
+import os
+
+from blockchain import *
+from snapshot import *
+
+
+def chain_length(block):
+    # The number of blocks reachable from block
+    length = 0
+    while block is not None:
+        length += 1
+        block = block.previous_block
+    return length
+
+
+def test_snapshot_file_round_trip(tmp_path):
+    node_a = Node(coins=200)
+    for coins in range(1, 6):
+        node_a.transfer_coins(f"ADDRESS_{coins}", coins=coins)
+    snapshot = node_a.take_snapshot()
+    path = str(tmp_path / 'snapshot.dat')
+
+    snapshot.save(path)
+    loaded = Snapshot.load(path)
+
+    assert loaded == snapshot
+    assert loaded.block_hash == node_a.get_blockchain().block_hash
+    assert loaded.balances[node_a.address] == 185
+    assert os.path.getsize(path) < 300
+
+
+def test_node_starts_from_a_snapshot():
+    node_a = Node(coins=200)
+    for _ in range(20):
+        node_a.transfer_coins("NODE_B_ADDRESS", coins=1)
+    snapshot = Snapshot.decode(node_a.take_snapshot(height=10).encode())
+
+    node_c = Node(other_nodes=[node_a], snapshot=snapshot)
+    assert node_c.get_blockchain() == node_a.get_blockchain()
+    assert chain_length(node_c.get_blockchain()) == 11  # The snapshot's block and the 10 blocks after it
+    assert node_c.get_balance("NODE_B_ADDRESS") == 20
+    assert node_c.get_balance(node_a.address) == 180
+
+    node_a.transfer_coins("NODE_B_ADDRESS", coins=5)
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_balance("NODE_B_ADDRESS") == 25
+
+    # A blockchain that doesn't contain the snapshot's block can't be followed
+    node_d = Node(coins=10000)
+    for _ in range(30):
+        node_d.transfer_coins("NODE_B_ADDRESS", coins=1)
+    node_c.add_node(node_d)
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_blockchain() == node_a.get_blockchain()
+
+
+def test_pruned_node_keeps_balances_and_validates_new_blocks():
+    node_a = Node(coins=200, prune_depth=5)
+    node_b = Node(other_nodes=[node_a])
+    for i in range(30):
+        node_a.transfer_coins(node_b.address, coins=1)
+        node_b.pull_blockchains_from_other_nodes()
+        if i == 20:
+            node_c = Node(other_nodes=[node_b])
+
+    assert chain_length(node_a.get_blockchain()) <= 2 * 5
+    assert node_a.get_balance(node_b.address) == 30
+    assert node_a.get_balance(node_a.address) == 170
+    assert node_a.get_block_locator()[-1][0] > 0
+
+    # The other node got the same blocks, but still has all of them
+    assert node_b.get_blockchain() == node_a.get_blockchain()
+    assert chain_length(node_b.get_blockchain()) == 31
+    assert Node.calculate_balance(node_b.address, node_b.get_blockchain()) == 30
+
+    # A node that is too far behind can't catch up from a pruned node
+    node_c._other_nodes = [node_a]
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_blockchain().height == 21
+
+    node_b.transfer_coins(node_a.address, coins=10)
+    assert node_a.receive_block(node_b.get_blockchain())
+    assert node_a.get_balance(node_b.address) == 20
+
+
+def test_periodic_snapshots_are_saved(tmp_path):
+    node_a = Node(coins=200, snapshot_interval=5, snapshot_directory=str(tmp_path))
+    for _ in range(12):
+        node_a.transfer_coins("NODE_B_ADDRESS", coins=1)
+
+    assert node_a.last_snapshot.height == 10
+    assert sorted(os.listdir(tmp_path)) == ['snapshot-10.dat', 'snapshot-5.dat']
+    assert Snapshot.load(str(tmp_path / 'snapshot-5.dat')).balances["NODE_B_ADDRESS"] == 5
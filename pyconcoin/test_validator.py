@@ -0,0 +1,106 @@
+from blockchain import *
+from blockstore import BlockStore
+from validator import *
+
+
+def blocks_of(tip):
+    # The blocks of the chain, from the genesis
+    blocks = []
+    while tip is not None:
+        blocks.append(tip)
+        tip = tip.previous_block
+    return blocks[::-1]
+
+
+def create_chain(length):
+    node = Node(coins=1000, miner=Miner(difficulty=4))
+    for _ in range(length - 1):
+        node.transfer_coins("NODE_B_ADDRESS", coins=1)
+    return node
+
+
+def test_valid_chain_passes():
+    node = create_chain(20)
+
+    result = ChainValidator(batch_size=3).validate(blocks_of(node.get_blockchain()))
+    assert result.valid
+    assert result.blocks_checked == 20
+
+
+def test_validation_stops_at_the_first_invalid_block():
+    node = create_chain(10)
+    tip = node.get_blockchain()
+
+    # A transfer the sender can't pay for, with a valid signature and proof of work
+    overspend = node.create_block(node.sign(Transaction(node.address, "NODE_B_ADDRESS", 5000)), tip)
+    forged = node.create_block(SignedTransaction(Transaction(node.address, "NODE_B_ADDRESS", 1), b"signed"), tip)
+    unmined = Block(node.sign(Transaction(node.address, "NODE_B_ADDRESS", 1)), tip, magic_number=0, difficulty=64)
+    coinbase = node.create_block(node.sign(Transaction(None, node.address, 1)), tip)
+    text_coins = node.create_block(node.sign(Transaction(node.address, "NODE_B_ADDRESS", "1")), tip)
+    fractional = node.create_block(node.sign(Transaction(node.address, "NODE_B_ADDRESS", 0.5)), tip)
+    for block, reason in ((overspend, "The sender doesn't have enough coins"), (forged, "Invalid signature"),
+                          (unmined, "The block's hash doesn't meet its difficulty"),
+                          (coinbase, "Only the first block can create coins"),
+                          (text_coins, "Malformed transaction"), (fractional, "Malformed transaction")):
+        after = node.create_block(node.sign(Transaction(node.address, "NODE_B_ADDRESS", 1)), block)
+        result = ChainValidator(batch_size=4).validate(blocks_of(after))
+        assert (result.valid, result.invalid_height, result.blocks_checked, result.reason) == (False, 10, 10, reason)
+
+    # A block whose transactions were swapped after it was mined
+    tip.signed_transactions[0] = node.sign(Transaction(node.address, "NODE_B_ADDRESS", 2))
+    result = ChainValidator().validate(blocks_of(tip))
+    assert result.invalid_height == 9
+    assert result.reason == "The block's hash doesn't match its contents"
+
+
+def test_validate_from_a_fork_point_streams_from_a_block_store(tmp_path):
+    node = create_chain(30)
+    with BlockStore(str(tmp_path)) as store:
+        store.set_tip(node.get_blockchain())
+        store.flush()
+
+        fork_point = store.get(9)
+        with ChainValidator(processes=2, batch_size=4) as validator:
+            result = validator.validate((store.get(height) for height in range(10, len(store))), fork_point,
+                                        balance=lambda address: Node.calculate_balance(address, fork_point))
+        assert result.valid
+        assert result.blocks_checked == 20
+
+        # Without the balances before the fork point, the first transfer is an overspend
+        assert ChainValidator().validate([store.get(10)], fork_point).invalid_height == 10
+
+
+def test_pull_ignores_overspending_chains():
+    node_a = Node(coins=200)
+    node_b = Node(other_nodes=[node_a])
+    tip = node_a.get_blockchain()
+    node_a._set_last_block(node_a.create_block(node_a.sign(Transaction(node_a.address, node_b.address, 300)), tip))
+
+    node_b.pull_blockchains_from_other_nodes()
+    assert node_b.get_blockchain() is tip
+    assert not node_b.receive_block(node_a.get_blockchain())
+
+    # A new node checks the first blockchain it gets too
+    node_c = Node(other_nodes=[node_a])
+    assert node_c.get_blockchain() is None
+    node_c.add_node(node_b)
+    node_c.pull_blockchains_from_other_nodes()
+    assert node_c.get_blockchain() is tip
+
+
+def test_free_blocks_cant_outweigh_real_work():
+    # Difficulty 0 blocks cost nothing, but add 2 ** 0 to the total work: 20 of them beat one difficulty 4 block
+    node_a = Node(coins=200, miner=Miner(difficulty=4))
+    node_b = Node(other_nodes=[node_a], miner=Miner(difficulty=4))
+    node_a.transfer_coins("NODE_B_ADDRESS", coins=1)
+    cheap_node = Node(other_nodes=[node_b], miner=Miner(difficulty=0))
+    for _ in range(20):
+        cheap_node._set_last_block(cheap_node.create_block([], cheap_node.get_blockchain()))
+    assert cheap_node.get_blockchain().total_work > node_a.get_blockchain().total_work
+
+    result = ChainValidator(min_difficulty=4).validate(blocks_of(cheap_node.get_blockchain()))
+    assert (result.invalid_height, result.reason) == (1, "The block's difficulty is below the minimum")
+    node_b.add_node(cheap_node)
+    node_b.pull_blockchains_from_other_nodes()
+    assert node_b.get_blockchain() == node_a.get_blockchain()
+
@@ -0,0 +1,48 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from chain import TipIndex
+
+# A transaction's place in the chain: its block, and its position in the block
+Location = Tuple[object, int]
+
+
+class TransactionIndex(TipIndex):
+    """
+    Where every transaction of one chain tip is, by transaction digest and by address,
+    so a node can serve inclusion proofs without searching the chain.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._by_digest: Dict[bytes, Location] = {}
+        self._by_address: Dict[str, List[Location]] = defaultdict(list)
+
+    def find(self, digest: bytes) -> Optional[Location]:
+        return self._by_digest.get(digest)
+
+    def find_address(self, address) -> List[Location]:
+        # The transactions that send coins from or to address, oldest first
+        return list(self._by_address.get(address, []))
+
+    @staticmethod
+    def _addresses(transaction) -> set:
+        return {address for address in (transaction.from_address, transaction.to_address) if address is not None}
+
+    def apply_block(self, block) -> None:
+        for position, signed_transaction in enumerate(block.signed_transactions):
+            self._by_digest[signed_transaction.digest()] = (block, position)
+            for address in self._addresses(signed_transaction.transaction):
+                self._by_address[address].append((block, position))
+        self.tip = block
+
+    def undo_block(self, block) -> None:
+        # The block's locations are the last ones of every address it touches
+        for signed_transaction in reversed(block.signed_transactions):
+            self._by_digest.pop(signed_transaction.digest(), None)
+            for address in self._addresses(signed_transaction.transaction):
+                locations = self._by_address[address]
+                locations.pop()
+                if not locations:
+                    del self._by_address[address]
+        self.tip = block.previous_block
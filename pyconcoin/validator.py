@@ -0,0 +1,210 @@
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import REGISTRY
+from mining import NONCE_SIZE, meets_difficulty
+from signatures import SignatureVerifier, is_well_formed
+
+DEFAULT_BATCH_SIZE = 1024
+
+_blocks_validated = REGISTRY.counter('pyconcoin_blocks_validated_total', "Blocks found valid by ChainValidator")
+_invalid_chains = REGISTRY.counter('pyconcoin_invalid_chains_total', "Chains rejected by ChainValidator")
+
+
+@dataclass
+class ValidationResult:
+    valid: bool
+    blocks_checked: int  # The number of blocks that were found valid
+    invalid_height: Optional[int] = None
+    reason: Optional[str] = None
+
+    def __bool__(self) -> bool:
+        return self.valid
+
+
+def _block_fields(block) -> tuple:
+    # What a worker needs to rebuild the block's header: plain values, so they are cheap to send to another process
+    transactions = [(signed_transaction.transaction.from_address, signed_transaction.transaction.to_address,
+                     signed_transaction.transaction.coins, signed_transaction.transaction.salt,
+                     signed_transaction.signature)
+                    for signed_transaction in block.signed_transactions]
+    return block.previous_hash, block.timestamp, block.difficulty, block.magic_number, transactions
+
+
+def _block_hashes(blocks_fields: List[tuple]) -> List[bytes]:
+    # Runs in the pool workers: the hash of each block, recomputed from its transactions (through the Merkle root).
+    # blockchain imports this module, so it is imported here
+    from blockchain import Block, SignedTransaction, Transaction, transactions_digest
+
+    hashes = []
+    for previous_hash, timestamp, difficulty, magic_number, transactions in blocks_fields:
+        signed_transactions = [SignedTransaction(Transaction(from_address, to_address, coins, salt), signature)
+                               for from_address, to_address, coins, salt, signature in transactions]
+        header = (Block.header_prefix(previous_hash, transactions_digest(signed_transactions), timestamp, difficulty)
+                  + magic_number.to_bytes(NONCE_SIZE, 'big'))
+        hashes.append(hashlib.sha256(header).digest())
+    return hashes
+
+
+def _chunks(blocks: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(blocks)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ChainValidator:
+    """
+    Checks blocks before a node adopts them, in three stages:
+    1. every block's hash matches its contents, meets its difficulty, and links to the block before it
+       (the hashes are recomputed on a process pool). The difficulty can't be below min_difficulty:
+       otherwise blocks that cost nothing to make would still add to a chain's total work,
+    2. the transactions' signatures (in batches, see SignatureVerifier.verify_many),
+    3. no transaction is in the chain twice, and no sender spends more than they have
+       (a single pass over the transactions, in order).
+
+    Blocks are read from an iterable in chunks of batch_size, and only a few chunks are in memory at once,
+    so a whole chain can be streamed from a BlockStore. Validation stops at the first invalid block.
+    With processes=1 everything runs in the calling process.
+    """
+
+    def __init__(self, processes: Optional[int] = 1, batch_size: int = DEFAULT_BATCH_SIZE,
+                 signature_verifier: SignatureVerifier = None, min_difficulty: int = 0):
+        self.processes = processes or os.cpu_count() or 1
+        self.min_difficulty = min_difficulty
+        self.batch_size = batch_size
+        self._signature_verifier = signature_verifier if signature_verifier is not None else SignatureVerifier()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def validate(self, blocks: Iterable, fork_point=None, balance: Callable[[str], int] = None,
+                 is_confirmed: Callable[[bytes], bool] = None) -> ValidationResult:
+        """
+        blocks are the blocks after fork_point (None: from the genesis), oldest first.
+        balance(address) is the balance of address as of fork_point, and is_confirmed(digest) tells whether
+        a transaction is in the chain up to fork_point (e.g. TransactionIndex.find).
+        """
+        balance = balance if balance is not None else (lambda address: 0)
+        is_confirmed = is_confirmed if is_confirmed is not None else (lambda digest: False)
+        changed_balances = {}  # Only the balances the blocks change; the others come from balance()
+        digests = set()  # The transactions of the blocks checked so far
+        previous = fork_point
+        blocks_checked = 0
+
+        # Stage 1 of the next chunks runs on the pool while stages 2 and 3 of the current one run here
+        chunks = _chunks(blocks, self.batch_size)
+        in_flight: Deque[Tuple[list, object]] = deque()
+        try:
+            self._submit(chunks, in_flight)
+            while in_flight:
+                chunk, hashes = in_flight.popleft()
+                hashes = hashes.result() if self._pool is not None else _block_hashes(hashes)
+                self._submit(chunks, in_flight)
+
+                # Each stage only checks the blocks before the first invalid one found so far
+                invalid = self._check_headers(chunk, hashes, previous)
+                invalid = self._check_signatures(chunk if invalid is None else chunk[:invalid[0]]) or invalid
+                invalid = self._check_balances(chunk if invalid is None else chunk[:invalid[0]], balance,
+                                               changed_balances, is_confirmed, digests) or invalid
+                if invalid is not None:
+                    index, reason = invalid
+                    _blocks_validated.inc(index)
+                    _invalid_chains.inc()
+                    return ValidationResult(False, blocks_checked + index, chunk[index].height, reason)
+                blocks_checked += len(chunk)
+                _blocks_validated.inc(len(chunk))
+                previous = chunk[-1]
+        finally:
+            if self._pool is not None:
+                for _, future in in_flight:
+                    future.cancel()
+        return ValidationResult(True, blocks_checked)
+
+    def _submit(self, chunks: Iterator[list], in_flight: Deque[Tuple[list, object]]) -> None:
+        # Keep up to two chunks per process in flight (in the calling process: one, checked when it is needed)
+        if self.processes > 1 and self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        limit = 2 * self.processes if self._pool is not None else 1
+        while len(in_flight) < limit:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            fields = [_block_fields(block) for block in chunk]
+            in_flight.append((chunk, self._pool.submit(_block_hashes, fields) if self._pool is not None else fields))
+
+    def _check_headers(self, chunk: list, hashes: List[bytes], previous) -> Optional[Tuple[int, str]]:
+        for index, (block, block_hash) in enumerate(zip(chunk, hashes)):
+            if block_hash != block.block_hash:
+                return index, "The block's hash doesn't match its contents"
+            if block.difficulty < self.min_difficulty:
+                return index, "The block's difficulty is below the minimum"
+            if not meets_difficulty(block_hash, block.difficulty):
+                return index, "The block's hash doesn't meet its difficulty"
+            if previous is None:
+                if block.height != 0 or block.total_work != 2 ** block.difficulty:
+                    return index, "Wrong height or total work"
+            elif (block.previous_hash != previous.block_hash or block.height != previous.height + 1
+                    or block.total_work != previous.total_work + 2 ** block.difficulty):
+                return index, "The block doesn't follow the previous block"
+            previous = block
+        return None
+
+    def _check_signatures(self, chunk: list) -> Optional[Tuple[int, str]]:
+        signed_transactions = [signed_transaction for block in chunk for signed_transaction in block.signed_transactions]
+        valid = self._signature_verifier.verify_many(signed_transactions)
+        if all(valid):
+            return None
+        first_invalid = valid.index(False)
+        for index, block in enumerate(chunk):
+            first_invalid -= len(block.signed_transactions)
+            if first_invalid < 0:
+                return index, "Invalid signature"
+        return None
+
+    @staticmethod
+    def _check_balances(chunk: list, balance: Callable[[str], int], changed_balances: dict,
+                        is_confirmed: Callable[[bytes], bool], digests: set) -> Optional[Tuple[int, str]]:
+        for index, block in enumerate(chunk):
+            for signed_transaction in block.signed_transactions:
+                # A transfer that was already confirmed can't be replayed to pay twice
+                digest = signed_transaction.digest()
+                if digest in digests or is_confirmed(digest):
+                    return index, "The transaction is already in the chain"
+                digests.add(digest)
+
+                transaction = signed_transaction.transaction
+                if not is_well_formed(transaction):
+                    return index, "Malformed transaction"
+                if transaction.coins < 0:
+                    return index, "Negative transfer"
+                if transaction.from_address is None:
+                    if block.height != 0:
+                        return index, "Only the first block can create coins"
+                else:
+                    sender = transaction.from_address
+                    sender_balance = changed_balances[sender] if sender in changed_balances else balance(sender)
+                    # Like make_transaction, the sender has to keep more than they send
+                    if sender_balance <= transaction.coins:
+                        return index, "The sender doesn't have enough coins"
+                    changed_balances[sender] = sender_balance - transaction.coins
+                receiver = transaction.to_address
+                receiver_balance = changed_balances[receiver] if receiver in changed_balances else balance(receiver)
+                changed_balances[receiver] = receiver_balance + transaction.coins
+        return None
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self) -> 'ChainValidator':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()